@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+""" file:   import_time.py (benchmarks)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+
+    description: Benchmark the time taken to import pysiss modules in a fresh
+    interpreter.
+
+    Each module is imported in a new Python process (so nothing is cached in
+    sys.modules), and we report the best and median wall-clock import times,
+    along with whether the import dragged in pkg_resources.
+
+    Usage:
+
+        python benchmarks/import_time.py [module ...] [--repeat N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Script run in the child interpreter, prints import time and whether
+# pkg_resources was imported
+_CHILD = """
+import sys, time
+start = time.time()
+import {module}
+print('{{0}} {{1}}'.format(time.time() - start,
+                           int('pkg_resources' in sys.modules)))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ['pysiss.vocabulary.namespaces',
+                   'pysiss.vocabulary.unmarshal',
+                   'pysiss.metadata',
+                   'pysiss']
+
+
+def time_import(module, repeat=10):
+    """ Import a module in `repeat` fresh interpreters
+
+        :returns: a list of import times in seconds, and whether
+            pkg_resources was imported.
+    """
+    times, uses_pkg_resources = [], False
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', _CHILD.format(module=module)], cwd=ROOT)
+        elapsed, flag = output.split()
+        times.append(float(elapsed))
+        uses_pkg_resources = uses_pkg_resources or bool(int(flag))
+    return times, uses_pkg_resources
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    row = '{0:<35} {1:>10} {2:>10} {3:>15}'
+    print(row.format('module', 'best (ms)', 'median (ms)', 'pkg_resources'))
+    for module in args.modules:
+        times, uses_pkg_resources = time_import(module, args.repeat)
+        times.sort()
+        print(row.format(module,
+                         '{0:.1f}'.format(1e3 * times[0]),
+                         '{0:.1f}'.format(1e3 * times[len(times) // 2]),
+                         'yes' if uses_pkg_resources else 'no'))
+
+
+if __name__ == '__main__':
+    main()
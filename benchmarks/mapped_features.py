@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+""" file:   mapped_features.py (benchmarks)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+
+    description: Benchmark the time and memory needed to construct
+    MappedFeatures.
+
+    We build a set of random polygons, then time constructing a
+    MappedFeature for each one, both on its own and with the derived
+    attributes (centroid, UUID and type) forced afterwards. Memory is
+    reported as the size of each feature object (including any instance
+    dictionary), not counting the shapely geometry that it wraps.
+
+    Usage:
+
+        python benchmarks/mapped_features.py [--number N] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pysiss.coverage import MappedFeature
+from pysiss.metadata import Metadata
+from shapely.geometry import box
+import numpy
+
+RECORD = (b'<gsml:GeologicUnit xmlns:gsml="urn:cgi:xmlns:CGI:GeoSciML:2.0" '
+          b'xmlns:gml="http://www.opengis.net/gml" gml:id="gu.benchmark"/>')
+
+
+def make_shapes(number, seed=42):
+    """ Generate some random boxes
+    """
+    rng = numpy.random.RandomState(seed)
+    corners = rng.uniform(0, 100, size=(number, 2))
+    return [box(x, y, x + 1, y + 1) for x, y in corners]
+
+
+def construct(shapes, force=False):
+    """ Construct a MappedFeature for each shape, optionally forcing the
+        derived attributes
+    """
+    features = [MappedFeature(shape=shape, projection='EPSG:4326',
+                              specification='gu.benchmark',
+                              ident='mf.{0}'.format(idx))
+                for idx, shape in enumerate(shapes)]
+    if force:
+        for feature in features:
+            feature.centroid, feature.uuid, feature.type
+    return features
+
+
+def feature_size(feature):
+    """ Return the size of a feature object in bytes
+
+        Slotted features only create an instance dictionary when something
+        is stored in it, so empty dictionaries aren't counted.
+    """
+    size = sys.getsizeof(feature)
+    if getattr(feature, '__dict__', None):
+        size += sys.getsizeof(feature.__dict__)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--number', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    Metadata(ident='gu.benchmark', tree=RECORD, type='gsml:GeologicUnit')
+    shapes = make_shapes(args.number)
+
+    row = '{0:<30} {1:>15}'
+    print(row.format('construction', 'best (us/feature)'))
+    for label, force in (('lazy', False), ('derived attributes forced', True)):
+        best = min(timeit.repeat(lambda: construct(shapes, force),
+                                 number=1, repeat=args.repeat))
+        print(row.format(label, '{0:.2f}'.format(1e6 * best / args.number)))
+
+    features = construct(shapes[:1000])
+    print(row.format('object size (bytes/feature)',
+                     '{0:.0f}'.format(numpy.mean(map(feature_size,
+                                                     features)))))
+
+
+if __name__ == '__main__':
+    main()
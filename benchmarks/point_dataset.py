@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+""" file:   point_dataset.py (benchmarks)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+
+    description: Benchmark nearest-neighbour regularization of
+    PointDataSets.
+
+    We build datasets with irregular sample spacing (like NVCL scans) and
+    time `PointDataSet.regularize` with nearest-neighbour interpolation. For
+    comparison we also time the old kernel, which built the full matrix of
+    squared distances between the old and new depths - that needs N * M
+    floats of memory, so it's only run for the smaller datasets and its
+    memory requirement is reported for the rest.
+
+    Usage:
+
+        python benchmarks/point_dataset.py [--sizes N N ...] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pysiss import borehole as pybh
+import numpy
+
+DENSITY = pybh.PropertyType('density')
+
+# Largest dataset to run the brute force kernel on
+BRUTE_FORCE_LIMIT = 20000
+
+
+def make_dataset(number, seed=42):
+    """ Generate a dataset with irregularly spaced samples
+    """
+    rng = numpy.random.RandomState(seed)
+    depths = numpy.cumsum(rng.uniform(0.005, 0.015, number))
+    dataset = pybh.PointDataSet('benchmark', depths)
+    dataset.add_property(DENSITY, rng.normal(2.7, 0.1, number))
+    dataset.split_at_gaps()
+    return dataset
+
+
+def brute_force(depths, new_depths):
+    """ The old nearest neighbour kernel
+    """
+    return numpy.argmin(
+        numpy.asarray([(depths - new_depths[:, numpy.newaxis]) ** 2]),
+        axis=-1)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    row = '{0:>10} {1:>18} {2:>18} {3:>22}'
+    print(row.format('samples', 'regularize (s)', 'old kernel (s)',
+                     'old kernel memory (MB)'))
+    for number in args.sizes:
+        dataset = make_dataset(number)
+        best = min(timeit.repeat(
+            lambda: dataset.regularize(fill_method='interpolate'),
+            number=1, repeat=args.repeat))
+
+        # The old kernel, for the same new depths as regularize uses
+        new_depths = dataset.regularize(fill_method='interpolate').depths
+        memory = 8. * len(dataset.depths) * len(new_depths) / 2 ** 20
+        if number <= BRUTE_FORCE_LIMIT:
+            old = '{0:.4f}'.format(min(timeit.repeat(
+                lambda: brute_force(dataset.depths, new_depths),
+                number=1, repeat=args.repeat)))
+        else:
+            old = 'skipped'
+        print(row.format(number, '{0:.4f}'.format(best), old,
+                         '{0:.0f}'.format(memory)))
+
+
+if __name__ == '__main__':
+    main()
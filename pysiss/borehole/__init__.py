@@ -10,11 +10,13 @@
 from .borehole import Borehole, Feature
 from .datasets import DataSet, PointDataSet, IntervalDataSet
 from .properties import Property, PropertyType
+from .store import BoreholeStore, LazyBoreholeCollection
 from pysiss.borehole.siss.borehole_generator import SISSBoreholeGenerator
 from . import plotting, analysis
 
 __all__ = [Borehole, Feature,
            DataSet, PointDataSet, IntervalDataSet,
            Property, PropertyType,
+           BoreholeStore, LazyBoreholeCollection,
            SISSBoreholeGenerator,
            plotting, analysis]
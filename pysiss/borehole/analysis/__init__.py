@@ -9,4 +9,5 @@
 """
 
 from .regularizer import ReSampler, unique
-from .detrend import detrend, demean
\ No newline at end of file
+from .detrend import detrend, demean
+from .stacking import stack_boreholes, DepthStack
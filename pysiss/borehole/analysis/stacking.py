@@ -0,0 +1,114 @@
+""" file:   stacking.py (pysiss.borehole.analysis)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Monday 15 September, 2014
+
+    description: Stack borehole data onto a common depth grid
+
+    To compare boreholes we want all their properties at the same depths.
+    Rather than resampling each PointDataSet into a new PointDataSet and
+    gluing the results together, here we resample every hole straight into
+    one preallocated (borehole, depth, property) array. All the properties
+    from a dataset are interpolated in one pass with
+    `PointDataSet.interpolate_properties`, and gaps are found with
+    `PointDataSet.label_gaps`, so stacked values match resampled ones.
+"""
+
+from collections import namedtuple
+import numpy
+
+DepthStack = namedtuple('DepthStack', 'names depths properties values mask')
+
+
+def stack_boreholes(boreholes, properties, depths, dataset_name=None,
+                    degree=0, mask_gaps=True):
+    """ Resample properties from a set of boreholes onto a common depth grid
+
+            stack = stack_boreholes(boreholes, ['Fe', 'Si'],
+                                    numpy.arange(0, 500, 0.5))
+            stack.values[:, :, 0]  # Fe for every hole and depth
+
+        Values are NaN (and the mask is False) where a borehole doesn't have a
+        property, where the grid is outside the depth range of the dataset
+        holding a property, and, if `mask_gaps` is True, where the grid falls
+        in a gap found by `PointDataSet.split_at_gaps` (including the gap's
+        end points, see `PointDataSet.label_gaps`).
+
+        :param boreholes: The boreholes to stack
+        :type boreholes: pysiss.utilities.Collection of Boreholes
+        :param properties: The names of the properties to stack
+        :type properties: list of strings
+        :param depths: The depth grid, in increasing order
+        :type depths: numpy.ndarray
+        :param dataset_name: The name of the point dataset to take the
+            properties from. Optional, if not given each property is taken
+            from the first dataset (in order of name) which has it.
+        :type dataset_name: string
+        :param degree: The degree of the interpolation - 0 for nearest
+            neighbour or 1 for linear. Optional, defaults to 0.
+        :type degree: int
+        :param mask_gaps: Whether to mask the grid in gaps between samples.
+            Optional, defaults to True.
+        :type mask_gaps: bool
+        :returns: a DepthStack namedtuple with the borehole `names`, the
+            `depths` and `properties`, the (borehole, depth, property) array
+            of `values`, and a boolean `mask` of the same shape which is True
+            where there are values
+    """
+    if degree not in (0, 1):
+        raise ValueError('Only degree 0 (nearest neighbour) or 1 (linear) '
+                         'interpolation is supported, not {0}'.format(degree))
+    depths = numpy.asarray(depths, dtype=float)
+    properties = list(properties)
+    values = numpy.empty((len(boreholes), len(depths), len(properties)))
+    values.fill(numpy.nan)
+    names = []
+    for idx, borehole in enumerate(boreholes):
+        names.append(borehole.name)
+        for dataset, columns in _datasets(borehole, properties,
+                                          dataset_name):
+            values[idx][:, columns] = _resample_dataset(
+                dataset, [properties[col] for col in columns], depths,
+                degree, mask_gaps)
+    return DepthStack(names=names, depths=depths, properties=properties,
+                      values=values, mask=~numpy.isnan(values))
+
+
+def _datasets(borehole, properties, dataset_name=None):
+    """ Work out which dataset to take each property from
+
+        :returns: a list of (dataset, property indices) pairs
+    """
+    if dataset_name is not None:
+        dataset = borehole.point_datasets.get(dataset_name)
+        datasets = [dataset] if dataset is not None else []
+    else:
+        datasets = [borehole.point_datasets[name]
+                    for name in sorted(borehole.point_datasets.keys())]
+    result = []
+    remaining = set(range(len(properties)))
+    for dataset in datasets:
+        columns = [col for col in sorted(remaining)
+                   if properties[col] in dataset.properties
+                   and dataset.properties[properties[col]]
+                   .property_type.isnumeric is not False]
+        if columns:
+            result.append((dataset, columns))
+            remaining.difference_update(columns)
+    return result
+
+
+def _resample_dataset(dataset, properties, depths, degree, mask_gaps):
+    """ Resample properties from one dataset onto the grid
+
+        :returns: a (depth, property) array of values
+    """
+    _, result = dataset.interpolate_properties(depths, degree,
+                                               names=properties)
+
+    # Mask depths outside the dataset, and in gaps if required
+    outside = (depths < dataset.depths[0]) | (depths > dataset.depths[-1])
+    if mask_gaps and dataset.gaps:
+        outside |= dataset.label_gaps(depths)[1]
+    result[outside] = numpy.nan
+    return result
@@ -8,11 +8,21 @@
 """
 
 from .dataset import DataSet
+from ...utilities import interpolate_columns
 
 import numpy
 from scipy.interpolate import InterpolatedUnivariateSpline as Spline
 import pandas
 
+try:
+    from scipy.interpolate import make_interp_spline
+except ImportError:
+    make_interp_spline = None
+
+# Methods for filling gaps when resampling
+FILL_METHODS = ('interpolate', 'mean', 'median', 'local mean',
+                'local median')
+
 
 class PointDataSet(DataSet):
 
@@ -37,7 +47,7 @@ class PointDataSet(DataSet):
         super(PointDataSet, self).__init__(
             name, len(depths), details=details)
         depths = numpy.asarray(depths)
-        assert all(numpy.gradient(depths) > 0), \
+        assert (numpy.gradient(depths) > 0).all(), \
             "depths must be monotonically increasing"
         self.depths = depths
 
@@ -47,27 +57,152 @@ class PointDataSet(DataSet):
         return info.format(self.name, len(self.depths),
                            len(self.properties))
 
-    def get_interval(self, from_depth, to_depth, dataset_name=None):
+    def get_interval(self, from_depth, to_depth, dataset_name=None,
+                     copy=False):
         """ Return the data between the given depths as as new PointDataSet
+
+            By default the depths and property values of the new dataset are
+            views onto this dataset's arrays, so taking an interval doesn't
+            copy any data (and changes to the values in one dataset show up
+            in the other). Property values stored as lists are always copied.
+
+            :param from_depth: The start of the interval
+            :type from_depth: float
+            :param to_depth: The end of the interval
+            :type to_depth: float
+            :param dataset_name: The name for the new dataset. Optional,
+                defaults to "<current_name>: subdataset <from> to <to>".
+            :type dataset_name: string
+            :param copy: Whether to copy the data into the new dataset.
+                Optional, defaults to False.
+            :type copy: bool
         """
         # Specify a name if not already passed
         if dataset_name is None:
             dataset_name = '{0}: subdataset {1} to {2}'.format(
                 self.name, from_depth, to_depth)
 
-        # Generate a new PointDataSet
-        indices = self.get_interval_indices(from_depth, to_depth)
-        newdom = PointDataSet(dataset_name, self.depths[indices])
+        # Generate a new PointDataSet - our depths are already known to be
+        # sorted so we don't need to check them again
+        interval = self.get_interval_indices(from_depth, to_depth)
+        depths = self.depths[interval]
+        if copy:
+            depths = depths.copy()
+        newdom = PointDataSet._from_sorted(dataset_name, depths)
         for prop in self.properties.values():
-            newdom.add_property(prop.property_type, prop.values[indices])
+            values = prop.values[interval]
+            if copy and isinstance(values, numpy.ndarray):
+                values = values.copy()
+            newdom.add_property(prop.property_type, values)
         return newdom
 
     def get_interval_indices(self, from_depth, to_depth):
         """ Returns the indices for the depths in the given interval
+
+            Depths are sorted, so this is a binary search for each end of the
+            interval.
+
+            :returns: a slice object which selects the depths between
+                from_depth and to_depth (inclusive)
+        """
+        return slice(
+            int(numpy.searchsorted(self.depths, from_depth, side='left')),
+            int(numpy.searchsorted(self.depths, to_depth, side='right')))
+
+    @classmethod
+    def _from_sorted(cls, name, depths, details=None):
+        """ Make a new dataset from depths which are known to be sorted,
+            without checking them
+        """
+        newdom = cls.__new__(cls)
+        DataSet.__init__(newdom, name, len(depths), details=details)
+        newdom.depths = depths
+        return newdom
+
+    def interpolate_properties(self, new_depths, degree=0, names=None):
+        """ Interpolate all the numeric properties onto a new set of depths
+
+            Rather than fitting each property separately, the properties are
+            stacked into one (depth, property) array. Nearest neighbours
+            only need to be found once, and for polynomial interpolation a
+            single spline basis is built over the depths and evaluated for
+            every property at once, so interpolating dozens of properties
+            costs about the same as interpolating one. Gaps aren't filled.
+
+            :param new_depths: The depths to interpolate to, in increasing
+                order
+            :type new_depths: numpy.ndarray
+            :param degree: The degree of the interpolation. Values > 0 denote
+                spline interpolation, a value of 0 uses nearest-neighbour
+                interpolation. Optional, defaults to 0.
+            :type degree: int
+            :param names: The names of the properties to interpolate.
+                Optional, defaults to None (i.e. all the numeric
+                properties).
+            :type names: list of strings
+            :returns: a list of the interpolated Properties, and an array of
+                the new values with a column for each property
+        """
+        new_depths = numpy.asarray(new_depths)
+        props, values = self._numeric_properties(names)
+        return props, self._interpolate(values, new_depths, degree)
+
+    def _numeric_properties(self, names=None):
+        """ Stack the numeric properties into one array
+
+            :param names: The names of the properties to stack. Optional,
+                defaults to None (i.e. all the properties).
+            :returns: a list of the numeric Properties, and an array of their
+                values with a column for each property
+        """
+        props = []
+        if names is None:
+            candidates = self.properties.values()
+        else:
+            candidates = [self.properties[name] for name in names]
+        for prop in candidates:
+            if prop.property_type.isnumeric is False:
+                # We can't interpolate non-numeric data
+                print ("Property {0} in dataset {1} is not numeric so I'm "
+                       "skipping it. If this is a suprise to you, maybe you "
+                       "should check whether you've correctly set the "
+                       "is_numeric flag in the PropertyType class for this "
+                       "property."
+                       ).format(prop.property_type.name, self.name)
+                continue
+            props.append(prop)
+        if not props:
+            return props, numpy.empty((len(self.depths), 0))
+        return props, numpy.column_stack([
+            numpy.asarray(prop.values, dtype=float) for prop in props])
+
+    def _interpolate(self, values, new_depths, degree):
+        """ Interpolate stacked property values onto new depths
         """
-        return numpy.where(
-            numpy.logical_and(self.depths >= from_depth,
-                              self.depths <= to_depth))[0]
+        if not values.shape[1]:
+            return numpy.empty((len(new_depths), 0))
+
+        # Nearest neighbours and linear interpolation only need each new
+        # depth to be located among the samples once (depths are sorted, so
+        # this is a binary search). A linear spline is the same as linear
+        # interpolation, extrapolating from the end segments. Higher degrees
+        # fit a spline.
+        if degree <= 1:
+            return interpolate_columns(self.depths, values, new_depths,
+                                       degree, extrapolate=True)
+        spline = None
+        if make_interp_spline is not None:
+            try:
+                spline = make_interp_spline(self.depths, values, k=degree)
+            except ValueError:
+                pass
+        if spline is None:
+            # Older scipys don't have make_interp_spline, and it can't do
+            # even degrees above 2, so fit the properties one by one
+            return numpy.column_stack([
+                Spline(self.depths, column, k=degree)(new_depths)
+                for column in values.T])
+        return spline(new_depths)
 
     def split_at_gaps(self, gap_metric='spacing_median', threshold=10):
         """ Split a dataset by finding significant gaps in the dataset.
@@ -118,6 +253,27 @@ class PointDataSet(DataSet):
             self.subdatasets.append((from_depth, to_depth))
         return self.subdatasets, self.gaps
 
+    def label_gaps(self, depths):
+        """ Find the gap (from `split_at_gaps`) that each of a set of depths
+            falls in
+
+            Gaps include their end points, i.e. a depth is in gap i if
+            gaps[i][0] <= depth <= gaps[i][1]. This is the rule used
+            everywhere gaps are filled or masked.
+
+            :param depths: The depths to label, in increasing order
+            :type depths: numpy.ndarray
+            :returns: an array with the index of the last gap starting at or
+                before each depth (-1 if there isn't one), and a boolean
+                array which is True where the depth is in that gap
+        """
+        depths = numpy.asarray(depths, dtype=float)
+        gaps = numpy.asarray(self.gaps or [], dtype=float).reshape(-1, 2)
+        gap_idx = numpy.searchsorted(gaps[:, 0], depths, side='right') - 1
+        in_gap = gap_idx >= 0
+        in_gap[in_gap] = depths[in_gap] <= gaps[gap_idx[in_gap], 1]
+        return gap_idx, in_gap
+
     def regularize(self, npoints=None, dataset_name=None, fill_method='median',
                    degree=0):
         """ Resample dataset onto regular grid.
@@ -152,93 +308,11 @@ class PointDataSet(DataSet):
             dataset_name = '{0} resampled'.format(self.name)
         if npoints is None:
             spacing = float(numpy.median(numpy.diff(self.depths)))
-            npoints = abs(self.depths[-1] - self.depths[0]) / spacing
+            npoints = int(abs(self.depths[-1] - self.depths[0]) / spacing)
 
         # Generate a new DataSet with the resampled data
         new_depths = numpy.linspace(self.depths[0], self.depths[-1], npoints)
-        newdom = PointDataSet(dataset_name, new_depths)
-
-        # If we're doing nearest neighbours then we only need to work out the
-        # interpolation once
-        if degree == 0:
-            # This line generates a set of indices which will reconstruct a
-            # new signal using nearest neighbours, just do:
-            # property.values[interp_indices]
-            interp_indices = numpy.argmin(
-                numpy.asarray([
-                    (self.depths - new_depths[:, numpy.newaxis]) ** 2]),
-                axis=-1)[0]
-
-        # Get gap indices etc and store for faster lookup
-        if fill_method in ['mean', 'median', 'local mean', 'local median']:
-            # These methods need gap indices
-            gap_idxs = [newdom.get_interval_indices(*gap) for gap in self.gaps]
-        if fill_method in ['local mean', 'local median']:
-            # These methods need subdataset indices from the old dataset
-            sdom_idxs = [self.get_interval_indices(*sdom)
-                         for sdom in self.subdatasets]
-
-        # Resample properties
-        for prop in self.properties.values():
-            if prop.property_type.isnumeric is False:
-                # We can't interpolate non-numeric data
-                print ("Property {0} in dataset {1} is not numeric so I'm "
-                       "skipping it. If this is a suprise to you, maybe you "
-                       "should check whether you've correctly set the "
-                       "is_numeric flag in the PropertyType class for this "
-                       "property."
-                       ).format(prop.property_type.name, self.name)
-                continue
-
-            # Generate spline fit if required, else use nearest-neighbours
-            if degree == 0:
-                new_values = prop.values[interp_indices]
-            else:
-                spl = Spline(self.depths, prop.values, k=degree)
-                new_values = spl(new_depths)
-
-            # Deal with gaps
-            if fill_method == 'interpolate':
-                # We've already generated an interpolated value, so move on
-                # This option is here for error checking purposes
-                pass
-
-            elif fill_method == 'mean':
-                # Mean value in gaps, poly interp otherwise
-                meanval = prop.values.mean()
-                for gidx in gap_idxs:
-                    new_values[gidx] = meanval
-
-            elif fill_method == 'median':
-                # Median value in gaps
-                medval = numpy.median(prop.values)
-                for gidx in gap_idxs:
-                    new_values[gidx] = medval
-
-            elif fill_method == 'local mean':
-                # local mean value in gaps
-                smeans = [prop.values[s].mean() for s in sdom_idxs]
-                for sma, gidx, smb in zip(smeans[:-1], gap_idxs, smeans[1:]):
-                    new_values[gidx] = (sma + smb) / 2.
-
-            elif fill_method == 'local median':
-                # local median value in gaps
-                gap_neighbours = zip(sdom_idxs[:-1], gap_idxs, sdom_idxs[1:])
-                for sidxa, gidx, sidxb in gap_neighbours:
-                    new_values[gidx] = numpy.median(numpy.concatenate(
-                        prop.values[sidxa],
-                        prop.values[sidxb]))
-
-            else:
-                raise NotImplementedError
-
-            # Push back to new dataset
-            newdom.add_property(prop.property_type, new_values)
-
-        # Copy over gaps and subdatasets
-        newdom.gaps = self.gaps
-        newdom.subdatasets = self.subdatasets
-        return newdom
+        return self._resample(new_depths, dataset_name, fill_method, degree)
 
     def resample(self, new_depths, dataset_name=None, fill_method='median',
                  degree=0):
@@ -270,83 +344,24 @@ class PointDataSet(DataSet):
             dataset_name = '{0} resampled'.format(self.name)
 
         # Generate a new DataSet with the resampled data
-        newdom = PointDataSet(dataset_name, new_depths)
+        return self._resample(numpy.asarray(new_depths), dataset_name,
+                              fill_method, degree)
 
-        # If we're doing nearest neighbours then we only need to work out the
-        # interpolation once
-        if degree == 0:
-            # This line generates a set of indices which will reconstruct a
-            # new signal using nearest neighbours, just do:
-            # property.values[interp_indices]
-            interp_indices = numpy.argmin(
-                numpy.asarray([
-                    (self.depths - new_depths[:, numpy.newaxis]) ** 2]),
-                axis=-1)[0]
-
-        # Get gap indices etc and store for faster lookup
-        if fill_method in ['mean', 'median', 'local mean', 'local median']:
-            # These methods need gap indices
-            gap_idxs = [newdom.get_interval_indices(*gap) for gap in self.gaps]
-        if fill_method in ['local mean', 'local median']:
-            # These methods need subdataset indices from the old dataset
-            sdom_idxs = [self.get_interval_indices(*sdom)
-                         for sdom in self.subdatasets]
-
-        # Resample properties
-        for prop in self.properties.values():
-            if prop.property_type.isnumeric is False:
-                # We can't interpolate non-numeric data
-                print ("Property {0} in dataset {1} is not numeric so I'm "
-                       "skipping it. If this is a suprise to you, maybe you "
-                       "should check whether you've correctly set the "
-                       "is_numeric flag in the PropertyType class for this "
-                       "property."
-                       ).format(prop.property_type.name, self.name)
-                continue
-
-            # Generate spline fit if required, else use nearest-neighbours
-            if degree == 0:
-                new_values = prop.values[interp_indices]
-            else:
-                spl = Spline(self.depths, prop.values, k=degree)
-                new_values = spl(new_depths)
-
-            # Deal with gaps
-            if fill_method == 'interpolate':
-                # We've already generated an interpolated value, so move on
-                # This option is here for error checking purposes
-                pass
-
-            elif fill_method == 'mean':
-                # Mean value in gaps, poly interp otherwise
-                meanval = prop.values.mean()
-                for gidx in gap_idxs:
-                    new_values[gidx] = meanval
-
-            elif fill_method == 'median':
-                # Median value in gaps
-                medval = numpy.median(prop.values)
-                for gidx in gap_idxs:
-                    new_values[gidx] = medval
-
-            elif fill_method == 'local mean':
-                # local mean value in gaps
-                smeans = [prop.values[s].mean() for s in sdom_idxs]
-                for sma, gidx, smb in zip(smeans[:-1], gap_idxs, smeans[1:]):
-                    new_values[gidx] = (sma + smb) / 2.
-
-            elif fill_method == 'local median':
-                # local median value in gaps
-                gap_neighbours = zip(sdom_idxs[:-1], gap_idxs, sdom_idxs[1:])
-                for sidxa, gidx, sidxb in gap_neighbours:
-                    new_values[gidx] = numpy.median(numpy.concatenate(
-                        prop.values[sidxa],
-                        prop.values[sidxb]))
-
-            else:
-                raise NotImplementedError
+    def _resample(self, new_depths, dataset_name, fill_method, degree):
+        """ Resample all the properties onto new depths and fill the gaps
+        """
+        if fill_method not in FILL_METHODS:
+            raise NotImplementedError(
+                'Unknown fill method {0}, expected one of {1}'.format(
+                    fill_method, FILL_METHODS))
+        newdom = PointDataSet(dataset_name, new_depths)
 
-            # Push back to new dataset
+        # Resample and fill all the properties at once
+        props, values = self._numeric_properties()
+        resampled = self._interpolate(values, new_depths, degree)
+        self._fill_gaps(values, new_depths, resampled, fill_method)
+        for prop, new_values in zip(props,
+                                    numpy.ascontiguousarray(resampled.T)):
             newdom.add_property(prop.property_type, new_values)
 
         # Copy over gaps and subdatasets
@@ -354,6 +369,80 @@ class PointDataSet(DataSet):
         newdom.subdatasets = self.subdatasets
         return newdom
 
+    def _fill_gaps(self, values, new_depths, resampled, fill_method):
+        """ Fill the gaps in resampled data, in place
+
+            Rather than dealing with each gap and property separately, every
+            new depth is labelled with the gap it falls in (if any) in one
+            binary search, the statistics for every subdataset and property
+            are calculated with grouped reductions, and then the fill values
+            are assigned for all the gaps at once.
+
+            :param values: The original values, with a column for each
+                property
+            :type values: numpy.ndarray
+            :param new_depths: The new depths, in increasing order
+            :type new_depths: numpy.ndarray
+            :param resampled: The resampled values at the new depths, with a
+                column for each property
+            :type resampled: numpy.ndarray
+            :param fill_method: One of FILL_METHODS
+            :type fill_method: string
+        """
+        if fill_method == 'interpolate' or not self.gaps \
+                or not values.shape[1]:
+            # We've already generated an interpolated value, so move on
+            return
+
+        # Label the new depths with the gap they fall in
+        gap_idx, in_gap = self.label_gaps(new_depths)
+        ngaps = len(self.gaps)
+
+        if fill_method == 'mean':
+            # Mean value in gaps
+            resampled[in_gap] = values.mean(axis=0)
+            return
+        elif fill_method == 'median':
+            # Median value in gaps
+            resampled[in_gap] = numpy.median(values, axis=0)
+            return
+
+        # The local methods use the subdatasets on either side of each gap,
+        # which are contiguous ranges of the original samples
+        subdatasets = numpy.asarray(self.subdatasets,
+                                    dtype=float).reshape(-1, 2)
+        starts = numpy.searchsorted(self.depths, subdatasets[:, 0],
+                                    side='left')
+        stops = numpy.maximum(
+            numpy.searchsorted(self.depths, subdatasets[:, 1], side='right'),
+            starts)
+        ngaps = min(ngaps, len(subdatasets) - 1)
+        in_gap &= gap_idx < ngaps
+        if ngaps <= 0:
+            return
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            if fill_method == 'local mean':
+                # Mean of the means of the subdatasets either side. The sums
+                # are reduced over each subdataset separately so that a NaN
+                # only affects the subdataset it is in. A zero row is added
+                # so that every bound is a valid index for reduceat.
+                padded = numpy.vstack([values, numpy.zeros(values.shape[1])])
+                bounds = numpy.column_stack([starts, stops]).ravel()
+                sums = numpy.add.reduceat(padded, bounds, axis=0)[::2]
+                sums[stops == starts] = 0
+                means = sums / (stops - starts)[:, numpy.newaxis]
+                fills = (means[:ngaps] + means[1:ngaps + 1]) / 2.
+            else:
+                # Median of the values in the subdatasets either side
+                fills = _grouped_medians(
+                    values,
+                    numpy.column_stack([starts[:ngaps],
+                                        starts[1:ngaps + 1]]).ravel(),
+                    numpy.column_stack([stops[:ngaps],
+                                        stops[1:ngaps + 1]]).ravel())
+        resampled[in_gap] = fills[gap_idx[in_gap]]
+
     def to_dataframe(self):
         """ Tranform the data in the dataset into a Pandas dataframe.
         """
@@ -361,3 +450,50 @@ class PointDataSet(DataSet):
             data=dict(((k, self.properties[k].values)
                        for k in self.properties.keys())),
             index=self.depths)
+
+
+def _grouped_medians(values, starts, stops):
+    """ Find the median of each column over groups of rows
+
+        Each group is made up of pairs of ranges of rows, so group i covers
+        rows starts[2 * i]:stops[2 * i] and starts[2 * i + 1]:stops[2 * i +
+        1]. The rows for every group are gathered into one array and sorted
+        by group and then value in a single lexsort, so the medians can be
+        read off directly. As with `numpy.median`, groups containing NaNs
+        have NaN medians.
+
+        :returns: an array with a row of medians for each group (NaN for
+            empty groups)
+    """
+    lengths = stops - starts
+    nrows = lengths.sum()
+    counts = lengths.reshape(-1, 2).sum(axis=1)
+    ngroups, ncols = len(counts), values.shape[1]
+    medians = numpy.empty((ngroups, ncols))
+    medians.fill(numpy.nan)
+    if not nrows:
+        return medians
+
+    # Gather the rows for each group
+    offsets = numpy.cumsum(lengths) - lengths
+    rows = numpy.arange(nrows) + numpy.repeat(starts - offsets, lengths)
+    labels = numpy.repeat(numpy.arange(ngroups), counts)
+    data = values[rows].T
+
+    # Sort each column by group and then value
+    order = numpy.lexsort((data, numpy.broadcast_to(labels, data.shape)))
+    data = data[numpy.arange(ncols)[:, numpy.newaxis], order]
+
+    # Pick out the middle values of each group
+    nonempty = counts > 0
+    first = (numpy.cumsum(counts) - counts)[nonempty]
+    lower = first + (counts[nonempty] - 1) // 2
+    upper = first + counts[nonempty] // 2
+    result = (data[:, lower] + data[:, upper]) / 2.
+
+    # NaNs are sorted to the end of each group, so we only need to check the
+    # last value to find groups with NaNs
+    last = first + counts[nonempty] - 1
+    result[numpy.isnan(data[:, last])] = numpy.nan
+    medians[nonempty] = result.T
+    return medians
@@ -53,3 +53,20 @@ class Details(dict):
         """ Disable setattr method
         """
         raise NotImplementedError('Use add_detail to add details')
+
+    def __reduce__(self):
+        """ Pickle support - detail types are generated on the fly, so they
+            can't be pickled by reference. We store their fields instead.
+        """
+        return (_rebuild_details,
+                (type(self), [(key, tuple(detail))
+                              for key, detail in self.items()]))
+
+
+def _rebuild_details(cls, items):
+    """ Rebuild a Details instance from its pickled items
+    """
+    details = cls()
+    for key, fields in items:
+        dict.__setitem__(details, key, cls.detail_type(*fields))
+    return details
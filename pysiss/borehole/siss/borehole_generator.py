@@ -16,7 +16,6 @@ o If the expectation is that only one borehole element should be
 import re
 import xml.etree.ElementTree
 from datetime import datetime
-from pint import UnitRegistry
 
 from ..properties import PropertyType
 from ..borehole import Borehole, OriginPosition
@@ -51,7 +50,10 @@ class SISSBoreholeGenerator:
     def __init__(self):
         """ Construct a SISS borehole generator instance.
         """
-        self.unit_reg = UnitRegistry() 
+        # pint imports pkg_resources, which is slow, so we only import it
+        # when we actually need a unit registry
+        from pint import UnitRegistry
+        self.unit_reg = UnitRegistry()
 
         self.ns_key = None
 
@@ -0,0 +1,504 @@
+""" file:   store.py (pysiss.borehole)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Friday 12 September, 2014
+
+    description: Disk-backed storage for large collections of boreholes
+
+    A statewide collection of boreholes, with all their datasets, won't fit
+    in memory. A BoreholeStore keeps each borehole in its own pickle file,
+    along with a small summary (collar location, datasets, depth ranges and
+    property names) in an append-only index. A LazyBoreholeCollection holds
+    only these summaries in memory, and loads boreholes from the store as
+    they are used, keeping the most recently used ones resident.
+
+    The store is a directory containing:
+
+        -   `index.jsonl`, with one line for each borehole added to or
+            removed from the store
+        -   `boreholes/<digest>.pickle`, with the pickled boreholes, named
+            by the SHA1 digest of the borehole name
+"""
+
+from ..utilities import Collection, to_bytes, to_degrees, to_native
+
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+import cPickle as pickle
+import hashlib
+import json
+import os
+import shutil
+
+# Bump this if the storage layout changes
+STORE_VERSION = 1
+
+_INDEX = 'index.jsonl'
+_BOREHOLES = 'boreholes'
+
+
+class BoreholeSummary(object):
+
+    """ A lightweight summary of a borehole, which is kept in memory while the
+        borehole itself stays on disk
+
+        Summaries have a `name`, the collar `longitude` and `latitude` in
+        degrees (or None if the borehole has no origin position), the names
+        of the borehole's `features`, and a dict of `point_datasets` and
+        `interval_datasets`, mapping dataset names to dicts giving the
+        number of `samples`, the `start` and `end` depths and the
+        `properties` defined on the dataset.
+    """
+
+    __slots__ = ('name', 'longitude', 'latitude', 'features',
+                 'point_datasets', 'interval_datasets')
+
+    def __init__(self, name, longitude=None, latitude=None, features=None,
+                 point_datasets=None, interval_datasets=None):
+        super(BoreholeSummary, self).__init__()
+        self.name = name
+        self.longitude = longitude
+        self.latitude = latitude
+        self.features = features or []
+        self.point_datasets = point_datasets or {}
+        self.interval_datasets = interval_datasets or {}
+
+    def __repr__(self):
+        return 'BoreholeSummary {0} with {1} datasets'.format(
+            self.name,
+            len(self.point_datasets) + len(self.interval_datasets))
+
+    @classmethod
+    def from_borehole(cls, borehole):
+        """ Summarize a borehole
+        """
+        position = borehole.origin_position
+        if position is None:
+            longitude = latitude = None
+        else:
+            longitude = to_degrees(position.longitude)
+            latitude = to_degrees(position.latitude)
+        point_datasets = dict(
+            (name, _summarize(dataset, dataset.depths, dataset.depths))
+            for name, dataset in borehole.point_datasets.items())
+        interval_datasets = dict(
+            (name, _summarize(dataset, dataset.from_depths,
+                              dataset.to_depths))
+            for name, dataset in borehole.interval_datasets.items())
+        return cls(borehole.name, longitude, latitude,
+                   sorted(borehole.features.keys()),
+                   point_datasets, interval_datasets)
+
+    @property
+    def datasets(self):
+        """ The names of all the datasets in the borehole
+        """
+        return self.point_datasets.keys() + self.interval_datasets.keys()
+
+    @property
+    def properties(self):
+        """ The names of all the properties defined on the borehole's
+            datasets
+        """
+        return sorted(set(
+            prop for summaries in (self.point_datasets,
+                                   self.interval_datasets)
+            for summary in summaries.values()
+            for prop in summary['properties']))
+
+    def to_dict(self):
+        return dict((attr, getattr(self, attr)) for attr in self.__slots__)
+
+
+class BoreholeStore(object):
+
+    """ A directory of boreholes on disk
+
+        Boreholes are pickled to one file each, so they can be loaded
+        independently (and in parallel). Adding a borehole with the same
+        name as an existing one replaces it.
+
+            store = BoreholeStore.create('wa.boreholes', boreholes)
+            store.load('PDP2C')
+
+        :param path: The directory holding the store. This is created if it
+            doesn't exist.
+        :type path: string
+    """
+
+    def __init__(self, path):
+        super(BoreholeStore, self).__init__()
+        self.path = path
+        self.summaries = OrderedDict()
+        boreholes_path = os.path.join(path, _BOREHOLES)
+        if not os.path.isdir(boreholes_path):
+            os.makedirs(boreholes_path)
+        index_path = os.path.join(path, _INDEX)
+        if os.path.exists(index_path):
+            self._read_index(index_path)
+
+    def __len__(self):
+        return len(self.summaries)
+
+    def __contains__(self, name):
+        return name in self.summaries
+
+    def __repr__(self):
+        return 'BoreholeStore {0} with {1} boreholes'.format(
+            self.path, len(self))
+
+    @classmethod
+    def create(cls, path, boreholes):
+        """ Write a set of boreholes to a new store
+
+            Any store already in the directory is replaced, including its
+            borehole files.
+
+            :param path: The directory to write the store to
+            :type path: string
+            :param boreholes: The boreholes to write (this can be a
+                generator, so they never all need to be in memory)
+            :returns: the new BoreholeStore
+        """
+        index_path = os.path.join(path, _INDEX)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        boreholes_path = os.path.join(path, _BOREHOLES)
+        if os.path.isdir(boreholes_path):
+            # Otherwise boreholes from the old store could still be loaded
+            shutil.rmtree(boreholes_path)
+        store = cls(path)
+        store.add_many(boreholes)
+        return store
+
+    def names(self):
+        """ Return the names of the boreholes in the store
+        """
+        return self.summaries.keys()
+
+    def add(self, borehole):
+        """ Write a borehole to the store
+
+            :returns: the borehole's BoreholeSummary
+        """
+        return self.add_many([borehole])[0]
+
+    def add_many(self, boreholes):
+        """ Write a set of boreholes to the store
+
+            :returns: a list of BoreholeSummaries
+        """
+        summaries = []
+        with open(os.path.join(self.path, _INDEX), 'ab') as index:
+            for borehole in boreholes:
+                with open(self._filename(borehole.name), 'wb') as fhandle:
+                    pickle.dump(borehole, fhandle, protocol=-1)
+                summary = BoreholeSummary.from_borehole(borehole)
+                self.summaries.pop(borehole.name, None)
+                self.summaries[borehole.name] = summary
+                index.write(json.dumps(
+                    {'version': STORE_VERSION, 'add': summary.to_dict()}))
+                index.write('\n')
+                summaries.append(summary)
+        return summaries
+
+    def remove(self, name):
+        """ Remove a borehole from the store
+        """
+        del self.summaries[name]
+        os.remove(self._filename(name))
+        with open(os.path.join(self.path, _INDEX), 'ab') as index:
+            index.write(json.dumps({'version': STORE_VERSION,
+                                    'remove': name}))
+            index.write('\n')
+
+    def load(self, name):
+        """ Read a borehole from the store
+
+            This only reads from the borehole's own file, so it is safe to
+            call from several threads at once.
+
+            :raises KeyError: if the borehole isn't in the store
+        """
+        if name not in self.summaries:
+            raise KeyError('Unknown borehole {0} in {1!r}'.format(name, self))
+        with open(self._filename(name), 'rb') as fhandle:
+            return pickle.load(fhandle)
+
+    def _filename(self, name):
+        """ Return the path of the file holding a borehole
+        """
+        return _borehole_path(self.path, name)
+
+    def _read_index(self, index_path):
+        """ Replay the index to get the current set of summaries
+        """
+        with open(index_path, 'rb') as index:
+            for line in index:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get('version') != STORE_VERSION:
+                    raise ValueError(
+                        ('Borehole store {0} has version {1}, expected '
+                         '{2}').format(self.path, entry.get('version'),
+                                       STORE_VERSION))
+                if 'add' in entry:
+                    summary = BoreholeSummary(**to_native(entry['add']))
+                    self.summaries.pop(summary.name, None)
+                    self.summaries[summary.name] = summary
+                else:
+                    self.summaries.pop(to_native(entry['remove']), None)
+
+
+class LazyBoreholeCollection(Collection):
+
+    """ A collection of boreholes which are loaded from a BoreholeStore on
+        demand
+
+        Only a BoreholeSummary for each borehole is kept in memory. Boreholes
+        are loaded when they're first accessed, and the `max_resident` most
+        recently used ones are kept in memory:
+
+            boreholes = LazyBoreholeCollection('wa.boreholes',
+                                               max_resident=100,
+                                               read_ahead=8)
+            boreholes.add_index('datasets', lambda s: s.datasets)
+            for borehole in boreholes.find(datasets='Mineralogy'):
+                ...
+
+        When iterating through the collection, the next `read_ahead`
+        boreholes are loaded in background threads so that reading from
+        disk overlaps with processing.
+
+        Secondary indexes (see `pysiss.utilities.Collection.add_index`) are
+        built from the summaries, so finding boreholes doesn't load them.
+        Adding a borehole to the collection writes it to the store. Removing
+        a borehole from the collection leaves it in the store - use
+        `store.remove` to delete it.
+
+        Changes to a loaded borehole are lost when it's evicted, unless it is
+        added to the collection again to save it. Functions applied with
+        `map`, `imap` or `reduce` are passed boreholes loaded from the
+        store by the workers themselves.
+
+        :param store: The store holding the boreholes, or its path
+        :type store: BoreholeStore or string
+        :param names: The names of the boreholes in the collection. Optional,
+            defaults to all the boreholes in the store.
+        :type names: list of strings
+        :param max_resident: The maximum number of boreholes to keep in
+            memory. Optional, defaults to 128.
+        :type max_resident: int
+        :param read_ahead: The number of boreholes to load ahead when
+            iterating. Optional, defaults to 0 (no read-ahead).
+        :type read_ahead: int
+    """
+
+    def __init__(self, store, names=None, max_resident=128, read_ahead=0):
+        if not isinstance(store, BoreholeStore):
+            store = BoreholeStore(store)
+        self.store = store
+        self.max_resident = max_resident
+        self.read_ahead = read_ahead
+        self._resident = OrderedDict()  # loaded boreholes, in LRU order
+        super(LazyBoreholeCollection, self).__init__()
+        if names is None:
+            names = store.names()
+        Collection.extend(self, [store.summaries[name] for name in names])
+
+    def __iter__(self):
+        names = self.keys()
+        if not self.read_ahead:
+            return (self._load(name) for name in names)
+        return self._iter_read_ahead(names)
+
+    def __reversed__(self):
+        return (self._load(name) for name in reversed(self.keys()))
+
+    def __repr__(self):
+        return 'LazyBoreholeCollection of {0} boreholes from {1!r}'.format(
+            len(self), self.store)
+
+    def __contains__(self, name_or_borehole):
+        """ Check whether a name or a borehole is in the collection
+        """
+        name = getattr(name_or_borehole, 'name', name_or_borehole)
+        try:
+            return name in self._index
+        except TypeError:
+            return False
+
+    def __getitem__(self, key_or_idx):
+        """ Retrieve a borehole from the collection, loading it if required
+
+            :param key_or_idx: Either a borehole name, an integer index or a
+                slice. Slices return a new LazyBoreholeCollection sharing the
+                same store.
+        """
+        if isinstance(key_or_idx, slice):
+            return self._view(
+                summary.name for summary in self._objects()[key_or_idx])
+        summary = super(LazyBoreholeCollection, self).__getitem__(key_or_idx)
+        return self._load(summary.name)
+
+    def __delitem__(self, key_or_idx):
+        summary = super(LazyBoreholeCollection, self).__getitem__(key_or_idx)
+        super(LazyBoreholeCollection, self).__delitem__(summary.name)
+        self._resident.pop(summary.name, None)
+
+    def extend(self, boreholes):
+        """ Add a set of boreholes to the collection, writing them to the
+            store
+        """
+        boreholes = list(boreholes)
+        for borehole in boreholes:
+            self._resident.pop(borehole.name, None)
+        super(LazyBoreholeCollection, self).extend(
+            self.store.add_many(boreholes))
+        for borehole in boreholes:
+            self._make_resident(borehole)
+
+    def get(self, key, default=None):
+        if key in self._index:
+            return self._load(key)
+        return default
+
+    def values(self):
+        return list(self)
+
+    def items(self):
+        return zip(self.keys(), self)
+
+    def itervalues(self):
+        return iter(self)
+
+    def iteritems(self):
+        return ((borehole.name, borehole) for borehole in self)
+
+    def summary(self, name):
+        """ Return the BoreholeSummary for a borehole, without loading it
+        """
+        return self._index[name]
+
+    def summaries(self):
+        """ Return the BoreholeSummaries for the collection, in order
+        """
+        return list(self._objects())
+
+    @property
+    def resident(self):
+        """ The names of the boreholes currently in memory, from least to
+            most recently used
+        """
+        return self._resident.keys()
+
+    def find(self, **values):
+        """ Find the boreholes with the given attribute values, without
+            loading them
+
+            See `pysiss.utilities.Collection.find_keys` for details.
+
+            :returns: a new LazyBoreholeCollection sharing the same store
+        """
+        return self._view(self.find_keys(**values))
+
+    def _map_source(self):
+        """ Send borehole names to map workers, which load the boreholes
+            from the store themselves rather than having them copied over
+        """
+        return self.keys(), StoreLoader(self.store.path)
+
+    def _view(self, names):
+        """ Return a new collection of some of our boreholes, sharing the
+            store and the boreholes we currently have loaded
+        """
+        view = LazyBoreholeCollection(self.store, names,
+                                      max_resident=self.max_resident,
+                                      read_ahead=self.read_ahead)
+        for name, borehole in self._resident.items():
+            if name in view._index:
+                view._resident[name] = borehole
+        return view
+
+    def _load(self, name):
+        """ Return a borehole, loading it from the store if required
+        """
+        try:
+            borehole = self._resident.pop(name)
+        except KeyError:
+            borehole = self.store.load(name)
+        self._make_resident(borehole)
+        return borehole
+
+    def _make_resident(self, borehole):
+        """ Mark a borehole as the most recently used, evicting the least
+            recently used ones if there are too many in memory
+        """
+        self._resident[borehole.name] = borehole
+        while len(self._resident) > self.max_resident:
+            self._resident.popitem(last=False)
+
+    def _fetch(self, name):
+        """ Load a borehole in a read-ahead thread. This doesn't touch the
+            LRU, which is only updated by the consuming thread.
+        """
+        borehole = self._resident.get(name)
+        if borehole is None:
+            borehole = self.store.load(name)
+        return borehole
+
+    def _iter_read_ahead(self, names):
+        """ Iterate through the boreholes, loading the next few in
+            background threads
+        """
+        pool = ThreadPool(self.read_ahead)
+        try:
+            names = deque(names)
+            pending = deque()
+            while names or pending:
+                while names and len(pending) < self.read_ahead:
+                    pending.append(
+                        pool.apply_async(self._fetch, (names.popleft(),)))
+                borehole = pending.popleft().get()
+                self._resident.pop(borehole.name, None)
+                self._make_resident(borehole)
+                yield borehole
+        finally:
+            pool.terminate()
+
+
+class StoreLoader(object):
+
+    """ Loads boreholes from a BoreholeStore by name, without reading the
+        store's index
+
+        This is cheap to pickle, so it can be sent to worker processes.
+
+        :param path: The directory holding the store
+        :type path: string
+    """
+
+    def __init__(self, path):
+        super(StoreLoader, self).__init__()
+        self.path = path
+
+    def __call__(self, name):
+        with open(_borehole_path(self.path, name), 'rb') as fhandle:
+            return pickle.load(fhandle)
+
+
+def _borehole_path(path, name):
+    """ Return the path of the file holding a borehole in a store
+    """
+    digest = hashlib.sha1(to_bytes(name)).hexdigest()
+    return os.path.join(path, _BOREHOLES, digest + '.pickle')
+
+
+def _summarize(dataset, from_depths, to_depths):
+    """ Summarize a dataset
+    """
+    return {'samples': int(len(from_depths)),
+            'start': float(from_depths[0]) if len(from_depths) else None,
+            'end': float(to_depths[-1]) if len(to_depths) else None,
+            'properties': sorted(dataset.properties.keys())}
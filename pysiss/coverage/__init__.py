@@ -0,0 +1,18 @@
+""" file:   __init__.py (pysiss.coverage)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Wednesday 3 September, 2014
+
+    description: Vector and raster coverages
+"""
+
+from .vector import MappedFeature, FeatureCollection, FeatureStore
+from .spatial_index import SpatialIndex
+from .join import join_collars
+from .raster import RasterCoverage
+from .pyramid import FeaturePyramid
+from .partition import PartitionedFeatureStore
+
+__all__ = [MappedFeature, FeatureCollection, FeatureStore, SpatialIndex,
+           FeaturePyramid, PartitionedFeatureStore, join_collars,
+           RasterCoverage]
@@ -0,0 +1,95 @@
+""" file:   join.py (pysiss.coverage)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Monday 8 September, 2014
+
+    description: Spatial joins between boreholes and mapped features
+
+    Boreholes give their collar locations as pint latitude/longitude
+    quantities, while MappedFeatures hold polygons. Here we pull all the
+    collar locations into one array, transform them into the features'
+    projection in a single call and then find the feature under every collar
+    using a spatial index and a vectorised point-in-polygon test.
+"""
+
+from .vector import FeatureStore
+from ..utilities import to_degrees
+from ..utilities.projection import transform
+
+import numpy
+import pandas
+
+
+def collar_coordinates(boreholes):
+    """ Return the collar locations of a set of boreholes
+
+        :param boreholes: The boreholes
+        :type boreholes: iterable of pysiss.borehole.Borehole
+        :returns: an (N, 2) array of (longitude, latitude) pairs in degrees,
+            with NaNs for boreholes without an origin position
+    """
+    coords = []
+    for borehole in boreholes:
+        position = getattr(borehole, 'origin_position', None)
+        if position is None:
+            coords.append((numpy.nan, numpy.nan))
+        else:
+            coords.append((to_degrees(position.longitude),
+                           to_degrees(position.latitude)))
+    return numpy.array(coords, dtype=float).reshape(-1, 2)
+
+
+def join_collars(boreholes, features, projection='EPSG:4326'):
+    """ Find the mapped feature under each borehole collar
+
+            >>> geology = unmarshal_all('geology.xml')
+            >>> joined = join_collars(boreholes, geology)
+            >>> joined.specification.value_counts()
+
+        :param boreholes: The boreholes to join
+        :type boreholes: pysiss.utilities.Collection of Boreholes
+        :param features: The features to join against, either as a
+            sequence of MappedFeatures (e.g. a FeatureCollection) or a
+            FeatureStore
+        :param projection: The projection of the borehole collar locations.
+            Optional, defaults to 'EPSG:4326'.
+        :returns: a pandas DataFrame indexed by borehole name, with the collar
+            longitude and latitude and the ident, specification key and
+            MappedFeature of the feature under each collar (or None if there
+            isn't one). Where features overlap, the first one wins.
+    """
+    boreholes = list(boreholes)
+    if isinstance(features, FeatureStore):
+        store, originals = features, None
+    else:
+        originals = list(features)
+        store = FeatureStore.from_features(originals)
+
+    # Get the collar locations into the same projection as the features
+    coords = collar_coordinates(boreholes)
+    projections = numpy.unique(store.projections)
+    if len(projections) == 1:
+        points = transform(coords, projection, projections[0].item())
+    else:
+        store, points = store.reproject(projection), coords
+    indices = store.locate(points)
+
+    # Assemble the results
+    found = indices >= 0
+    idents = numpy.empty(len(boreholes), dtype=object)
+    specifications = numpy.empty(len(boreholes), dtype=object)
+    matched = numpy.empty(len(boreholes), dtype=object)
+    idents[found] = store.idents[indices[found]].tolist()
+    specifications[found] = \
+        store.specifications[indices[found]].tolist()
+    for position in numpy.flatnonzero(found):
+        idx = indices[position]
+        matched[position] = originals[idx] if originals is not None \
+            else store.feature(idx)
+    return pandas.DataFrame(
+        data={'longitude': coords[:, 0], 'latitude': coords[:, 1],
+              'ident': idents, 'specification': specifications,
+              'feature': matched},
+        index=[getattr(borehole, 'name', None) for borehole in boreholes],
+        columns=['longitude', 'latitude', 'ident', 'specification',
+                 'feature'])
@@ -0,0 +1,410 @@
+""" file:   partition.py (pysiss.coverage)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Thursday 11 September, 2014
+
+    description: Spatially partitioned on-disk feature stores
+
+    Continental scale maps don't fit in memory, even as FeatureStores. Here
+    we split features into a fixed grid of spatial tiles on disk, so that a
+    bounding box query only reads the tiles it touches and operations can be
+    run over tiles in parallel.
+
+    The store is a directory containing:
+
+        -   `manifest.json`, giving the tile grid, the bounds and parts of
+            each tile, lookup tables for projections and specifications, and
+            the keys and types of the metadata records
+        -   `metadata.npy` and `metadata_offsets.npy`, holding the
+            serialized metadata records referred to by the features
+        -   `tiles/<col>_<row>/<part>/`, holding the FeatureStore columns
+            for each batch of features written to a tile
+
+    Each feature goes in the tile containing the centre of its bounding
+    box, and each tile records the bounds of all its features, so queries
+    find every intersecting feature even if it spills over a tile edge.
+"""
+
+from .vector import FeatureStore
+from ..metadata import Metadata, current_registry
+from ..utilities import from_bytes, to_bytes, to_native, to_text
+
+import json
+import multiprocessing
+import numpy
+import os
+import shutil
+
+# Bump this if the storage layout changes
+PARTITION_VERSION = 1
+
+_MANIFEST = 'manifest.json'
+
+# Numeric FeatureStore columns, which are memory-mapped when read
+_COLUMNS = ('coords', 'ring_offsets', 'part_offsets', 'geometry_offsets',
+            'geometry_types', 'bounds')
+
+
+class PartitionedFeatureStore(object):
+
+    """ A set of features partitioned into spatial tiles on disk
+
+        Use `PartitionedFeatureStore.create` to partition a set of features
+        (which can be a generator, so the features never all need to be in
+        memory), then open it again with `PartitionedFeatureStore(path)`:
+
+            store = PartitionedFeatureStore.create(
+                'geology.tiles', unmarshal_all('geology.xml'),
+                tile_size=(1, 1))
+            local = store.query((115.5, -31.5, 116, -31))
+            areas = store.map_tiles(total_area, processes=4)
+
+        Opening a store registers its metadata records in the current
+        metadata registry, so features read from it can find their
+        specifications.
+
+        :param path: The directory holding the store
+        :type path: string
+    """
+
+    def __init__(self, path):
+        super(PartitionedFeatureStore, self).__init__()
+        self.path = path
+        self._manifest = _read_manifest(path)
+        self.origin = tuple(self._manifest['origin'])
+        self.tile_size = tuple(self._manifest['tile_size'])
+        self.projections = [to_native(p)
+                            for p in self._manifest['projections']]
+        self.specifications = [to_native(s)
+                               for s in self._manifest['specifications']]
+        self.register_metadata()
+
+    def __len__(self):
+        return sum(tile['count'] for tile in self._manifest['tiles'].values())
+
+    def __repr__(self):
+        return 'PartitionedFeatureStore {0} with {1} features in {2} tiles'\
+            .format(self.path, len(self), len(self.tiles))
+
+    @classmethod
+    def create(cls, path, features, tile_size, origin=(0., 0.),
+               batch_size=10000):
+        """ Partition a set of features into tiles on disk and open the
+            result
+
+            Features are buffered in memory until `batch_size` of them have
+            built up, and then each tile's share is written out as a new
+            part.
+
+            :param path: The directory to write the store to
+            :type path: string
+            :param features: The features to partition, as a sequence of
+                MappedFeatures or a FeatureStore
+            :param tile_size: The (x, y) size of each tile, in the units of
+                the features' projection
+            :type tile_size: tuple
+            :param origin: The (x, y) coordinates of the corner of tile
+                (0, 0). Optional, defaults to (0, 0).
+            :type origin: tuple
+            :param batch_size: The number of features to buffer before
+                writing. Optional, defaults to 10000.
+            :type batch_size: int
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        manifest_path = os.path.join(path, _MANIFEST)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        tiles_path = os.path.join(path, 'tiles')
+        if os.path.isdir(tiles_path):
+            # Parts left over from an earlier store would be read as ours
+            shutil.rmtree(tiles_path)
+
+        writer = _PartitionWriter(path, tile_size, origin)
+        if isinstance(features, FeatureStore):
+            for start in range(0, len(features), batch_size):
+                writer.write(features.take(
+                    numpy.arange(start, min(start + batch_size,
+                                            len(features)))))
+        else:
+            batch = []
+            for feature in features:
+                batch.append(feature)
+                writer.remember_registry(feature)
+                if len(batch) == batch_size:
+                    writer.write(FeatureStore.from_features(batch))
+                    batch = []
+            if batch:
+                writer.write(FeatureStore.from_features(batch))
+        writer.close()
+        return cls(path)
+
+    @property
+    def tiles(self):
+        """ The keys of the tiles in the store, as (col, row) tuples
+        """
+        return sorted(_tile_key(name) for name in self._manifest['tiles'])
+
+    def tile_bounds(self, tile):
+        """ Return the bounds of the features in a tile
+        """
+        return tuple(self._manifest['tiles'][_tile_name(tile)]['bounds'])
+
+    def _parts(self, tile):
+        """ Return the number of parts written to a tile
+        """
+        return self._manifest['tiles'][_tile_name(tile)]['parts']
+
+    def tiles_for(self, bounds):
+        """ Return the tiles containing features whose bounding boxes might
+            intersect a bounding box
+
+            :param bounds: The bounding box as (minx, miny, maxx, maxy)
+            :type bounds: tuple
+        """
+        minx, miny, maxx, maxy = bounds
+        result = []
+        for tile in self.tiles:
+            tminx, tminy, tmaxx, tmaxy = self.tile_bounds(tile)
+            if tminx <= maxx and tmaxx >= minx \
+                    and tminy <= maxy and tmaxy >= miny:
+                result.append(tile)
+        return result
+
+    def read_tile(self, tile):
+        """ Read the features in a tile
+
+            :param tile: The (col, row) key of the tile
+            :type tile: tuple
+            :returns: a FeatureStore
+        """
+        return _read_tile(self.path, tile, self._parts(tile),
+                          self.projections, self.specifications)
+
+    def query(self, bounds):
+        """ Return the features whose bounding boxes intersect a bounding
+            box, reading only the tiles which might contain them
+
+            :param bounds: The bounding box as (minx, miny, maxx, maxy)
+            :type bounds: tuple
+            :returns: a FeatureStore
+        """
+        stores = [self.read_tile(tile).filter(bounds=bounds)
+                  for tile in self.tiles_for(bounds)]
+        return FeatureStore.concatenate(stores)
+
+    def map_tiles(self, func, bounds=None, processes=None):
+        """ Apply a function to the features in each tile
+
+            Each worker process reads its own tiles from disk, so only the
+            function and its results are sent between processes.
+
+            :param func: The function to apply. This is passed a
+                FeatureStore, and must be picklable (i.e. defined at the top
+                level of a module).
+            :type func: callable
+            :param bounds: Only process the tiles which might intersect this
+                bounding box. Optional, defaults to None (i.e. all tiles).
+            :type bounds: tuple
+            :param processes: The number of worker processes to use.
+                Optional, defaults to None (i.e. one per CPU). Use 1 to run
+                in this process.
+            :type processes: int
+            :returns: a dictionary mapping tile keys to results
+        """
+        tiles = self.tiles if bounds is None else self.tiles_for(bounds)
+        jobs = [(self.path, tile, self._parts(tile), self.projections,
+                 self.specifications, func) for tile in tiles]
+        if processes == 1:
+            results = [_map_tile(job) for job in jobs]
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_map_tile, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        return dict(zip(tiles, results))
+
+    def register_metadata(self):
+        """ Register the store's metadata records in the current registry
+        """
+        registry = current_registry()
+        metadata = numpy.load(os.path.join(self.path, 'metadata.npy'),
+                              mmap_mode='r')
+        offsets = numpy.load(os.path.join(self.path, 'metadata_offsets.npy'))
+        for idx, (key, mdtype) in enumerate(self._manifest['metadata']):
+            key = to_native(key)
+            if key not in registry:
+                Metadata(ident=key, type=to_native(mdtype),
+                         tree=metadata[offsets[idx]:offsets[idx + 1]]
+                         .tobytes())
+
+
+class _PartitionWriter(object):
+
+    """ Write batches of features into tiles
+    """
+
+    def __init__(self, path, tile_size, origin):
+        self.path = path
+        self.tile_size = tuple(float(v) for v in tile_size)
+        self.origin = tuple(float(v) for v in origin)
+        self.tiles = {}  # maps tile names to bounds, counts and parts
+        self.projections, self.specifications = {}, {}  # lookup tables
+        self.registries = {}  # maps specification keys to registries
+
+    def remember_registry(self, feature):
+        """ Note the registry which holds a feature's metadata
+        """
+        registry = getattr(feature, 'md_registry', None)
+        if registry is not None:
+            self.registries.setdefault(feature.specification, registry)
+
+    def write(self, store):
+        """ Write each tile's share of a batch of features
+        """
+        centres = (store.bounds[:, :2] + store.bounds[:, 2:]) / 2.
+        cols = numpy.floor((centres[:, 0] - self.origin[0])
+                           / self.tile_size[0]).astype(int)
+        rows = numpy.floor((centres[:, 1] - self.origin[1])
+                           / self.tile_size[1]).astype(int)
+        projection_codes = _codes(store.projections, self.projections)
+        specification_codes = _codes(store.specifications,
+                                     self.specifications)
+        for col, row in set(zip(cols, rows)):
+            mask = (cols == col) & (rows == row)
+            tile = store.take(mask)
+            name = _tile_name((col, row))
+            info = self.tiles.setdefault(
+                name, {'bounds': None, 'count': 0, 'parts': 0})
+            part_path = os.path.join(self.path, 'tiles', name,
+                                     str(info['parts']))
+            if not os.path.isdir(part_path):
+                os.makedirs(part_path)
+            for column in _COLUMNS:
+                numpy.save(os.path.join(part_path, column + '.npy'),
+                           getattr(tile, column))
+            numpy.save(os.path.join(part_path, 'idents.npy'),
+                       numpy.array([to_bytes(i) for i in tile.idents],
+                                   dtype=bytes))
+            numpy.save(os.path.join(part_path, 'projections.npy'),
+                       projection_codes[mask])
+            numpy.save(os.path.join(part_path, 'specifications.npy'),
+                       specification_codes[mask])
+
+            # Update the tile info
+            bounds = [tile.bounds[:, 0].min(), tile.bounds[:, 1].min(),
+                      tile.bounds[:, 2].max(), tile.bounds[:, 3].max()]
+            if info['bounds'] is not None:
+                bounds = [min(bounds[0], info['bounds'][0]),
+                          min(bounds[1], info['bounds'][1]),
+                          max(bounds[2], info['bounds'][2]),
+                          max(bounds[3], info['bounds'][3])]
+            info['bounds'] = [float(v) for v in bounds]
+            info['count'] += len(tile)
+            info['parts'] += 1
+
+    def close(self):
+        """ Write the metadata records and the manifest
+        """
+        specifications = _table(self.specifications)
+        records = []
+        for key in specifications:
+            if key is None:
+                # Feature without a specification, kept as null
+                continue
+            registry = self.registries.get(key, current_registry())
+            if key in registry:
+                records.append((key, registry[key]))
+        buffers = [record.serialized for _, record in records]
+        offsets = numpy.zeros(len(buffers) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(b) for b in buffers])
+        numpy.save(os.path.join(self.path, 'metadata.npy'),
+                   numpy.frombuffer(b''.join(buffers), dtype=numpy.uint8))
+        numpy.save(os.path.join(self.path, 'metadata_offsets.npy'), offsets)
+
+        manifest = {
+            'version': PARTITION_VERSION,
+            'origin': list(self.origin),
+            'tile_size': list(self.tile_size),
+            'tiles': self.tiles,
+            'projections': [to_text(p) for p in _table(self.projections)],
+            'specifications': [to_text(s) for s in specifications],
+            'metadata': [[to_text(key), record.type]
+                         for key, record in records]}
+        with open(os.path.join(self.path, _MANIFEST), 'w') as fhandle:
+            json.dump(manifest, fhandle)
+
+
+def _read_manifest(path):
+    """ Read and check a store's manifest
+    """
+    with open(os.path.join(path, _MANIFEST)) as fhandle:
+        manifest = json.load(fhandle)
+    if manifest.get('version') != PARTITION_VERSION:
+        raise ValueError(
+            'Unsupported partition version {0} in {1}'.format(
+                manifest.get('version'), path))
+    return manifest
+
+
+def _read_tile(path, tile, parts, projections, specifications):
+    """ Read the parts of a tile listed in the manifest into a FeatureStore
+    """
+    tile_path = os.path.join(path, 'tiles', _tile_name(tile))
+    stores = []
+    for part in range(parts):
+        part_path = os.path.join(tile_path, str(part))
+        columns = dict(
+            (column, numpy.load(os.path.join(part_path, column + '.npy'),
+                                mmap_mode='r'))
+            for column in _COLUMNS)
+        idents = numpy.load(os.path.join(part_path, 'idents.npy'))
+        projection_codes = numpy.load(
+            os.path.join(part_path, 'projections.npy'))
+        specification_codes = numpy.load(
+            os.path.join(part_path, 'specifications.npy'))
+        stores.append(FeatureStore(
+            idents=[from_bytes(i) for i in idents],
+            projections=[projections[c] for c in projection_codes],
+            specifications=[specifications[c] for c in specification_codes],
+            **columns))
+    return stores[0] if len(stores) == 1 else FeatureStore.concatenate(stores)
+
+
+def _map_tile(job):
+    """ Read a tile and apply a function to it
+
+        This runs in a worker process for `map_tiles`.
+    """
+    path, tile, parts, projections, specifications, func = job
+    return func(_read_tile(path, tile, parts, projections, specifications))
+
+
+def _tile_name(tile):
+    return '{0}_{1}'.format(*tile)
+
+
+def _tile_key(name):
+    col, row = name.split('_')
+    return int(col), int(row)
+
+
+def _codes(values, lookup):
+    """ Convert values into codes into a growing lookup table
+    """
+    codes = numpy.empty(len(values), dtype=numpy.int32)
+    for idx, value in enumerate(values):
+        value = value.item() if isinstance(value, numpy.generic) else value
+        try:
+            codes[idx] = lookup[value]
+        except KeyError:
+            codes[idx] = lookup[value] = len(lookup)
+    return codes
+
+
+def _table(lookup):
+    """ Convert a lookup table into a list of values, ordered by code
+    """
+    return [value for value, _ in sorted(lookup.items(), key=lambda i: i[1])]
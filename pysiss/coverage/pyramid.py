@@ -0,0 +1,109 @@
+""" file:   pyramid.py (pysiss.coverage)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Wednesday 10 September, 2014
+
+    description: Level-of-detail pyramids for mapped features
+
+    At regional scales most of the vertices in a detailed map are smaller
+    than a pixel, but they still dominate the cost of queries and of moving
+    geometries around. A FeaturePyramid keeps simplified copies of a set of
+    features at a series of tolerances, and queries use the coarsest copy
+    which is still within the tolerance you ask for.
+"""
+
+from .vector import FeatureStore
+
+import numpy
+
+
+class FeaturePyramid(object):
+
+    """ A multi-resolution pyramid of simplified features
+
+        Level 0 holds the features at full resolution, and each level above
+        holds the features simplified at the next tolerance (see
+        `FeatureStore.simplify`). Every level is simplified from the full
+        resolution features, so no vertex at a level is further than that
+        level's tolerance from the original geometry.
+
+            pyramid = FeaturePyramid(unmarshal_all('geology.xml'),
+                                     tolerances=[1e-4, 1e-3, 1e-2])
+            regional = pyramid.query((115, -35, 125, -25), tolerance=5e-3)
+
+        Topology is preserved within each feature, but shared boundaries
+        between neighbouring features are simplified separately and may no
+        longer line up exactly.
+
+        :param features: The features, as a sequence of MappedFeatures or a
+            FeatureStore
+        :param tolerances: The simplification tolerances for each level above
+            full resolution, in the units of the features' projection.
+            Optional, by default we use three levels at 1e-4, 1e-3 and 1e-2
+            times the width of the features' extent.
+        :type tolerances: list of floats
+        :param preserve_topology: Whether to prevent self-intersections and
+            collapsed rings when simplifying. Optional, defaults to True.
+        :type preserve_topology: bool
+    """
+
+    def __init__(self, features, tolerances=None, preserve_topology=True):
+        super(FeaturePyramid, self).__init__()
+        if not isinstance(features, FeatureStore):
+            features = FeatureStore.from_features(features)
+        if tolerances is None:
+            if len(features):
+                bounds = features.bounds
+                extent = max(bounds[:, 2].max() - bounds[:, 0].min(),
+                             bounds[:, 3].max() - bounds[:, 1].min())
+            else:
+                extent = 0
+            tolerances = [extent * factor for factor in (1e-4, 1e-3, 1e-2)]
+        self.tolerances = [0.] + sorted(float(t) for t in tolerances)
+        self.levels = [features] + [
+            features.simplify(tolerance, preserve_topology)
+            for tolerance in self.tolerances[1:]]
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def __repr__(self):
+        return 'FeaturePyramid with {0} features at tolerances {1}'.format(
+            len(self), self.tolerances)
+
+    def level_for(self, tolerance=0):
+        """ Return the index of the coarsest level within a tolerance
+
+            :param tolerance: The largest acceptable distance between the
+                returned and original geometries
+            :type tolerance: float
+        """
+        return int(numpy.searchsorted(self.tolerances, tolerance,
+                                      side='right')) - 1
+
+    def store(self, tolerance=0):
+        """ Return the FeatureStore for the coarsest level within a
+            tolerance
+        """
+        return self.levels[self.level_for(tolerance)]
+
+    def query(self, bounds, tolerance=0):
+        """ Return the features whose bounding boxes intersect a bounding
+            box, from the coarsest level within a tolerance
+
+            :param bounds: The bounding box as (minx, miny, maxx, maxy)
+            :type bounds: tuple
+            :param tolerance: The largest acceptable distance between the
+                returned and original geometries. Optional, defaults to 0
+                (i.e. full resolution).
+            :type tolerance: float
+            :returns: a FeatureStore
+        """
+        store = self.store(tolerance)
+        _, entries = store.spatial_index.query_pairs([bounds])
+        return store.take(sorted(entry.ident for entry in entries))
+
+    def vertex_counts(self):
+        """ Return the total number of vertices at each level
+        """
+        return [len(level.coords) for level in self.levels]
@@ -0,0 +1,454 @@
+""" file:   raster.py (pysiss.coverage)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Tuesday 9 September, 2014
+
+    desription: Implementation of classes for raster coverage data
+
+    Gridded coverages (magnetics, gravity, DEMs etc) can be much larger than
+    memory, so they are stored on disk as a directory of NumPy arrays which
+    we memory-map rather than load:
+
+        -   `manifest.json` gives the grid shape, data type, georeferencing
+            and tile size
+        -   `level_0.npy` holds the full resolution grid, split into square
+            tiles and stored tile by tile (as an array of shape (tile rows,
+            tile columns, tile size, tile size)) so that a small window only
+            touches a few contiguous chunks of the file
+        -   `level_<k>.npy` hold overviews, each averaging 2 x 2 cells of the
+            level above
+
+    Grids are north-up, with `origin` giving the (x, y) coordinates of the
+    top-left corner and `cell_size` the (x, y) size of each cell, so cell
+    (row, col) covers x from origin[0] + col * cell_size[0] and y down from
+    origin[1] - row * cell_size[1].
+"""
+
+from ..utilities.projection import transform
+
+from numpy.lib.format import open_memmap
+import json
+import numpy
+import os
+
+# Bump this if the storage layout changes
+RASTER_VERSION = 1
+
+_MANIFEST = 'manifest.json'
+
+
+class RasterCoverage(object):
+
+    """ A gridded coverage backed by memory-mapped tiled arrays
+
+        Use `RasterCoverage.create` to write a new coverage from an array
+        (which can itself be a memory-mapped array), then open it again with
+        `RasterCoverage(path)`:
+
+            dem = RasterCoverage.create('dem.raster', heights,
+                                        origin=(115., -30.),
+                                        cell_size=(0.001, 0.001))
+            block = dem.read_bounds((115.1, -30.2, 115.2, -30.1))
+            heights = dem.sample_boreholes(boreholes)
+
+        Nothing is read from disk until you ask for it, and reads only
+        touch the tiles they need.
+
+        :param path: The directory holding the coverage
+        :type path: string
+    """
+
+    def __init__(self, path):
+        super(RasterCoverage, self).__init__()
+        self.path = path
+        with open(os.path.join(path, _MANIFEST)) as fhandle:
+            manifest = json.load(fhandle)
+        if manifest.get('version') != RASTER_VERSION:
+            raise ValueError(
+                'Unsupported raster version {0} in {1}'.format(
+                    manifest.get('version'), path))
+        self.shape = tuple(manifest['shape'])
+        self.dtype = numpy.dtype(str(manifest['dtype']))
+        self.origin = tuple(manifest['origin'])
+        self.cell_size = tuple(manifest['cell_size'])
+        self.tile_size = manifest['tile_size']
+        self.projection = manifest['projection']
+        if self.projection is not None:
+            self.projection = str(self.projection)
+        self.nodata = manifest['nodata']
+        self.levels = manifest['levels']
+        self._tiles = {}  # maps levels to memory-mapped tile arrays
+
+    def __repr__(self):
+        return 'RasterCoverage {0} with shape {1} and {2} levels'.format(
+            self.path, self.shape, self.levels)
+
+    @classmethod
+    def create(cls, path, data, origin, cell_size, projection=None,
+               nodata=None, tile_size=256, overviews=True):
+        """ Write a new coverage to disk and open it
+
+            The data is copied one row of tiles at a time, so it can be a
+            memory-mapped array larger than memory.
+
+            :param path: The directory to write the coverage to
+            :type path: string
+            :param data: The grid values, as a 2D array with the first row
+                at the top (north)
+            :type data: numpy.ndarray
+            :param origin: The (x, y) coordinates of the top-left corner of
+                the grid
+            :type origin: tuple
+            :param cell_size: The (x, y) size of each cell
+            :type cell_size: tuple
+            :param projection: The identifier for the grid's projection (e.g.
+                'EPSG:4326'). Optional, defaults to None.
+            :param nodata: The value marking missing cells. Optional,
+                defaults to None (NaNs are always treated as missing).
+            :type nodata: float
+            :param tile_size: The width and height of each tile in cells.
+                Optional, defaults to 256.
+            :type tile_size: int
+            :param overviews: Whether to build overviews. Optional, defaults
+                to True.
+            :type overviews: bool
+        """
+        if len(data.shape) != 2:
+            raise ValueError(
+                'Raster data must be 2D, got shape {0}'.format(data.shape))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        shape = data.shape
+
+        # Copy the data in, one row of tiles at a time
+        fill = _fill_value(data.dtype, nodata)
+        tiles = _open_tiles(path, 0, shape, tile_size, data.dtype, fill)
+        for tile_row in range(tiles.shape[0]):
+            rows = data[tile_row * tile_size:(tile_row + 1) * tile_size]
+            _write_tile_row(tiles, tile_row, numpy.asarray(rows), fill)
+        tiles.flush()
+        del tiles
+
+        # Build overviews by averaging 2 x 2 blocks of the level above
+        levels = 1
+        if overviews:
+            source = _Level(path, 0, shape, tile_size)
+            overview_dtype = numpy.result_type(data.dtype, numpy.float32)
+            while max(source.shape) > tile_size:
+                level_shape = tuple(-(-n // 2) for n in source.shape)
+                tiles = _open_tiles(path, levels, level_shape, tile_size,
+                                    overview_dtype, numpy.nan)
+                for tile_row in range(tiles.shape[0]):
+                    rows = source.read_rows(2 * tile_row * tile_size,
+                                            2 * (tile_row + 1) * tile_size)
+                    _write_tile_row(tiles, tile_row,
+                                    _downsample(_masked(rows, nodata)),
+                                    numpy.nan)
+                tiles.flush()
+                del tiles
+                source = _Level(path, levels, level_shape, tile_size)
+                levels += 1
+
+        # Write the manifest last, so a partly written coverage won't open
+        manifest = {
+            'version': RASTER_VERSION,
+            'shape': list(shape),
+            'dtype': data.dtype.str,
+            'origin': [float(v) for v in origin],
+            'cell_size': [float(v) for v in cell_size],
+            'tile_size': tile_size,
+            'projection': projection,
+            'nodata': None if nodata is None else float(nodata),
+            'levels': levels}
+        with open(os.path.join(path, _MANIFEST), 'w') as fhandle:
+            json.dump(manifest, fhandle)
+        return cls(path)
+
+    @property
+    def bounds(self):
+        """ The (minx, miny, maxx, maxy) bounds of the grid
+        """
+        return (self.origin[0],
+                self.origin[1] - self.shape[0] * self.cell_size[1],
+                self.origin[0] + self.shape[1] * self.cell_size[0],
+                self.origin[1])
+
+    def level_shape(self, level=0):
+        """ Return the shape of the grid at an overview level
+        """
+        self._check_level(level)
+        return tuple(-(-n // 2 ** level) for n in self.shape)
+
+    def level_cell_size(self, level=0):
+        """ Return the (x, y) cell size at an overview level
+        """
+        self._check_level(level)
+        return (self.cell_size[0] * 2 ** level, self.cell_size[1] * 2 ** level)
+
+    def choose_level(self, resolution):
+        """ Return the coarsest overview level whose cells are no bigger
+            than the given resolution
+        """
+        ratio = float(resolution) / max(self.cell_size)
+        level = int(numpy.floor(numpy.log2(ratio))) if ratio >= 1 else 0
+        return min(level, self.levels - 1)
+
+    def read(self, window=None, level=0):
+        """ Read a window of cells
+
+            Cells outside the grid are filled with the nodata value (or NaN
+            for floating point grids without one, and for overviews).
+
+            :param window: The window as (row_start, row_stop, col_start,
+                col_stop) at the given level. Optional, defaults to the whole
+                grid.
+            :type window: tuple
+            :param level: The overview level to read from. Optional, defaults
+                to 0 (i.e. full resolution).
+            :type level: int
+            :returns: a 2D array
+        """
+        shape = self.level_shape(level)
+        if window is None:
+            window = (0, shape[0], 0, shape[1])
+        row_start, row_stop, col_start, col_stop = [int(v) for v in window]
+        tiles = self._level_tiles(level)
+        result = numpy.empty((max(row_stop - row_start, 0),
+                              max(col_stop - col_start, 0)),
+                             dtype=tiles.dtype)
+        result.fill(_fill_value(tiles.dtype, self.nodata if level == 0
+                                else None))
+
+        # Copy in the parts of each tile which overlap the window
+        size = self.tile_size
+        rows = (max(row_start, 0), min(row_stop, shape[0]))
+        cols = (max(col_start, 0), min(col_stop, shape[1]))
+        if rows[0] >= rows[1] or cols[0] >= cols[1]:
+            return result
+        for tile_row in range(rows[0] // size, (rows[1] - 1) // size + 1):
+            top = max(rows[0], tile_row * size)
+            bottom = min(rows[1], (tile_row + 1) * size)
+            for tile_col in range(cols[0] // size, (cols[1] - 1) // size + 1):
+                left = max(cols[0], tile_col * size)
+                right = min(cols[1], (tile_col + 1) * size)
+                result[top - row_start:bottom - row_start,
+                       left - col_start:right - col_start] = \
+                    tiles[tile_row, tile_col,
+                          top - tile_row * size:bottom - tile_row * size,
+                          left - tile_col * size:right - tile_col * size]
+        return result
+
+    def read_bounds(self, bounds, level=0):
+        """ Read the cells which overlap a bounding box
+
+            :param bounds: The bounding box as (minx, miny, maxx, maxy)
+            :type bounds: tuple
+            :param level: The overview level to read from. Optional, defaults
+                to 0 (i.e. full resolution).
+            :type level: int
+            :returns: a 2D array, and the (x, y) coordinates of its top-left
+                corner
+        """
+        minx, miny, maxx, maxy = bounds
+        dx, dy = self.level_cell_size(level)
+        window = (int(numpy.floor((self.origin[1] - maxy) / dy)),
+                  int(numpy.ceil((self.origin[1] - miny) / dy)),
+                  int(numpy.floor((minx - self.origin[0]) / dx)),
+                  int(numpy.ceil((maxx - self.origin[0]) / dx)))
+        corner = (self.origin[0] + window[2] * dx,
+                  self.origin[1] - window[0] * dy)
+        return self.read(window, level), corner
+
+    def sample(self, points, level=0, method='nearest', projection=None):
+        """ Sample the grid at a set of points
+
+            Only the tiles containing the points are read. Points outside
+            the grid or on missing cells give NaN.
+
+            :param points: The points, as an (N, 2) array of (x, y)
+                coordinates
+            :type points: numpy.ndarray
+            :param level: The overview level to sample. Optional, defaults to
+                0 (i.e. full resolution).
+            :type level: int
+            :param method: Either 'nearest' (the value of the cell containing
+                each point) or 'bilinear' (interpolated between the four
+                nearest cell centres). Optional, defaults to 'nearest'.
+            :type method: string
+            :param projection: The projection of the points, if it's
+                different to the grid's. Optional, defaults to None.
+            :returns: an array of values
+        """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        if projection is not None and self.projection is not None:
+            points = transform(points, projection, self.projection)
+        dx, dy = self.level_cell_size(level)
+        cols = (points[:, 0] - self.origin[0]) / dx
+        rows = (self.origin[1] - points[:, 1]) / dy
+        if method == 'nearest':
+            return self._cells(level, numpy.floor(rows), numpy.floor(cols))
+        elif method == 'bilinear':
+            rows, cols = rows - 0.5, cols - 0.5
+            shape = self.level_shape(level)
+            outside = (rows < -0.5) | (rows > shape[0] - 0.5) \
+                | (cols < -0.5) | (cols > shape[1] - 0.5)
+            rows = numpy.clip(rows, 0, shape[0] - 1)
+            cols = numpy.clip(cols, 0, shape[1] - 1)
+            top, left = numpy.floor(rows), numpy.floor(cols)
+            bottom = numpy.minimum(top + 1, shape[0] - 1)
+            right = numpy.minimum(left + 1, shape[1] - 1)
+            wrow, wcol = rows - top, cols - left
+            result = (
+                self._cells(level, top, left) * (1 - wrow) * (1 - wcol)
+                + self._cells(level, top, right) * (1 - wrow) * wcol
+                + self._cells(level, bottom, left) * wrow * (1 - wcol)
+                + self._cells(level, bottom, right) * wrow * wcol)
+            result[outside] = numpy.nan
+            return result
+        else:
+            raise ValueError(
+                ('Unknown sampling method {0}, '
+                 'expected nearest or bilinear').format(method))
+
+    def sample_boreholes(self, boreholes, projection='EPSG:4326', **kwargs):
+        """ Sample the grid at the collar of each borehole in a collection
+
+            :param boreholes: The boreholes
+            :type boreholes: pysiss.utilities.Collection of Boreholes
+            :param projection: The projection of the collar locations.
+                Optional, defaults to 'EPSG:4326'.
+            :param kwargs: Passed through to `sample`
+            :returns: an array of values, with NaN for boreholes without an
+                origin position
+        """
+        from .join import collar_coordinates
+        return self.sample(collar_coordinates(boreholes),
+                           projection=projection, **kwargs)
+
+    def _cells(self, level, rows, cols):
+        """ Look up cell values as floats, with NaNs for missing cells
+
+            Lookups are made in file order to keep reads from the
+            memory-mapped tiles local.
+        """
+        shape = self.level_shape(level)
+        tiles = self._level_tiles(level)
+        result = numpy.empty(len(rows))
+        result.fill(numpy.nan)
+        with numpy.errstate(invalid='ignore'):
+            inside = (rows >= 0) & (rows < shape[0]) \
+                & (cols >= 0) & (cols < shape[1])
+        rows, cols = rows[inside].astype(int), cols[inside].astype(int)
+        size = self.tile_size
+        flat = numpy.ravel_multi_index(
+            (rows // size, cols // size, rows % size, cols % size),
+            tiles.shape)
+        order = numpy.argsort(flat)
+        values = numpy.empty(len(flat))
+        values[order] = tiles.reshape(-1)[flat[order]]
+        if level == 0 and self.nodata is not None:
+            values[values == self.nodata] = numpy.nan
+        result[inside] = values
+        return result
+
+    def _level_tiles(self, level):
+        """ Return the memory-mapped tiles for a level
+        """
+        self._check_level(level)
+        try:
+            return self._tiles[level]
+        except KeyError:
+            tiles = self._tiles[level] = numpy.load(
+                _level_path(self.path, level), mmap_mode='r')
+            return tiles
+
+    def _check_level(self, level):
+        if not 0 <= level < self.levels:
+            raise ValueError(
+                'Level {0} out of range, this coverage has {1} levels'.format(
+                    level, self.levels))
+
+
+class _Level(object):
+
+    """ Read whole rows from a level while we're still building the
+        coverage
+    """
+
+    def __init__(self, path, level, shape, tile_size):
+        self.tiles = numpy.load(_level_path(path, level), mmap_mode='r')
+        self.shape = shape
+        self.tile_size = tile_size
+
+    def read_rows(self, start, stop):
+        """ Read rows [start, stop) as a 2D array
+        """
+        size = self.tile_size
+        first, last = start // size, -(-min(stop, self.shape[0]) // size)
+        block = self.tiles[first:last]
+        block = block.transpose(0, 2, 1, 3).reshape(
+            (last - first) * size, self.tiles.shape[1] * size)
+        return block[start - first * size:stop - first * size,
+                     :self.shape[1]]
+
+
+def _level_path(path, level):
+    """ Return the filename for a level's tiles
+    """
+    return os.path.join(path, 'level_{0}.npy'.format(level))
+
+
+def _open_tiles(path, level, shape, tile_size, dtype, fill):
+    """ Create the memory-mapped tile array for a level
+    """
+    tiles = open_memmap(_level_path(path, level), mode='w+', dtype=dtype,
+                        shape=(-(-shape[0] // tile_size),
+                               -(-shape[1] // tile_size),
+                               tile_size, tile_size))
+    tiles.fill(fill)
+    return tiles
+
+
+def _write_tile_row(tiles, tile_row, rows, fill):
+    """ Split a block of rows into tiles and write them to a level, padding
+        the edges with the fill value
+    """
+    ntiles, size = tiles.shape[1], tiles.shape[2]
+    block = numpy.empty((size, ntiles * size), dtype=tiles.dtype)
+    block.fill(fill)
+    block[:rows.shape[0], :rows.shape[1]] = rows
+    tiles[tile_row] = block.reshape(size, ntiles, size).transpose(1, 0, 2)
+
+
+def _fill_value(dtype, nodata):
+    """ Return the value for cells with no data
+    """
+    if nodata is not None:
+        return nodata
+    return numpy.nan if numpy.issubdtype(dtype, numpy.floating) else 0
+
+
+def _masked(values, nodata):
+    """ Convert values to floats with NaNs for missing cells
+    """
+    values = numpy.array(values, dtype=numpy.result_type(values.dtype,
+                                                         numpy.float32))
+    if nodata is not None:
+        values[values == nodata] = numpy.nan
+    return values
+
+
+def _downsample(values):
+    """ Average 2 x 2 blocks of cells, ignoring NaNs
+    """
+    rows, cols = values.shape
+    padded = numpy.empty((rows + rows % 2, cols + cols % 2),
+                         dtype=values.dtype)
+    padded.fill(numpy.nan)
+    padded[:rows, :cols] = values
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = ~numpy.isnan(blocks)
+    counts = valid.sum(axis=(1, 3))
+    totals = numpy.where(valid, blocks, 0).sum(axis=(1, 3))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
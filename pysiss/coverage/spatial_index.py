@@ -0,0 +1,437 @@
+""" file:   spatial_index.py (pysiss.coverage)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Wednesday 3 September, 2014
+
+    description: A spatial index over MappedFeatures
+
+    The index is a sort-tile-recursive (STR) packed R-tree, stored as NumPy
+    arrays of node bounding boxes so that queries can be vectorised over
+    whole tree levels (and over many query boxes at once). Bounding box
+    candidates are then checked against the real geometries using prepared
+    shapely geometries.
+
+    Packed trees can't be updated in place, so features inserted after the
+    tree was built are kept in a pending list which is scanned linearly, and
+    deleted features are masked out. Once enough pending or deleted features
+    have built up, the tree is repacked.
+"""
+
+from shapely.geometry import Point
+from shapely.prepared import prep
+import heapq
+import numpy
+
+
+class SpatialIndex(object):
+
+    """ An STR-tree spatial index over a set of features
+
+        Features can be anything with an `ident` and a shapely `shape`
+        (e.g. `pysiss.coverage.vector.MappedFeature`), and are keyed by
+        their ident.
+
+        :param features: The features to index. Optional, defaults to None.
+        :type features: iterable of MappedFeatures
+        :param node_capacity: The maximum number of children for each node in
+            the tree. Optional, defaults to 16.
+        :type node_capacity: int
+        :param rebuild_fraction: Repack the tree when the number of features
+            inserted or deleted since it was last packed is more than this
+            fraction of the number of features in the index. Optional,
+            defaults to 0.25.
+        :type rebuild_fraction: float
+        :param bounds: The bounding boxes of the features, if you already
+            have them (see `insert_many`). Optional, defaults to None.
+        :type bounds: numpy.ndarray
+    """
+
+    def __init__(self, features=None, node_capacity=16, rebuild_fraction=0.25,
+                 bounds=None):
+        super(SpatialIndex, self).__init__()
+        self.node_capacity = node_capacity
+        self.rebuild_fraction = rebuild_fraction
+        self._features = []  # maps item ids to features (None if deleted)
+        self._items = {}  # maps feature idents to item ids
+        self._bounds = numpy.empty((0, 4))  # item bounds, with spare space
+        self._alive = numpy.empty(0, dtype=bool)
+        self._prepared = {}  # maps item ids to prepared geometries
+        self._built = 0  # items with ids below this are in the tree
+        self._deleted = 0
+        self._levels = []  # node bounds for each level, leaves first
+        self._order = numpy.empty(0, dtype=int)  # items in leaf order
+        if features is not None:
+            self.insert_many(features, bounds)
+            self.rebuild()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, ident):
+        return ident in self._items
+
+    def __repr__(self):
+        return 'SpatialIndex with {0} features ({1} pending)'.format(
+            len(self), len(self._features) - self._built)
+
+    def insert(self, feature):
+        """ Add a feature to the index
+
+            If there's already a feature with the same ident it is replaced.
+        """
+        self.insert_many([feature])
+
+    def insert_many(self, features, bounds=None):
+        """ Add a set of features to the index
+
+            As with `insert`, features replace any existing features with
+            the same ident, and if several features in the batch share an
+            ident then the last one wins.
+
+            :param features: The features to add
+            :param bounds: The bounding boxes of the features, as an array of
+                (minx, miny, maxx, maxy) rows. Optional, if not given the
+                bounds of each feature's shape are used. Features without
+                shapes can be indexed this way, but only support bounding
+                box queries.
+            :type bounds: numpy.ndarray
+        """
+        features = list(features)
+        if not features:
+            return
+        if bounds is not None:
+            bounds = numpy.asarray(bounds, dtype=float).reshape(-1, 4)
+        last = dict((f.ident, idx) for idx, f in enumerate(features))
+        if len(last) < len(features):
+            keep = sorted(last.values())
+            features = [features[idx] for idx in keep]
+            if bounds is not None:
+                bounds = bounds[keep]
+        for feature in features:
+            if feature.ident in self._items:
+                self._discard(feature.ident)
+        start = len(self._features)
+        self._reserve(start + len(features))
+        if bounds is None:
+            bounds = [f.shape.bounds for f in features]
+        self._bounds[start:start + len(features)] = bounds
+        self._alive[start:start + len(features)] = True
+        for item, feature in enumerate(features, start):
+            self._items[feature.ident] = item
+        self._features.extend(features)
+        self._maybe_rebuild()
+
+    def delete(self, feature):
+        """ Remove a feature from the index
+
+            :param feature: The feature or its ident
+            :raises KeyError: if the feature isn't in the index
+        """
+        self._discard(getattr(feature, 'ident', feature))
+        self._maybe_rebuild()
+
+    def rebuild(self):
+        """ Repack the tree, including all pending features and dropping
+            deleted ones
+        """
+        nitems = len(self._features)
+        alive = numpy.flatnonzero(self._alive[:nitems])
+        self._features = [self._features[item] for item in alive]
+        self._bounds = self._bounds[alive]
+        self._alive = numpy.ones(len(alive), dtype=bool)
+        self._items = dict((feature.ident, item)
+                           for item, feature in enumerate(self._features))
+        self._prepared = {}
+        self._deleted = 0
+        self._built = len(self._features)
+        self._pack()
+
+    def query(self, bounds):
+        """ Return the features whose bounding boxes intersect a bounding box
+
+            :param bounds: The bounding box as (minx, miny, maxx, maxy)
+            :type bounds: tuple
+            :returns: a list of features
+        """
+        return self.query_many([bounds])[0]
+
+    def query_many(self, bounds):
+        """ Return the features whose bounding boxes intersect each of a set
+            of bounding boxes
+
+            :param bounds: The bounding boxes, as an array of (minx, miny,
+                maxx, maxy) rows
+            :returns: a list of lists of features, one for each box
+        """
+        bounds = numpy.asarray(bounds, dtype=float).reshape(-1, 4)
+        queries, items = self._candidates(bounds)
+        return self._collect(queries, items, len(bounds))
+
+    def query_pairs(self, bounds):
+        """ Return every pair of query box and feature whose bounding boxes
+            intersect
+
+            This is handy for joins, where you want to test the candidates
+            in bulk yourself.
+
+            :param bounds: The bounding boxes, as an array of (minx, miny,
+                maxx, maxy) rows
+            :returns: an array of query indices, and a list of the matching
+                features for each pair
+        """
+        queries, items = self._candidates(bounds)
+        return queries, [self._features[item] for item in items]
+
+    def intersecting(self, geometry):
+        """ Return the features which intersect a shapely geometry
+        """
+        return self.intersecting_many([geometry])[0]
+
+    def intersecting_many(self, geometries):
+        """ Return the features which intersect each of a set of shapely
+            geometries
+        """
+        geometries = list(geometries)
+        queries, items = self._candidates([g.bounds for g in geometries])
+        keep = numpy.array([self._prepare(item).intersects(geometries[query])
+                            for query, item in zip(queries, items)],
+                           dtype=bool)
+        return self._collect(queries[keep], items[keep], len(geometries))
+
+    def containing(self, point):
+        """ Return the features which contain a point
+
+            :param point: The point, as a shapely Point or an (x, y) pair
+            :returns: a list of features
+        """
+        return self.containing_many([point])[0]
+
+    def containing_many(self, points):
+        """ Return the features which contain each of a set of points
+
+            :param points: The points, as shapely Points or an array of
+                (x, y) rows
+            :returns: a list of lists of features, one for each point
+        """
+        points = [_point(point) for point in points]
+        queries, items = self._candidates(
+            [(p.x, p.y, p.x, p.y) for p in points])
+        keep = numpy.array([self._prepare(item).contains(points[query])
+                            for query, item in zip(queries, items)],
+                           dtype=bool)
+        return self._collect(queries[keep], items[keep], len(points))
+
+    def nearest(self, point, k=1):
+        """ Return the features nearest to a point, closest first
+
+            :param point: The point, as a shapely Point or an (x, y) pair
+            :param k: The number of features to return. Optional, defaults
+                to 1.
+            :type k: int
+            :returns: a list of features
+        """
+        point = _point(point)
+        xy = (point.x, point.y)
+        heap, tiebreak = [], 0
+
+        # Seed the search with the root nodes and any pending items
+        if self._levels:
+            level = len(self._levels) - 1
+            nodes = numpy.arange(len(self._levels[level]))
+            for dist, node in zip(_box_distance(self._levels[level], xy),
+                                  nodes):
+                heap.append((dist, tiebreak, level, node))
+                tiebreak += 1
+        pending = numpy.arange(self._built, len(self._features))
+        pending = pending[self._alive[pending]]
+        for dist, item in zip(_box_distance(self._bounds[pending], xy),
+                              pending):
+            heap.append((dist, tiebreak, -1, item))
+            tiebreak += 1
+        heapq.heapify(heap)
+
+        # Best-first search - box distances are lower bounds on feature
+        # distances, so features come off the heap in order
+        result = []
+        while heap and len(result) < k:
+            dist, _, level, idx = heapq.heappop(heap)
+            if level == -2:
+                result.append(self._features[idx])
+                continue
+            elif level == -1:
+                entries = [(self._features[idx].shape.distance(point),
+                            -2, idx)]
+            else:
+                children = idx * self.node_capacity \
+                    + numpy.arange(self.node_capacity)
+                if level > 0:
+                    children = children[
+                        children < len(self._levels[level - 1])]
+                    boxes = self._levels[level - 1][children]
+                    entries = zip(_box_distance(boxes, xy),
+                                  [level - 1] * len(children), children)
+                else:
+                    children = self._order[children[children < self._built]]
+                    children = children[self._alive[children]]
+                    entries = zip(_box_distance(self._bounds[children], xy),
+                                  [-1] * len(children), children)
+            for dist, level, idx in entries:
+                heapq.heappush(heap, (dist, tiebreak, level, idx))
+                tiebreak += 1
+        return result
+
+    def nearest_many(self, points, k=1):
+        """ Return the features nearest to each of a set of points
+
+            :returns: a list of lists of features, one for each point
+        """
+        return [self.nearest(point, k) for point in points]
+
+    def _candidates(self, bounds):
+        """ Find the items whose bounding boxes intersect each query box
+
+            :returns: arrays of query indices and item ids for each
+                candidate pair
+        """
+        boxes = numpy.asarray(bounds, dtype=float).reshape(-1, 4)
+        nqueries = len(boxes)
+        capacity = self.node_capacity
+        queries, items = [], []
+
+        # Walk down the tree, one level at a time
+        if self._levels:
+            top = len(self._levels[-1])
+            query = numpy.repeat(numpy.arange(nqueries), top)
+            node = numpy.tile(numpy.arange(top), nqueries)
+            for level in reversed(range(len(self._levels))):
+                hit = _intersects(boxes[query], self._levels[level][node])
+                query, node = query[hit], node[hit]
+                nchildren = len(self._levels[level - 1]) if level > 0 \
+                    else self._built
+                node = (node[:, numpy.newaxis] * capacity
+                        + numpy.arange(capacity)).ravel()
+                query = numpy.repeat(query, capacity)
+                keep = node < nchildren
+                query, node = query[keep], node[keep]
+            queries.append(query)
+            items.append(self._order[node])
+
+        # Scan pending items
+        pending = numpy.arange(self._built, len(self._features))
+        if len(pending):
+            queries.append(numpy.repeat(numpy.arange(nqueries), len(pending)))
+            items.append(numpy.tile(pending, nqueries))
+
+        if not queries:
+            return numpy.empty(0, dtype=int), numpy.empty(0, dtype=int)
+        query, item = numpy.concatenate(queries), numpy.concatenate(items)
+        keep = self._alive[item] & _intersects(boxes[query],
+                                               self._bounds[item])
+        return query[keep], item[keep]
+
+    def _collect(self, queries, items, nqueries):
+        """ Group candidate items by query, returning features in item order
+        """
+        result = [[] for _ in range(nqueries)]
+        for idx in numpy.lexsort((items, queries)):
+            result[queries[idx]].append(self._features[items[idx]])
+        return result
+
+    def _prepare(self, item):
+        """ Return the prepared geometry for an item
+        """
+        try:
+            return self._prepared[item]
+        except KeyError:
+            prepared = self._prepared[item] = prep(
+                self._features[item].shape)
+            return prepared
+
+    def _discard(self, ident):
+        """ Mark a feature as deleted
+        """
+        item = self._items.pop(ident)
+        self._features[item] = None
+        self._alive[item] = False
+        self._prepared.pop(item, None)
+        self._deleted += 1
+
+    def _reserve(self, size):
+        """ Make sure there is space for `size` items, growing geometrically
+        """
+        if size > len(self._bounds):
+            capacity = max(size, 2 * len(self._bounds))
+            bounds = numpy.empty((capacity, 4))
+            bounds[:len(self._bounds)] = self._bounds
+            alive = numpy.zeros(capacity, dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._bounds, self._alive = bounds, alive
+
+    def _maybe_rebuild(self):
+        """ Repack the tree if enough features have changed
+        """
+        stale = len(self._features) - self._built + self._deleted
+        if stale > max(self.node_capacity, self.rebuild_fraction * len(self)):
+            self.rebuild()
+
+    def _pack(self):
+        """ Bulk load the tree using sort-tile-recursive packing
+        """
+        bounds = self._bounds[:self._built]
+        nitems, capacity = len(bounds), self.node_capacity
+        if nitems == 0:
+            self._order = numpy.empty(0, dtype=int)
+            self._levels = []
+            return
+
+        # Sort into vertical slices by x, then by y within each slice
+        centres = (bounds[:, :2] + bounds[:, 2:]) / 2.
+        nleaves = -(-nitems // capacity)
+        slice_size = int(numpy.ceil(numpy.sqrt(nleaves))) * capacity
+        order = numpy.argsort(centres[:, 0], kind='mergesort')
+        for start in range(0, nitems, slice_size):
+            chunk = order[start:start + slice_size]
+            order[start:start + slice_size] = \
+                chunk[numpy.argsort(centres[chunk, 1], kind='mergesort')]
+        self._order = order
+
+        # Group consecutive runs of boxes into nodes until we get to the root
+        self._levels = []
+        boxes = bounds[order]
+        while True:
+            boxes = _group(boxes, capacity)
+            self._levels.append(boxes)
+            if len(boxes) <= capacity:
+                break
+
+
+def _group(boxes, size):
+    """ Merge consecutive runs of `size` bounding boxes
+    """
+    starts = numpy.arange(0, len(boxes), size)
+    return numpy.hstack([numpy.minimum.reduceat(boxes[:, :2], starts),
+                         numpy.maximum.reduceat(boxes[:, 2:], starts)])
+
+
+def _intersects(first, second):
+    """ Vectorised test for intersection of two arrays of bounding boxes
+    """
+    return ((first[:, 0] <= second[:, 2]) & (first[:, 2] >= second[:, 0])
+            & (first[:, 1] <= second[:, 3]) & (first[:, 3] >= second[:, 1]))
+
+
+def _box_distance(boxes, xy):
+    """ Return the distance from a point to each of an array of bounding
+        boxes
+    """
+    dx = numpy.maximum(numpy.maximum(boxes[:, 0] - xy[0], 0),
+                       xy[0] - boxes[:, 2])
+    dy = numpy.maximum(numpy.maximum(boxes[:, 1] - xy[1], 0),
+                       xy[1] - boxes[:, 3])
+    return numpy.hypot(dx, dy)
+
+
+def _point(point):
+    """ Convert an (x, y) pair into a shapely Point
+    """
+    return point if isinstance(point, Point) else Point(*point)
@@ -6,8 +6,28 @@
     desription: Implementation of classes for vector coverage data
 """
 
-from ..utilities import id_object
-from ..metadata import MetadataRegistry
+from ..utilities import id_object, Collection
+from ..utilities.projection import project, transform, normalize_projection
+from ..metadata import current_registry
+from .spatial_index import SpatialIndex
+
+from shapely.geometry import Point, LineString, Polygon, MultiLineString, \
+    MultiPolygon
+from collections import namedtuple
+import numpy
+import uuid
+
+# Geometry types supported by FeatureStore
+GEOMETRY_TYPES = (Point, LineString, Polygon, MultiLineString, MultiPolygon)
+POLYGONAL_TYPES = (2, 4)
+LINEAR_TYPES = (1, 3)
+
+# Entries in a FeatureStore's spatial index, keyed by position in the store
+StoreEntry = namedtuple('StoreEntry', 'ident')
+
+# Plain feature records for building new FeatureStores from old ones
+StoredFeature = namedtuple('StoredFeature',
+                           'ident shape specification projection')
 
 
 class MappedFeature(id_object):
@@ -15,24 +35,47 @@ class MappedFeature(id_object):
     """ Class containing vector GIS data.
 
         Corresponds roughly to gsml:MappedFeatures
+
+        Metadata for the feature is looked up in the registry which was
+        current when the feature was created (see
+        `pysiss.metadata.metadata_scope`).
+
+        Large maps can have millions of these, so the core attributes are
+        kept in slots rather than a per-instance dictionary (extra keyword
+        arguments still go into a dictionary, which is only created if you
+        pass some). The centroid, UUID and metadata type are only worked out
+        when first asked for.
+
+        Features without an ident are given a random UUID as their ident,
+        so they don't clash when keyed on ident.
     """
 
-    md_registry = MetadataRegistry()
+    __slots__ = ('ident', 'projection', 'specification', 'md_registry',
+                 '_shape', '_centroid', '_uuid', '_type', '_metadata',
+                 '__dict__')
 
     def __init__(self, shape, projection, specification, ident=None, **kwargs):
-        super(MappedFeature, self).__init__(name='mapped_feature')
-        self.ident = ident or self.uuid
+        self._uuid = self._type = self._centroid = self._metadata = None
+        if not ident:
+            # Features are keyed on their idents (e.g. in FeatureCollections)
+            # so features without one get a random UUID
+            ident = self._uuid = uuid.uuid4()
+        self.ident = ident
 
         # Store some info on the shape
         self.shape = shape
         self.projection = projection
-        self.centroid = self.shape.representative_point()
 
         # Store other metadata
         for attrib, value in kwargs.items():
             setattr(self, attrib, value)
         self.specification = specification
-        self.type = self.md_registry[self.specification].type
+        self.md_registry = current_registry()
+
+        # Weak registries only keep records alive while something else
+        # refers to them, so hang on to our record
+        if getattr(self.md_registry, 'weak', False):
+            self._metadata = self.md_registry[self.specification]
 
     def __repr__(self):
         """ String representation
@@ -41,17 +84,710 @@ class MappedFeature(id_object):
         info_str = info.format(self.ident, self.centroid)
         return info_str
 
+    def __getstate__(self):
+        """ Pickle support - registries stay in their own process
+        """
+        state = dict(getattr(self, '__dict__', {}))
+        for attrib in self.__slots__:
+            if attrib not in ('__dict__', 'md_registry') \
+                    and hasattr(self, attrib):
+                state[attrib] = getattr(self, attrib)
+        return state
+
+    def __setstate__(self, state):
+        for attrib, value in state.items():
+            setattr(self, attrib, value)
+        self.md_registry = current_registry()
+
+    @property
+    def shape(self):
+        """ The shapely geometry for the feature
+        """
+        return self._shape
+
+    @shape.setter
+    def shape(self, shape):
+        self._shape = shape
+        self._centroid = None
+
+    @property
+    def centroid(self):
+        """ A point guaranteed to lie within the shape
+        """
+        if self._centroid is None:
+            self._centroid = self._shape.representative_point()
+        return self._centroid
+
+    @property
+    def uuid(self):
+        """ The UUID for the feature, generated from its ident
+        """
+        if self._uuid is None:
+            ident = self.ident
+            if isinstance(ident, unicode):
+                ident = ident.encode('utf-8')
+            self._uuid = uuid.uuid5(uuid.NAMESPACE_DNS, str(ident))
+        return self._uuid
+
+    @property
+    def type(self):
+        """ The type of the feature's specification (e.g.
+            'gsml:GeologicUnit')
+        """
+        if self._type is None:
+            self._type = self.metadata.type
+        return self._type
+
     def reproject(self, new_projection):
         """ Reproject the shape to a new projection.
 
-            :param new_projection: The identifier for the new projection
-            :type new_projection: int
+            To reproject lots of features, use `reproject_features` which
+            transforms them all in one go.
+
+            :param new_projection: The identifier for the new projection,
+                either an EPSG code or a srsName (e.g. 'EPSG:3577')
+            :type new_projection: int or string
         """
-        raise NotImplementedError
-        # self.shape = type(self.shape)(project(self.shape.positions))
+        self.shape = project(self.shape, to_projection=new_projection,
+                             from_projection=self.projection)
+        self.projection = new_projection
 
     @property
     def metadata(self):
         """ Return the metadata associated with the MappedFeature
         """
+        if self._metadata is not None:
+            return self._metadata
         return self.md_registry[self.specification]
+
+
+class FeatureCollection(Collection):
+
+    """ A collection of MappedFeatures with a spatial index
+
+        Features are keyed by their ident. The spatial index (see
+        `pysiss.coverage.spatial_index.SpatialIndex`) is available as
+        `spatial_index`, and is updated as features are appended or deleted:
+
+            features = FeatureCollection(unmarshal_all('map.xml'))
+            features.spatial_index.containing((117.5, -31.2))
+
+        :param features: The features to add on initialization
+        :type features: list of MappedFeatures
+        :param **kwargs: Passed to the SpatialIndex constructor
+    """
+
+    key_attribute = 'ident'
+
+    def __init__(self, features=None, **kwargs):
+        self.spatial_index = SpatialIndex(**kwargs)
+        super(FeatureCollection, self).__init__(features)
+
+    def _added(self, features):
+        self.spatial_index.insert_many(features)
+
+    def _removed(self, feature):
+        self.spatial_index.delete(feature)
+
+    def reproject(self, new_projection):
+        """ Reproject all the features in the collection, and update the
+            spatial index
+
+            :param new_projection: The identifier for the new projection
+            :type new_projection: int or string
+        """
+        reproject_features(self, new_projection)
+        self.spatial_index = SpatialIndex(
+            self, node_capacity=self.spatial_index.node_capacity,
+            rebuild_fraction=self.spatial_index.rebuild_fraction)
+
+
+class FeatureStore(object):
+
+    """ A columnar store for large sets of MappedFeatures
+
+        Rather than keeping a Python object and a shapely geometry for each
+        feature, all the vertices are stored in one coordinate array, with
+        offset arrays giving the structure of each geometry:
+
+            -   `coords` is an (N, 2) array of vertices
+            -   `ring_offsets` gives the range of vertices in each ring (or
+                line, or point)
+            -   `part_offsets` gives the range of rings in each part (i.e.
+                the exterior and interiors of a polygon)
+            -   `geometry_offsets` gives the range of parts in each feature
+
+        so the vertices of ring i are `coords[ring_offsets[i]:ring_offsets[i +
+        1]]`. Feature idents, specifications, projections, geometry types
+        (indices into GEOMETRY_TYPES) and bounds are stored in their own
+        arrays. Bounds, areas and centroids are computed for all features at
+        once with NumPy, and MappedFeatures are only created when you ask for
+        them:
+
+            store = FeatureStore.from_features(unmarshal_all('big_map.xml'))
+            big = store.filter(store.area() > 1e6,
+                               bounds=(115, -35, 120, -30))
+            for feature in big:
+                print feature.metadata
+
+        Other attributes set on the original MappedFeatures are not stored.
+    """
+
+    def __init__(self, coords, ring_offsets, part_offsets, geometry_offsets,
+                 geometry_types, idents, specifications, projections,
+                 bounds=None):
+        super(FeatureStore, self).__init__()
+        self.coords = numpy.asarray(coords, dtype=float).reshape(-1, 2)
+        self.ring_offsets = numpy.asarray(ring_offsets, dtype=int)
+        self.part_offsets = numpy.asarray(part_offsets, dtype=int)
+        self.geometry_offsets = numpy.asarray(geometry_offsets, dtype=int)
+        self.geometry_types = numpy.asarray(geometry_types, dtype=numpy.int8)
+        self.idents = numpy.asarray(idents)
+        self.specifications = numpy.asarray(specifications)
+        self.projections = numpy.asarray(projections)
+        if bounds is None:
+            self.bounds = self._compute_bounds()
+        else:
+            self.bounds = numpy.asarray(bounds, dtype=float).reshape(-1, 4)
+        self._spatial_index = None
+
+    @classmethod
+    def from_features(cls, features):
+        """ Build a store from a sequence of MappedFeatures
+
+            :param features: The features to store
+            :type features: iterable of MappedFeatures
+            :raises ValueError: if a feature has an unsupported geometry type
+        """
+        coords, ring_sizes, part_sizes, geometry_sizes = [], [], [], []
+        types, idents, specifications, projections = [], [], [], []
+        for feature in features:
+            shape = feature.shape
+            try:
+                gtype = GEOMETRY_TYPES.index(type(shape))
+            except ValueError:
+                raise ValueError(
+                    ('Feature {0} has a {1} geometry, FeatureStore only '
+                     'supports {2}').format(
+                        feature.ident, shape.geom_type,
+                        ', '.join(t.__name__ for t in GEOMETRY_TYPES)))
+            parts = list(shape.geoms) if gtype > 2 else [shape]
+            for part in parts:
+                rings = [part.exterior] + list(part.interiors) \
+                    if isinstance(part, Polygon) else [part]
+                for ring in rings:
+                    ring_coords = numpy.asarray(ring.coords)[:, :2]
+                    coords.append(ring_coords)
+                    ring_sizes.append(len(ring_coords))
+                part_sizes.append(len(rings))
+            geometry_sizes.append(len(parts))
+            types.append(gtype)
+            idents.append(feature.ident)
+            specifications.append(feature.specification)
+            projections.append(feature.projection)
+        return cls(
+            coords=numpy.concatenate(coords) if coords
+            else numpy.empty((0, 2)),
+            ring_offsets=_offsets(ring_sizes),
+            part_offsets=_offsets(part_sizes),
+            geometry_offsets=_offsets(geometry_sizes),
+            geometry_types=types,
+            idents=idents,
+            specifications=specifications,
+            projections=projections)
+
+    @classmethod
+    def concatenate(cls, stores):
+        """ Join a sequence of FeatureStores into one store
+        """
+        stores = list(stores)
+        if not stores:
+            return cls.from_features([])
+
+        def _join(attr, offsets=False):
+            arrays = [getattr(store, attr) for store in stores]
+            if not offsets:
+                return numpy.concatenate(arrays)
+
+            # Shift each store's offsets along by the size of the ones before
+            starts = numpy.cumsum([0] + [array[-1] for array in arrays[:-1]])
+            return numpy.concatenate(
+                [arrays[0][:1]] + [array[1:] + start
+                                   for array, start in zip(arrays, starts)])
+
+        return cls(coords=_join('coords'),
+                   ring_offsets=_join('ring_offsets', True),
+                   part_offsets=_join('part_offsets', True),
+                   geometry_offsets=_join('geometry_offsets', True),
+                   geometry_types=_join('geometry_types'),
+                   idents=_join('idents'),
+                   specifications=_join('specifications'),
+                   projections=_join('projections'),
+                   bounds=_join('bounds'))
+
+    def __len__(self):
+        return len(self.idents)
+
+    def __repr__(self):
+        return 'FeatureStore with {0} features and {1} vertices'.format(
+            len(self), len(self.coords))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.feature(idx)
+
+    def __getitem__(self, idx):
+        """ Return a MappedFeature, or a new FeatureStore if given a slice,
+            a boolean mask or an array of indices
+        """
+        if isinstance(idx, (int, long, numpy.integer)):
+            return self.feature(idx)
+        elif isinstance(idx, slice):
+            idx = numpy.arange(len(self))[idx]
+        return self.take(idx)
+
+    def shape(self, idx):
+        """ Return the shapely geometry for a feature
+
+            :param idx: The index of the feature
+            :type idx: int
+        """
+        gtype = GEOMETRY_TYPES[self.geometry_types[idx]]
+        parts = []
+        for part in range(self.geometry_offsets[idx],
+                          self.geometry_offsets[idx + 1]):
+            rings = [self.coords[self.ring_offsets[ring]:
+                                 self.ring_offsets[ring + 1]]
+                     for ring in range(self.part_offsets[part],
+                                       self.part_offsets[part + 1])]
+            if gtype in (Polygon, MultiPolygon):
+                parts.append(Polygon(rings[0], rings[1:]))
+            elif gtype is Point:
+                parts.append(Point(rings[0][0]))
+            else:
+                parts.append(LineString(rings[0]))
+        return gtype(parts) if gtype in (MultiPolygon, MultiLineString) \
+            else parts[0]
+
+    def feature(self, idx):
+        """ Create a MappedFeature for a feature in the store
+
+            The feature's specification is looked up in the current
+            metadata registry.
+
+            :param idx: The index of the feature
+            :type idx: int
+        """
+        return MappedFeature(shape=self.shape(idx),
+                             projection=_item(self.projections[idx]),
+                             specification=_item(self.specifications[idx]),
+                             ident=_item(self.idents[idx]))
+
+    def take(self, indices):
+        """ Return a new FeatureStore containing a subset of the features
+
+            :param indices: The features to keep, as an array of indices or
+                a boolean mask
+        """
+        indices = numpy.asarray(indices)
+        if indices.dtype == bool:
+            indices = numpy.flatnonzero(indices)
+        else:
+            indices = indices.astype(int)
+        parts = _ranges(self.geometry_offsets[indices],
+                        self.geometry_offsets[indices + 1])
+        rings = _ranges(self.part_offsets[parts],
+                        self.part_offsets[parts + 1])
+        coords = _ranges(self.ring_offsets[rings],
+                         self.ring_offsets[rings + 1])
+        return FeatureStore(
+            coords=self.coords[coords],
+            ring_offsets=_offsets(self.ring_offsets[rings + 1]
+                                  - self.ring_offsets[rings]),
+            part_offsets=_offsets(self.part_offsets[parts + 1]
+                                  - self.part_offsets[parts]),
+            geometry_offsets=_offsets(self.geometry_offsets[indices + 1]
+                                      - self.geometry_offsets[indices]),
+            geometry_types=self.geometry_types[indices],
+            idents=self.idents[indices],
+            specifications=self.specifications[indices],
+            projections=self.projections[indices],
+            bounds=self.bounds[indices])
+
+    def reproject(self, new_projection):
+        """ Return a new FeatureStore with all the features reprojected
+
+            Features are transformed in one array call for each distinct
+            source projection.
+
+            :param new_projection: The identifier for the new projection
+            :type new_projection: int or string
+        """
+        feature_of_coord = self._feature_of_coord()
+        coords = self.coords.copy()
+        for projection in numpy.unique(self.projections):
+            mask = (self.projections == projection)[feature_of_coord]
+            coords[mask] = transform(coords[mask], _item(projection),
+                                     new_projection)
+        return FeatureStore(
+            coords=coords,
+            ring_offsets=self.ring_offsets,
+            part_offsets=self.part_offsets,
+            geometry_offsets=self.geometry_offsets,
+            geometry_types=self.geometry_types,
+            idents=self.idents,
+            specifications=self.specifications,
+            projections=[new_projection] * len(self))
+
+    def simplify(self, tolerance, preserve_topology=True):
+        """ Return a new FeatureStore with simplified geometries
+
+            Each geometry is simplified with shapely's Douglas-Peucker
+            `simplify`, so no vertex moves more than `tolerance`. Geometries
+            which would collapse are kept as they are.
+
+            :param tolerance: The maximum distance between the original and
+                simplified geometries
+            :type tolerance: float
+            :param preserve_topology: Whether to prevent self-intersections
+                and collapsed rings. Optional, defaults to True.
+            :type preserve_topology: bool
+        """
+        features = []
+        for idx in range(len(self)):
+            shape = self.shape(idx)
+            simple = shape.simplify(tolerance, preserve_topology)
+            if simple.is_empty or type(simple) not in GEOMETRY_TYPES:
+                simple = shape
+            features.append(StoredFeature(
+                ident=self.idents[idx], shape=simple,
+                specification=self.specifications[idx],
+                projection=self.projections[idx]))
+        if not features:
+            return self.take([])
+        return FeatureStore.from_features(features)
+
+    def filter(self, mask=None, bounds=None, specification=None):
+        """ Return a new FeatureStore containing the features which match
+            all the given criteria
+
+            :param mask: A boolean mask of features to keep. Optional,
+                defaults to None.
+            :type mask: numpy.ndarray
+            :param bounds: Only keep features whose bounding boxes intersect
+                this box, given as (minx, miny, maxx, maxy). Optional,
+                defaults to None.
+            :type bounds: tuple
+            :param specification: Only keep features with this
+                specification key. Optional, defaults to None.
+        """
+        keep = numpy.ones(len(self), dtype=bool)
+        if mask is not None:
+            keep &= numpy.asarray(mask, dtype=bool)
+        if bounds is not None:
+            keep &= self.intersects_bounds(bounds)
+        if specification is not None:
+            keep &= self.specifications == specification
+        return self.take(keep)
+
+    def intersects_bounds(self, bounds):
+        """ Return a mask of the features whose bounding boxes intersect a
+            bounding box
+
+            :param bounds: The bounding box as (minx, miny, maxx, maxy)
+            :type bounds: tuple
+        """
+        minx, miny, maxx, maxy = bounds
+        return ((self.bounds[:, 0] <= maxx) & (self.bounds[:, 2] >= minx)
+                & (self.bounds[:, 1] <= maxy) & (self.bounds[:, 3] >= miny))
+
+    @property
+    def spatial_index(self):
+        """ A SpatialIndex over the bounds of the features in the store,
+            built when first needed
+
+            The indexed entries are StoreEntries whose idents are the
+            positions of the features in the store.
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(
+                [StoreEntry(idx) for idx in range(len(self))],
+                bounds=self.bounds)
+        return self._spatial_index
+
+    def contains_points(self, points, indices, max_segments=2 ** 22):
+        """ Test whether each of a set of points lies inside a feature
+
+            This uses a vectorised even-odd crossing test over the segments
+            of each feature, so holes and multipolygons are handled. Points
+            on a boundary may go either way, and only polygonal features can
+            contain points.
+
+            :param points: The points, as an (N, 2) array
+            :type points: numpy.ndarray
+            :param indices: The index of the feature to test for each point
+            :type indices: numpy.ndarray
+            :param max_segments: The maximum number of point/segment pairs
+                to test at once, to bound memory use. Optional, defaults to
+                2 ** 22.
+            :type max_segments: int
+            :returns: a boolean array, True where the point is inside its
+                feature
+        """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        indices = numpy.asarray(indices, dtype=int)
+        result = numpy.zeros(len(points), dtype=bool)
+        polygonal = numpy.in1d(self.geometry_types[indices], POLYGONAL_TYPES)
+        if not polygonal.any():
+            return result
+
+        # Segments are stored in vertex order, so each feature's segments
+        # are contiguous
+        start, _, _ = self._segments()
+        feature_of_segment = self._feature_of_coord()[start]
+        segment_offsets = _offsets(numpy.bincount(feature_of_segment,
+                                                  minlength=len(self)))
+        sizes = numpy.where(polygonal,
+                            segment_offsets[indices + 1]
+                            - segment_offsets[indices], 0)
+
+        # Test pairs in chunks so we don't blow out memory
+        chunk_start, cumulative = 0, numpy.cumsum(sizes)
+        while chunk_start < len(points):
+            done = cumulative[chunk_start - 1] if chunk_start else 0
+            chunk_stop = max(chunk_start + 1, numpy.searchsorted(
+                cumulative, done + max_segments, side='right'))
+            pairs = numpy.arange(chunk_start, chunk_stop)
+            segments = start[_ranges(segment_offsets[indices[pairs]],
+                                     segment_offsets[indices[pairs]]
+                                     + sizes[pairs])]
+            pair = numpy.repeat(pairs, sizes[pairs])
+            x0, y0 = self.coords[segments, 0], self.coords[segments, 1]
+            x1, y1 = self.coords[segments + 1, 0], self.coords[segments + 1, 1]
+            px, py = points[pair, 0], points[pair, 1]
+            straddles = (y0 > py) != (y1 > py)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                crossing = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+                crosses = straddles & (px < crossing)
+            counts = numpy.bincount(pair - chunk_start, crosses,
+                                    minlength=len(pairs))
+            result[pairs] = counts % 2 == 1
+            chunk_start = chunk_stop
+        return result
+
+    def locate(self, points):
+        """ Find the feature containing each of a set of points
+
+            Candidate features are found with the store's spatial index, and
+            then tested with `contains_points`. Where features overlap, the
+            first one in the store wins.
+
+            :param points: The points, as an (N, 2) array in the same
+                projection as the features
+            :type points: numpy.ndarray
+            :returns: an array of feature indices, with -1 where a point
+                isn't in any feature (or is NaN)
+        """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        result = numpy.empty(len(points), dtype=int)
+        result.fill(len(self))
+        valid = numpy.flatnonzero(~numpy.isnan(points).any(axis=1))
+        if len(valid) and len(self):
+            queries, entries = self.spatial_index.query_pairs(
+                numpy.hstack([points[valid], points[valid]]))
+            indices = numpy.array([entry.ident for entry in entries],
+                                  dtype=int)
+            queries = valid[queries]
+            inside = self.contains_points(points[queries], indices)
+            numpy.minimum.at(result, queries[inside], indices[inside])
+        result[result == len(self)] = -1
+        return result
+
+    def area(self):
+        """ Return the area of each feature (zero for points and lines)
+        """
+        return self._polygon_moments()[0]
+
+    def length(self):
+        """ Return the length of each feature's boundary (or of the lines
+            themselves for linear features)
+        """
+        return self._segment_moments()[0]
+
+    def centroid(self):
+        """ Return the centroid of each feature as an (N, 2) array
+
+            Polygons use the area-weighted centroid, lines the
+            length-weighted centroid and points the mean of their vertices,
+            as for shapely's `centroid`.
+        """
+        nfeatures = len(self)
+        feature_of_coord = self._feature_of_coord()
+        counts = numpy.bincount(feature_of_coord, minlength=nfeatures)
+        origin = self.bounds[:, :2]
+        local = self.coords - origin[feature_of_coord]
+        centroid = numpy.column_stack([
+            numpy.bincount(feature_of_coord, local[:, dim],
+                           minlength=nfeatures)
+            for dim in (0, 1)]) / numpy.maximum(counts, 1)[:, numpy.newaxis]
+
+        # Use line moments for lines and polygon moments for polygons
+        length, line_moments = self._segment_moments()
+        linear = numpy.in1d(self.geometry_types, LINEAR_TYPES) & (length > 0)
+        centroid[linear] = line_moments[linear] \
+            / length[linear, numpy.newaxis]
+        area, area_moments = self._polygon_moments()
+        polygonal = numpy.in1d(self.geometry_types, POLYGONAL_TYPES) \
+            & (area > 0)
+        centroid[polygonal] = area_moments[polygonal] \
+            / area[polygonal, numpy.newaxis]
+        return centroid + origin
+
+    def _compute_bounds(self):
+        """ Work out the bounding box of each feature
+        """
+        starts = self.ring_offsets[
+            self.part_offsets[self.geometry_offsets[:-1]]]
+        if len(starts) == 0:
+            return numpy.empty((0, 4))
+        return numpy.hstack([numpy.minimum.reduceat(self.coords, starts),
+                             numpy.maximum.reduceat(self.coords, starts)])
+
+    def _ring_structure(self):
+        """ Return the feature each ring belongs to, and whether it's the
+            first ring in its part
+        """
+        nrings = len(self.ring_offsets) - 1
+        part_of_ring = numpy.repeat(numpy.arange(len(self.part_offsets) - 1),
+                                    numpy.diff(self.part_offsets))
+        feature_of_part = numpy.repeat(numpy.arange(len(self)),
+                                       numpy.diff(self.geometry_offsets))
+        first = numpy.zeros(nrings, dtype=bool)
+        first[self.part_offsets[:-1][numpy.diff(self.part_offsets) > 0]] = True
+        return feature_of_part[part_of_ring], first
+
+    def _feature_of_coord(self):
+        """ Return the feature each vertex belongs to
+        """
+        feature_of_ring, _ = self._ring_structure()
+        return numpy.repeat(feature_of_ring, numpy.diff(self.ring_offsets))
+
+    def _segments(self):
+        """ Return the index of the first vertex in each segment, and the
+            ring each segment belongs to
+
+            Segments join consecutive vertices in the same ring. Vertices
+            are shifted to each feature's lower-left corner to keep the
+            arithmetic well conditioned.
+        """
+        nrings = len(self.ring_offsets) - 1
+        ring_of_coord = numpy.repeat(numpy.arange(nrings),
+                                     numpy.diff(self.ring_offsets))
+        if len(self.coords) < 2:
+            return numpy.empty(0, dtype=int), ring_of_coord[:0], \
+                numpy.empty((0, 2))
+        start = numpy.flatnonzero(ring_of_coord[:-1] == ring_of_coord[1:])
+        feature_of_ring, _ = self._ring_structure()
+        origin = self.bounds[feature_of_ring[ring_of_coord], :2]
+        return start, ring_of_coord[start], self.coords - origin
+
+    def _segment_moments(self):
+        """ Return the total segment length for each feature, and the
+            length-weighted sum of segment midpoints (relative to the
+            feature's lower-left corner)
+        """
+        nfeatures = len(self)
+        start, ring, local = self._segments()
+        feature_of_ring, _ = self._ring_structure()
+        feature = feature_of_ring[ring]
+        delta = local[start + 1] - local[start]
+        length = numpy.hypot(delta[:, 0], delta[:, 1])
+        middle = (local[start + 1] + local[start]) / 2.
+        moments = numpy.column_stack([
+            numpy.bincount(feature, length * middle[:, dim],
+                           minlength=nfeatures)
+            for dim in (0, 1)])
+        return numpy.bincount(feature, length, minlength=nfeatures), moments
+
+    def _polygon_moments(self):
+        """ Return the area of each feature, and the area-weighted sum of
+            ring centroids (relative to the feature's lower-left corner)
+
+            Exterior rings add area and interior rings subtract it,
+            whichever way round the rings are oriented.
+        """
+        nfeatures = len(self)
+        nrings = len(self.ring_offsets) - 1
+        start, ring, local = self._segments()
+        feature_of_ring, first = self._ring_structure()
+
+        # Shoelace formula for the signed area and moments of each ring
+        x0, y0 = local[start, 0], local[start, 1]
+        x1, y1 = local[start + 1, 0], local[start + 1, 1]
+        cross = x0 * y1 - x1 * y0
+        ring_area = numpy.bincount(ring, cross, minlength=nrings) / 2.
+        ring_moments = numpy.column_stack([
+            numpy.bincount(ring, (x0 + x1) * cross, minlength=nrings),
+            numpy.bincount(ring, (y0 + y1) * cross, minlength=nrings)]) / 6.
+
+        # Combine rings into features, only counting polygons
+        polygonal = numpy.in1d(self.geometry_types[feature_of_ring],
+                               POLYGONAL_TYPES)
+        role = numpy.where(first, 1., -1.) * polygonal
+        area = numpy.bincount(feature_of_ring, role * numpy.abs(ring_area),
+                              minlength=nfeatures)
+        weights = role * numpy.sign(ring_area)
+        moments = numpy.column_stack([
+            numpy.bincount(feature_of_ring, weights * ring_moments[:, dim],
+                           minlength=nfeatures)
+            for dim in (0, 1)])
+        return area, moments
+
+
+def reproject_features(features, new_projection):
+    """ Reproject a set of MappedFeatures in place
+
+        Rather than transforming each geometry separately, the coordinates of
+        all the features are packed into a FeatureStore and transformed in
+        one array call for each source projection.
+
+        :param features: The features to reproject
+        :type features: list of MappedFeatures
+        :param new_projection: The identifier for the new projection
+        :type new_projection: int or string
+    """
+    features = [feature for feature in features
+                if normalize_projection(feature.projection)
+                != normalize_projection(new_projection)]
+    if not features:
+        return
+    store = FeatureStore.from_features(features).reproject(new_projection)
+    for idx, feature in enumerate(features):
+        feature.shape = store.shape(idx)
+        feature.projection = new_projection
+
+
+def _offsets(sizes):
+    """ Convert an array of sizes into an array of offsets
+    """
+    offsets = numpy.zeros(len(sizes) + 1, dtype=int)
+    numpy.cumsum(sizes, out=offsets[1:])
+    return offsets
+
+
+def _ranges(starts, stops):
+    """ Return the concatenation of range(start, stop) for each pair of
+        starts and stops, without a Python loop
+    """
+    sizes = stops - starts
+    total = sizes.sum()
+    if total == 0:
+        return numpy.empty(0, dtype=int)
+    shifts = numpy.repeat(starts - _offsets(sizes)[:-1], sizes)
+    return numpy.arange(total) + shifts
+
+
+def _item(value):
+    """ Convert a NumPy scalar into the equivalent Python object
+    """
+    return value.item() if isinstance(value, numpy.generic) else value
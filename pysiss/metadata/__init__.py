@@ -6,7 +6,10 @@
     description: Functions to deal with metadata
 """
 
-from .registry import MetadataRegistry
+from .registry import MetadataRegistry, ScopedMetadataRegistry, \
+    current_registry, metadata_scope, shared_key
 from .metadata import Metadata
+from .table import extract_table
 
-__all__ = [MetadataRegistry, Metadata]
+__all__ = [MetadataRegistry, ScopedMetadataRegistry, current_registry,
+           metadata_scope, shared_key, Metadata, extract_table]
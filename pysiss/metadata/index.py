@@ -0,0 +1,120 @@
+""" file:   index.py (pysiss.metadata)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Monday 1 September, 2014
+
+    description: Secondary indexes over metadata records
+
+    An index extracts a value from each record using an XPath query, and
+    maps each value back to the keys of the records it came from. Metadata
+    registries keep their indexes up to date as records are registered and
+    deregistered, so finding records with a given value is a dictionary
+    lookup rather than a query over every record.
+"""
+
+from lxml import etree
+
+
+class MetadataIndex(object):
+
+    """ An index mapping the values extracted from metadata records by an
+        XPath query to the keys of those records
+
+        Queries which return several values (e.g. all the lithologies in a
+        GeologicUnit) index the record under each value. Element results are
+        indexed by their text.
+
+        :param name: The name of the indexed field. If a record has already
+            extracted a field with this name (see `Metadata.fields`), those
+            values are used rather than evaluating the query again.
+        :type name: string
+        :param xpath: The query to extract the field values
+        :type xpath: string or `lxml.etree.XPath`
+        :param namespaces: The namespace prefixes used in the query, if it is
+            a string. Optional, defaults to None.
+        :type namespaces: dict
+    """
+
+    def __init__(self, name, xpath, namespaces=None):
+        super(MetadataIndex, self).__init__()
+        self.name = name
+        if isinstance(xpath, etree.XPath):
+            self.xpath = xpath
+        else:
+            self.xpath = etree.XPath(xpath, namespaces=namespaces,
+                                     smart_strings=False)
+        self._keys = {}  # maps values to sets of record keys
+        self._values = {}  # maps record keys to values
+
+    def __repr__(self):
+        return 'MetadataIndex {0} with {1} values'.format(self.name,
+                                                          len(self._keys))
+
+    def extract(self, metadata_item, tree=None):
+        """ Return the values of the indexed field for a metadata record
+
+            :param metadata_item: The record
+            :type metadata_item: pysiss.metadata.Metadata
+            :param tree: The record's tree, if it has already been parsed.
+                Optional, defaults to None.
+            :returns: a set of values
+        """
+        fields = getattr(metadata_item, 'fields', {})
+        if self.name in fields:
+            result = fields[self.name]
+        else:
+            result = self.xpath(tree if tree is not None
+                                else metadata_item.tree)
+        if not isinstance(result, list):
+            result = [result]
+        return set(_plain(value) for value in result)
+
+    def add(self, key, metadata_item, tree=None):
+        """ Add a metadata record to the index
+        """
+        self.discard(key)
+        values = self.extract(metadata_item, tree)
+        self._values[key] = values
+        for value in values:
+            self._keys.setdefault(value, set()).add(key)
+
+    def discard(self, key):
+        """ Remove a metadata record from the index, if it is there
+        """
+        for value in self._values.pop(key, ()):
+            keys = self._keys[value]
+            keys.discard(key)
+            if not keys:
+                del self._keys[value]
+
+    def clear(self):
+        """ Remove all records from the index
+        """
+        self._keys.clear()
+        self._values.clear()
+
+    def lookup(self, value):
+        """ Return the keys of the records with the given value
+        """
+        return set(self._keys.get(value, ()))
+
+    def values(self):
+        """ Return all the values in the index
+        """
+        return self._keys.keys()
+
+
+def _plain(value):
+    """ Convert an XPath result into a plain value for indexing
+
+        Element results are converted to their text, and lxml's 'smart'
+        strings are converted to plain strings so they don't keep the tree
+        alive.
+    """
+    if etree.iselement(value):
+        value = value.text
+    if isinstance(value, str):
+        return str(value)
+    elif isinstance(value, basestring):
+        return unicode(value)
+    return value
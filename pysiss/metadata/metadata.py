@@ -10,33 +10,131 @@
 """
 
 from ..utilities import id_object
-from .registry import MetadataRegistry
+from .registry import current_registry
+
+from lxml import etree
 
 
 class Metadata(id_object):
 
     """ Class to store metadata record
+
+        Records can be stored either as a live lxml tree, or in a compact form
+        as serialized XML which is reparsed on demand whenever the tree is
+        needed (e.g. in `Metadata.xpath`). Compact records use much less
+        memory, at the cost of slower queries. Set `Metadata.compact = True`
+        to make all new records compact by default (e.g. before unmarshalling
+        a large map).
+
+        Key fields can be pulled out of the record once at construction using
+        the `extract` argument, so that common queries don't need to reparse
+        compact records.
+
+        :param ident: An identifier for the record. Optional, if None then
+            the record's UUID is used.
+        :type ident: string
+        :param tree: The metadata record, either as an lxml element or as
+            serialized XML
+        :type tree: `lxml.etree.Element` or bytes
+        :param type: The type of the metadata record (e.g.
+            'gsml:GeologicUnit')
+        :type type: string
+        :param compact: Whether to store the record as serialized XML.
+            Optional, defaults to `Metadata.compact`.
+        :type compact: bool
+        :param extract: A mapping of field names to XPath queries, which are
+            evaluated at construction and the results stored in
+            `Metadata.fields`. Queries can either be `lxml.etree.XPath`
+            instances or strings, in which case the namespace prefixes
+            declared on the record can be used. Optional, defaults to None.
+        :type extract: dict
     """
 
-    registry = MetadataRegistry()
+    # Whether records are stored as serialized XML by default
+    compact = False
 
-    def __init__(self, ident, tree, type, **kwargs):
+    def __init__(self, ident, tree, type, compact=None, extract=None,
+                 **kwargs):
         super(Metadata, self).__init__(name=type)
         self.ident = ident or self.uuid
-        self.tree = tree
         self.type = type
+        if compact is not None:
+            self.compact = compact
+
+        # Store the record in the requested form
+        if isinstance(tree, bytes):
+            serialized, tree = tree, None
+        else:
+            serialized = None
+        if self.compact:
+            self._tree = None
+            self._serialized = serialized or etree.tostring(tree)
+        else:
+            self._tree = tree if tree is not None \
+                else etree.fromstring(serialized)
+            self._serialized = None
+
+        # Pull out key fields while we have a tree to hand
+        self.fields = {}
+        if extract:
+            tree = tree if tree is not None else self.tree
+            for name, query in extract.items():
+                if isinstance(query, etree.XPath):
+                    self.fields[name] = query(tree)
+                else:
+                    self.fields[name] = tree.xpath(
+                        query, namespaces=_prefixes(tree),
+                        smart_strings=False)
 
         # Store other metadata
         for attrib, value in kwargs.items():
             setattr(self, attrib, value)
 
-        # Register yourself with the registry
-        self.registry.register(self)
+        # Register yourself with the current registry
+        current_registry().register(self)
 
     def __str__(self):
         return 'Metadata record {0}, of type {1}'.format(self.ident, self.type)
 
+    def __getstate__(self):
+        """ Pickle support - lxml trees can't be pickled so we serialize them
+        """
+        state = self.__dict__.copy()
+        if state['_tree'] is not None:
+            state['_tree'] = etree.tostring(state['_tree'])
+        return state
+
+    def __setstate__(self, state):
+        if state['_tree'] is not None:
+            state['_tree'] = etree.fromstring(state['_tree'])
+        self.__dict__.update(state)
+
+    @property
+    def tree(self):
+        """ The record as an lxml tree
+
+            Compact records are reparsed every time this is accessed.
+        """
+        if self._tree is not None:
+            return self._tree
+        return etree.fromstring(self._serialized)
+
+    @property
+    def serialized(self):
+        """ The record as serialized XML
+        """
+        if self._serialized is not None:
+            return self._serialized
+        return etree.tostring(self._tree)
+
     def xpath(self, *args, **kwargs):
         """ Pass XPath queries through to underlying tree
         """
         return self.tree.xpath(*args, **kwargs)
+
+
+def _prefixes(tree):
+    """ Return the namespace prefixes declared on an element, suitable for
+        passing to XPath queries
+    """
+    return dict((k, v) for k, v in tree.nsmap.items() if k is not None)
@@ -7,28 +7,494 @@
 
     Metadata descriptions can be shared by many different objects, so it makes
     sense to seperate these out into a seperate registry.
+
+    By default everything goes into the process-wide MetadataRegistry, which
+    never releases anything. For long-running processes you can use a scoped
+    registry instead:
+
+        with metadata_scope(max_size=10000) as registry:
+            features = unmarshal_all('big_map.xml')
+
+    Records created inside the `with` block go into the scoped registry, and
+    objects created there (e.g. MappedFeatures) keep using it after the block
+    exits. Scopes are per-thread, so threads can load data into their own
+    registries at the same time.
 """
 
 from ..utilities import Singleton
+from .index import MetadataIndex
 
+from collections import MutableMapping, OrderedDict
+from contextlib import contextmanager
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import threading
+import weakref
 
-class MetadataRegistry(dict):
+# Stacks of active scoped registries for each thread, the last one is current
+_SCOPES = threading.local()
 
-    """ A registry to store metadata instances
+# Don't bother compacting spill files with less than this many bytes unused
+_MIN_COMPACT = 2 ** 20
 
-        Since GeoSciML allows metadata reuse, we need to have a central
-        repository of metadata which stores the actual etrees, and objects can
-        refer to keys within this repository.
+
+class RegistryIndexMixin(object):
+
+    """ Registration and secondary indexes for metadata registries
+
+        Records with a content digest (see
+        `pysiss.vocabulary.gsml.unmarshallers.canonical_digest`) are indexed
+        by digest in `digests`, so that identical records can be shared.
+
+        You can also declare secondary indexes on fields extracted from the
+        records with XPath queries:
+
+            registry.add_index('lithology',
+                './/gsml:lithology/@xlink:href', namespaces=NAMESPACES)
+            keys = registry.find(type='gsml:GeologicUnit',
+                                 lithology=GRANITE_URN)
+
+        Indexes are kept up to date by `register` and `deregister`, so
+        lookups don't need to query every record.
     """
 
-    __metaclass__ = Singleton
+    def _init_indexes(self):
+        self.digests = {}  # maps content digests to keys
+        self.indexes = {}  # maps field names to MetadataIndexes
+        self._types = {}  # maps record types to sets of keys
 
     def register(self, metadata_item):
         """ Register a metadata item in the registry
         """
-        self[metadata_item.ident] = metadata_item
+        key = metadata_item.ident
+        self[key] = metadata_item
+
+        # Index by digest
+        digest = getattr(metadata_item, 'digest', None)
+        if digest is not None and shared_key(self, digest) is None:
+            self.digests[digest] = key
+
+        # Index by type and declared fields, parsing the tree at most once
+        self._types.setdefault(metadata_item.type, set()).add(key)
+        if self.indexes:
+            fields = getattr(metadata_item, 'fields', {})
+            if all(name in fields for name in self.indexes):
+                tree = None
+            else:
+                tree = metadata_item.tree
+            for index in self.indexes.values():
+                index.add(key, metadata_item, tree)
 
     def deregister(self, metadata_key):
         """ Deregister the given metadata item given by the key
         """
+        metadata_item = self[metadata_key]
         del self[metadata_key]
+        keys = self._types.get(metadata_item.type)
+        if keys is not None:
+            keys.discard(metadata_key)
+        for index in self.indexes.values():
+            index.discard(metadata_key)
+
+    def add_index(self, name, xpath, namespaces=None):
+        """ Add a secondary index on a field of the metadata records
+
+            Records which are already registered are added to the new index.
+
+            :param name: The name of the field. This is the keyword used to
+                look up values in `find`.
+            :type name: string
+            :param xpath: The query to extract the field from a record
+            :type xpath: string or `lxml.etree.XPath`
+            :param namespaces: The namespace prefixes used in the query, if
+                it is a string. Optional, defaults to None.
+            :type namespaces: dict
+            :returns: the new MetadataIndex
+        """
+        index = MetadataIndex(name, xpath, namespaces)
+        for key in self._indexed_keys():
+            index.add(key, self[key])
+        self.indexes[name] = index
+        return index
+
+    def remove_index(self, name):
+        """ Remove a secondary index
+        """
+        del self.indexes[name]
+
+    def find(self, type=None, **values):
+        """ Find the keys of the records with the given type and field values
+
+            Each keyword argument gives a field name and the value to look up
+            in that field's index, e.g. `find(lithology='granite')`. Only
+            records matching every criterion are returned.
+
+            :param type: The record type (e.g. 'gsml:GeologicUnit').
+                Optional, defaults to None (i.e. any type).
+            :type type: string
+            :returns: a set of registry keys
+        """
+        matches = []
+        if type is not None:
+            matches.append(set(self._types.get(type, ())))
+        for name, value in values.items():
+            try:
+                matches.append(self.indexes[name].lookup(value))
+            except KeyError:
+                raise KeyError(
+                    ('No index on field {0}. '
+                     'Available indexes are {1}').format(
+                        name, self.indexes.keys()))
+        if not matches:
+            return set(self._indexed_keys())
+
+        # Intersect starting from the smallest set, and drop keys which have
+        # gone away (e.g. weak references)
+        matches.sort(key=len)
+        result = matches[0].intersection(*matches[1:])
+        return set(key for key in result if key in self)
+
+    def _indexed_keys(self):
+        """ Return the keys of the registered records (i.e. not aliases)
+        """
+        return [key for keys in self._types.values() for key in keys
+                if key in self]
+
+    def _clear_indexes(self):
+        """ Remove all records from the indexes
+        """
+        self.digests.clear()
+        self._types.clear()
+        for index in self.indexes.values():
+            index.clear()
+
+
+class MetadataRegistry(RegistryIndexMixin, dict):
+
+    """ A registry to store metadata instances
+
+        Since GeoSciML allows metadata reuse, we need to have a central
+        repository of metadata which stores the actual etrees, and objects can
+        refer to keys within this repository.
+
+        See RegistryIndexMixin for details of indexing records.
+    """
+
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        super(MetadataRegistry, self).__init__()
+        self._init_indexes()
+
+    def clear(self):
+        """ Remove all records from the registry
+        """
+        super(MetadataRegistry, self).clear()
+        self._clear_indexes()
+
+
+class ScopedMetadataRegistry(RegistryIndexMixin, MutableMapping):
+
+    """ A registry to store metadata instances which can release records
+
+        Unlike MetadataRegistry, you can have as many of these as you like.
+        Records can be held in one of three ways:
+
+            -   By default, all records are held in memory (just like
+                MetadataRegistry)
+            -   If `weak` is True, records are only held while something else
+                refers to them. MappedFeatures hold a reference to their own
+                record when their registry is weak, so records are released
+                when the last feature using them goes away. Since records are
+                usually created before the objects that use them, new records
+                are pinned in memory until `release` is called (which happens
+                automatically when a `metadata_scope` block exits).
+            -   If `max_size` is given, at most that many records are held in
+                memory and the least recently used records are evicted. If
+                `spill` is True, evicted records are written to an on-disk
+                store and transparently reloaded when they are next looked
+                up; otherwise they are dropped.
+
+        Call `close` to remove the on-disk store when you're done. See
+        RegistryIndexMixin for details of indexing records.
+
+        :param max_size: The maximum number of records to hold in memory.
+            Optional, defaults to None (i.e. unbounded).
+        :type max_size: int
+        :param weak: Whether to hold weak references to records. Optional,
+            defaults to False. Can't be used with max_size.
+        :type weak: bool
+        :param spill: Whether to spill evicted records to disk. Optional,
+            defaults to True.
+        :type spill: bool
+        :param spill_path: The directory to keep spilled records in.
+            Optional, defaults to a temporary directory.
+        :type spill_path: string
+    """
+
+    def __init__(self, max_size=None, weak=False, spill=True,
+                 spill_path=None):
+        super(ScopedMetadataRegistry, self).__init__()
+        if weak and max_size is not None:
+            raise ValueError("You should only specify one of the weak or "
+                             "max_size keyword arguments to "
+                             "ScopedMetadataRegistry.")
+        self.max_size = max_size
+        self.weak = weak
+        self.spill = spill and max_size is not None
+        self._spill_path = spill_path
+        self._temporary = spill_path is None
+        self._store = None
+        self._spilled = {}  # maps keys to locations in the on-disk store
+        self._init_indexes()
+        self._pinned = {}  # strong references to new records in weak mode
+        if weak:
+            self._resident = weakref.WeakValueDictionary()
+        else:
+            self._resident = OrderedDict()
+
+    def __getitem__(self, key):
+        try:
+            value = self._resident[key]
+        except KeyError:
+            if key not in self._spilled:
+                raise
+            value = self._store.read(self._spilled.pop(key))
+            self._spill_changed()
+            self[key] = value
+            return value
+
+        # Mark as most recently used
+        if self.max_size is not None:
+            del self._resident[key]
+            self._resident[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._spilled:
+            self._store.discard(self._spilled.pop(key))
+            self._spill_changed()
+        self._resident.pop(key, None)
+        self._resident[key] = value
+        if self.weak:
+            self._pinned[key] = value
+        if self.max_size is not None:
+            while len(self._resident) > self.max_size:
+                self._evict()
+
+    def __delitem__(self, key):
+        if key in self._spilled:
+            self._store.discard(self._spilled.pop(key))
+            self._spill_changed()
+        else:
+            del self._resident[key]
+            self._pinned.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._resident or key in self._spilled
+
+    def __iter__(self):
+        for key in list(self._resident.keys()):
+            yield key
+        for key in list(self._spilled.keys()):
+            yield key
+
+    def __len__(self):
+        return len(self._resident) + len(self._spilled)
+
+    @property
+    def resident(self):
+        """ The number of records currently held in memory
+        """
+        return len(self._resident)
+
+    def release(self):
+        """ Unpin new records in a weak registry, so that records which
+            nothing else refers to can be released
+        """
+        self._pinned.clear()
+
+    def clear(self):
+        """ Remove all records from the registry
+        """
+        self._resident.clear()
+        self._pinned.clear()
+        self._spilled.clear()
+        if self._store is not None:
+            self._store.clear()
+        self._clear_indexes()
+
+    def close(self):
+        """ Remove all records and the on-disk store for spilled records
+        """
+        self._resident.clear()
+        self._pinned.clear()
+        self._spilled.clear()
+        self._clear_indexes()
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+            if self._temporary:
+                shutil.rmtree(self._spill_path)
+                self._spill_path = None
+
+    def _evict(self):
+        """ Evict the least recently used record, spilling it to disk if
+            required
+        """
+        key, value = self._resident.popitem(last=False)
+        if self.spill:
+            if self._store is None:
+                self._open_store()
+            self._spilled[key] = self._store.write(value)
+
+    def _open_store(self):
+        """ Open the on-disk store for spilled records
+        """
+        if self._spill_path is None:
+            self._spill_path = tempfile.mkdtemp(prefix='pysiss-metadata-')
+        elif not os.path.isdir(self._spill_path):
+            os.makedirs(self._spill_path)
+        self._store = _SpillFile(os.path.join(self._spill_path, 'metadata'))
+
+    def _spill_changed(self):
+        """ Reclaim space in the on-disk store after records have been
+            reloaded or removed
+        """
+        if not self._spilled:
+            self._store.clear()
+        elif self._store.wasted > max(self._store.used, _MIN_COMPACT):
+            self._spilled = self._store.compact(self._spilled)
+
+
+class _SpillFile(object):
+
+    """ An append-only file of pickled records
+
+        Records are located by their (offset, length) in the file. Reading
+        or discarding a record doesn't touch the file, it just marks the
+        space as unused, so every operation takes constant time. Unused space
+        is reclaimed by `compact` or `clear`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w+b')
+        self._size = 0
+        self.used = 0  # the number of bytes in live records
+
+    @property
+    def wasted(self):
+        """ The number of bytes in the file which aren't in live records
+        """
+        return self._size - self.used
+
+    def write(self, value):
+        """ Append a record and return its location
+        """
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._file.seek(self._size)
+        self._file.write(data)
+        location = (self._size, len(data))
+        self._size += len(data)
+        self.used += len(data)
+        return location
+
+    def read(self, location):
+        """ Read a record, and mark its space as unused
+        """
+        offset, length = location
+        self._file.seek(offset)
+        value = pickle.loads(self._file.read(length))
+        self.used -= length
+        return value
+
+    def discard(self, location):
+        """ Mark a record's space as unused
+        """
+        self.used -= location[1]
+
+    def compact(self, locations):
+        """ Rewrite the file with only the given records
+
+            :param locations: A dictionary mapping keys to record locations
+            :returns: a dictionary mapping the keys to their new locations
+        """
+        compacted = open(self.path + '.compact', 'w+b')
+        result, size = {}, 0
+        for key, (offset, length) in sorted(locations.items(),
+                                            key=lambda item: item[1]):
+            self._file.seek(offset)
+            compacted.write(self._file.read(length))
+            result[key] = (size, length)
+            size += length
+        self._file.close()
+        os.rename(self.path + '.compact', self.path)
+        self._file, self._size, self.used = compacted, size, size
+        return result
+
+    def clear(self):
+        """ Remove all the records
+        """
+        self._file.seek(0)
+        self._file.truncate()
+        self._size = self.used = 0
+
+    def close(self):
+        self._file.close()
+
+
+def shared_key(registry, digest):
+    """ Return the key of a registered record with the given content digest,
+        or None if there isn't one
+    """
+    key = registry.digests.get(digest)
+    if key is not None and key in registry:
+        return key
+    return None
+
+
+def current_registry():
+    """ Return the registry that new metadata records should be added to
+
+        This is the innermost active scoped registry (see `metadata_scope`),
+        or the process-wide MetadataRegistry if there isn't one.
+    """
+    scopes = getattr(_SCOPES, 'stack', None)
+    if scopes:
+        return scopes[-1]
+    return MetadataRegistry()
+
+
+@contextmanager
+def metadata_scope(registry=None, **kwargs):
+    """ Make a registry current for the duration of a `with` block
+
+        Metadata records created inside the block (in this thread) are added
+        to this registry rather than the process-wide MetadataRegistry. When
+        the block exits, new records in a weak registry are released.
+
+        :param registry: The registry to use. Optional, if not given a new
+            ScopedMetadataRegistry is created with the given keyword
+            arguments.
+        :type registry: ScopedMetadataRegistry
+        :returns: the registry
+    """
+    if registry is None:
+        registry = ScopedMetadataRegistry(**kwargs)
+    if not hasattr(_SCOPES, 'stack'):
+        _SCOPES.stack = []
+    scopes = _SCOPES.stack
+    scopes.append(registry)
+    try:
+        yield registry
+    finally:
+        # Remove this scope, even if inner scopes weren't exited in order
+        for idx in reversed(range(len(scopes))):
+            if scopes[idx] is registry:
+                del scopes[idx]
+                break
+        if getattr(registry, 'weak', False):
+            registry.release()
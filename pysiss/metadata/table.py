@@ -0,0 +1,154 @@
+""" file:   table.py (pysiss.metadata)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Tuesday 2 September, 2014
+
+    description: Bulk extraction of tables from metadata records
+
+    For analysis it's often handy to turn a set of metadata records into a
+    table, with one row per record and one column per field. Here we compile
+    a set of XPath queries once and evaluate them over every record (parsing
+    compact records only once), optionally farming chunks of records out to
+    a pool of worker processes.
+"""
+
+from .registry import current_registry
+from ..utilities import to_text
+
+from lxml import etree
+import multiprocessing
+import numpy
+import pandas
+
+
+def extract_table(queries, namespaces=None, registry=None, keys=None,
+                  type=None, where=None, processes=None, chunksize=1000,
+                  as_dataframe=True):
+    """ Evaluate a set of XPath queries over metadata records and return the
+        results as a table
+
+        Each query gives one column. Queries which return a single value
+        give that value, queries which return nothing give None, and queries
+        which return several values give a list of them. Use XPath functions
+        like `string()` or `number()` if you want scalar values.
+
+        :param queries: The queries to evaluate, as a mapping or a list of
+            (column name, query) pairs. Queries can be strings or
+            `lxml.etree.XPath` instances.
+        :type queries: dict or list of tuples
+        :param namespaces: The namespace prefixes used in the queries.
+            Optional, defaults to None.
+        :type namespaces: dict
+        :param registry: The registry to extract records from. Optional,
+            defaults to the current registry.
+        :param keys: The keys of the records to extract, in the order of the
+            rows. Optional, defaults to all the records in the registry
+            matching `type` and `where`, sorted by key.
+        :type keys: iterable
+        :param type: Only extract records of this type (e.g.
+            'gsml:GeologicUnit'). Optional, defaults to None (i.e. all
+            types).
+        :type type: string
+        :param where: Only extract records with these indexed field values,
+            passed to the registry's `find` method. Optional, defaults to
+            None.
+        :type where: dict
+        :param processes: The number of worker processes to use. Optional,
+            defaults to None (i.e. extract in this process). Queries are
+            recompiled in the workers, so they must be given as strings
+            (with their prefixes in `namespaces`) rather than as compiled
+            `lxml.etree.XPath` instances.
+        :type processes: int
+        :param chunksize: The number of records to send to a worker at a
+            time. Optional, defaults to 1000.
+        :type chunksize: int
+        :param as_dataframe: Whether to return a pandas DataFrame indexed by
+            record key. If False, a dictionary of NumPy arrays is returned
+            instead, with the record keys under 'key'. Optional, defaults to
+            True.
+        :type as_dataframe: bool
+    """
+    registry = registry if registry is not None else current_registry()
+    if hasattr(queries, 'items'):
+        queries = list(queries.items())
+    names = [name for name, _ in queries]
+    if keys is None:
+        # Sort so that the rows come out in the same order every time
+        keys = sorted(registry.find(type=type, **(where or {})), key=to_text)
+    keys = list(keys)
+
+    # Evaluate the queries
+    if processes and processes > 1:
+        # Compiled queries can't be pickled, and we can't get their
+        # namespaces back out to recompile them in the workers
+        compiled = [name for name, query in queries
+                    if isinstance(query, etree.XPath)]
+        if compiled:
+            raise ValueError(
+                'Compiled XPath queries ({0}) can\'t be sent to worker '
+                'processes; pass them as strings with their prefixes in '
+                '`namespaces` instead'.format(', '.join(compiled)))
+        jobs = [(queries, namespaces,
+                 [registry[key].serialized
+                  for key in keys[start:start + chunksize]])
+                for start in range(0, len(keys), chunksize)]
+        pool = multiprocessing.Pool(processes)
+        try:
+            rows = [row for chunk in pool.imap(_extract_chunk, jobs)
+                    for row in chunk]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        compiled = _compile(queries, namespaces)
+        rows = [[_cell(query(registry[key].tree)) for query in compiled]
+                for key in keys]
+
+    # Assemble the table
+    columns = zip(*rows) if rows else [()] * len(names)
+    if as_dataframe:
+        return pandas.DataFrame(
+            data=dict((name, list(column))
+                      for name, column in zip(names, columns)),
+            index=keys, columns=names)
+    else:
+        table = dict((name, numpy.array(column))
+                     for name, column in zip(names, columns))
+        table['key'] = numpy.array(keys)
+        return table
+
+
+def _compile(queries, namespaces):
+    """ Compile a list of (name, query) pairs into XPath evaluators
+    """
+    return [query if isinstance(query, etree.XPath)
+            else etree.XPath(query, namespaces=namespaces, smart_strings=False)
+            for _, query in queries]
+
+
+def _extract_chunk(job):
+    """ Evaluate queries over a chunk of serialized records
+
+        This runs in a worker process for `extract_table`, and returns one
+        row of values per record.
+    """
+    queries, namespaces, records = job
+    compiled = _compile(queries, namespaces)
+    rows = []
+    for record in records:
+        tree = etree.fromstring(record)
+        rows.append([_cell(query(tree)) for query in compiled])
+    return rows
+
+
+def _cell(result):
+    """ Convert the result of an XPath query into a table value
+    """
+    if isinstance(result, list):
+        result = [elem.text if etree.iselement(elem) else elem
+                  for elem in result]
+        if not result:
+            return None
+        elif len(result) == 1:
+            return result[0]
+    return result
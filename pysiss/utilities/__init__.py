@@ -10,5 +10,6 @@
 from maths import *
 from collection import Collection
 from id_object import id_object
-# from projection import project
+from projection import project
 from singleton import Singleton
+from strings import from_bytes, to_bytes, to_native, to_text
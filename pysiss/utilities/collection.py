@@ -4,70 +4,567 @@
     date:   25 August 2014
 
     description: A utility class for forming collections of objects
+
+    Objects are held in an OrderedDict keyed by name, so lookups, inserts and
+    deletes by name are all O(1). Positional access goes through a cached
+    list of the objects, which is only rebuilt after an object is removed.
+
+    Functions can be mapped over collections in thread or process pools.
+    Objects are sent to workers in chunks, with only a few chunks in flight
+    at once, so results can be streamed back in order without holding every
+    object (or result) in memory.
+
+    Chunks for process workers are pickled with the highest protocol, and
+    large numpy arrays in them aren't pickled at all: they are written to
+    temporary .npy files which the workers memory-map, so the array data is
+    only copied once (into the page cache) however many workers read it.
 """
 
+from collections import OrderedDict, deque
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+import cPickle as pickle
+import multiprocessing
+import numpy
+import os
+import shutil
+import tempfile
+
+# Placeholder for a missing initial value in Collection.reduce
+_MISSING = object()
 
-class Collection(list):
+# Arrays with at least this many bytes are sent to process workers through
+# memory-mapped files rather than being pickled
+_SHARED_ARRAY_BYTES = 2 ** 16
+
+# The function and loader used by process pool workers, set by _init_worker
+_WORKER = None
+
+
+class Collection(object):
 
     """ A collection of objects, accessible as a list or dictionary
 
+        Objects are keyed by their `name` attribute (subclasses can change
+        this by setting `key_attribute`), and are kept in the order they were
+        added:
+
+            boreholes = Collection(boreholes)
+            boreholes['PMD_001'], boreholes[0], boreholes[-10:]
+            del boreholes['PMD_001']
+
+        Adding an object with the same key as an existing one replaces it.
+
+        You can also declare secondary indexes on object attributes, to find
+        objects without checking every one:
+
+            boreholes.add_index('endpoint', lambda bh: bh.details.endpoint)
+            boreholes.add_index('datasets',
+                                lambda bh: bh.point_datasets.keys())
+            nvcl = boreholes.find(endpoint=GSWA_URL, datasets='Mineralogy')
+
+        If the attribute gives a list or set of values, the object is indexed
+        under each one. Indexes hold the values at the time each object was
+        added, so if you change an indexed attribute, add the object again to
+        update them.
+
         :param objects: The objects to add on initialization
         :type objects: list of object instances
     """
 
+    key_attribute = 'name'
+
     def __init__(self, objects=None):
         super(Collection, self).__init__()
-        self._index = {}
+        self._index = OrderedDict()  # maps keys to objects
+        self._order = []  # cached list of objects, or None if stale
+        self.indexes = {}  # maps index names to CollectionIndexes
 
         # Add the list of objects if required
         if objects:
-            for bh in objects:
-                self.append(bh)
+            self.extend(objects)
+
+    def __len__(self):
+        return len(self._index)
 
-    def __getitem__(self, ident_or_idx):
-        """ Retrieve a object from the collection
+    def __iter__(self):
+        return self._index.itervalues()
 
-            :param ident_or_idx: Either an integer index, or a object name.
+    def __reversed__(self):
+        return reversed(self._index.values())
+
+    def __contains__(self, key_or_object):
+        """ Check whether a key or an object is in the collection
         """
         try:
-            return super(Collection, self).__getitem__(ident_or_idx)
-        except IndexError:
-            try:
-                return super(Collection, self).__getitem__(self._index[ident_or_idx])
-            except KeyError:
-                str = ('Unknown key or index {0} passed '
-                       'to BoreholeCollection').format(ident_or_idx)
-                raise IndexError(str)
+            if key_or_object in self._index:
+                return True
+        except TypeError:
+            pass
+        key = getattr(key_or_object, self.key_attribute, None)
+        try:
+            return self._index.get(key) is key_or_object
+        except TypeError:
+            return False
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self.values())
+
+    def __getitem__(self, key_or_idx):
+        """ Retrieve an object from the collection
+
+            :param key_or_idx: Either an object name, an integer index or a
+                slice. Slices return a new collection.
+        """
+        if isinstance(key_or_idx, slice):
+            return type(self)(self._objects()[key_or_idx])
+        try:
+            return self._index[key_or_idx]
+        except KeyError:
+            if isinstance(key_or_idx, (int, long)):
+                return self._objects()[key_or_idx]
+            raise KeyError(('Unknown key {0} passed '
+                            'to {1}').format(key_or_idx, type(self).__name__))
+
+    def __setitem__(self, key_or_idx, obj):
+        """ Add or replace an object in the collection
+
+            :param key_or_idx: Either the object's name, or the integer index
+                of the object to replace. If the object at that index has a
+                different key, it is removed and the new object is added at
+                the end.
+        """
+        if isinstance(key_or_idx, (int, long)) \
+                and key_or_idx not in self._index:
+            if self._key(self[key_or_idx]) != self._key(obj):
+                del self[key_or_idx]
+        elif key_or_idx != self._key(obj):
+            raise KeyError(('Key {0} does not match the key {1} of the '
+                            'object').format(key_or_idx, self._key(obj)))
+        self.append(obj)
+
+    def __delitem__(self, key_or_idx):
+        """ Remove an object from the collection
+
+            :param key_or_idx: Either an object name or an integer index
+        """
+        key = self._key(self[key_or_idx])
+        obj = self._index.pop(key)
+        for index in self.indexes.values():
+            index.discard(key)
+        self._order = None
+        self._removed(obj)
 
-    def __setitem__(self, object):
-        """ Add a object to the collection
+    def append(self, obj):
+        """ Add an object to the collection
         """
-        self.append(object)
-        self._index[object.name] = len(self)
+        self.extend([obj])
 
-    def __delitem__(self, object_name):
-        """ Remove a object from the collection
+    def extend(self, objects):
+        """ Add a set of objects to the collection
         """
-        # Find location of object in list
-        idx = self._index[object_name]
+        # Only the last object with each key in the batch is kept
+        batch = OrderedDict()
+        for obj in objects:
+            batch[self._key(obj)] = obj
 
-        # Move subsequent object indices up
-        for obj in self[idx:]:
-            self._index[obj.name] -= 1
+        added, replaced = [], []
+        for key, obj in batch.iteritems():
+            previous = self._index.get(key)
+            if previous is not None:
+                # Keep the position of the object we're replacing. Re-adding
+                # an object which is already in the collection just updates
+                # the indexes.
+                self._order = None
+                if previous is not obj:
+                    replaced.append(previous)
+                    added.append(obj)
+            else:
+                if self._order is not None:
+                    self._order.append(obj)
+                added.append(obj)
+            self._index[key] = obj
+            for index in self.indexes.values():
+                index.discard(key)
+                index.add(key, obj)
+        for obj in replaced:
+            self._removed(obj)
+        self._added(added)
 
-        # Delete object
-        del self._index[object_name]
-        del self[idx]
+    def pop(self, key_or_idx=-1):
+        """ Remove an object from the collection and return it
+        """
+        obj = self[key_or_idx]
+        del self[key_or_idx]
+        return obj
+
+    def get(self, key, default=None):
+        return self._index.get(key, default)
 
     def keys(self):
-        return [obj.name for obj in self]
+        return self._index.keys()
 
     def values(self):
-        return self
+        return list(self._objects())
 
     def items(self):
-        return zip(self.keys(), self.values())
+        return self._index.items()
+
+    def iterkeys(self):
+        return self._index.iterkeys()
+
+    def itervalues(self):
+        return self._index.itervalues()
+
+    def iteritems(self):
+        return self._index.iteritems()
+
+    def add_index(self, name, attribute=None):
+        """ Add a secondary index on an attribute of the objects
+
+            Objects which are already in the collection are added to the new
+            index.
+
+            :param name: The name of the index. This is the keyword used to
+                look up values in `find`.
+            :type name: string
+            :param attribute: The attribute to index, either as an attribute
+                name or as a function which takes an object and returns the
+                value. Optional, defaults to the attribute given by `name`.
+            :type attribute: string or callable
+            :returns: the new CollectionIndex
+        """
+        index = CollectionIndex(name, attribute)
+        for key, obj in self._index.iteritems():
+            index.add(key, obj)
+        self.indexes[name] = index
+        return index
+
+    def remove_index(self, name):
+        """ Remove a secondary index
+        """
+        del self.indexes[name]
+
+    def find_keys(self, **values):
+        """ Find the keys of the objects with the given attribute values
+
+            Each keyword argument gives an index name and the value to look
+            up in that index, e.g. `find_keys(endpoint=GSWA_URL)`. Only
+            objects matching every criterion are returned.
+
+            :returns: a list of keys, in the order the objects were added
+        """
+        matches = []
+        for name, value in values.items():
+            try:
+                matches.append(self.indexes[name].lookup(value))
+            except KeyError:
+                raise KeyError(
+                    ('No index on attribute {0}. '
+                     'Available indexes are {1}').format(
+                        name, self.indexes.keys()))
+        if not matches:
+            return self.keys()
+        matches.sort(key=len)
+        return [key for key in matches[0]
+                if all(key in match for match in matches[1:])]
+
+    def find(self, **values):
+        """ Find the objects with the given attribute values
+
+            See `find_keys` for details.
+
+            :returns: a new collection of the matching objects
+        """
+        return type(self)(self._index[key]
+                          for key in self.find_keys(**values))
+
+    def imap(self, func, workers=None, backend='thread', chunksize=1):
+        """ Apply a function to each object in the collection, streaming the
+            results back in order
+
+                for stats in boreholes.imap(summarize, workers=8):
+                    ...
+
+            :param func: The function to apply. For the process backend,
+                this must be picklable (i.e. defined at the top level of a
+                module).
+            :type func: callable
+            :param workers: The number of workers. Optional, defaults to the
+                number of CPUs. If this is 1, the function is applied in
+                this thread.
+            :type workers: int
+            :param backend: Either 'thread' or 'process'. Threads avoid
+                copying objects, and suit functions which release the GIL
+                (e.g. numpy and IO heavy work). Processes suit pure Python
+                work; large numpy arrays are passed to them as copy-on-write
+                memory maps. Optional, defaults to 'thread'.
+            :type backend: string
+            :param chunksize: The number of objects sent to a worker at a
+                time. Optional, defaults to 1.
+            :type chunksize: int
+            :returns: a generator of results, in the order of the objects
+        """
+        if backend not in ('thread', 'process'):
+            raise ValueError(("Unknown backend {0}, expected 'thread' or "
+                              "'process'").format(backend))
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        tasks, loader = self._map_source()
+        chunks = _chunks(tasks, chunksize)
+        if workers <= 1:
+            return (result for chunk in chunks
+                    for result in _apply_chunk(func, loader, chunk))
+        return _imap(func, loader, chunks, workers, backend)
+
+    def map(self, func, workers=None, backend='thread', chunksize=1):
+        """ Apply a function to each object in the collection
+
+            See `imap` for details of the arguments.
+
+            :returns: a list of results, in the order of the objects
+        """
+        return list(self.imap(func, workers=workers, backend=backend,
+                              chunksize=chunksize))
+
+    def reduce(self, func, reducer, initial=_MISSING, workers=None,
+               backend='thread', chunksize=1):
+        """ Apply a function to each object in the collection and combine the
+            results
+
+            The results are combined in this thread as they arrive, in the
+            order of the objects, so they never all need to be in memory:
+
+                total = boreholes.reduce(count_samples, operator.add, 0)
+
+            See `imap` for details of the other arguments.
+
+            :param reducer: A function taking the combined value so far and
+                the next result, and returning the new combined value
+            :type reducer: callable
+            :param initial: The initial combined value. Optional, if not
+                given the first result is used.
+            :raises ValueError: if the collection is empty and there is no
+                initial value
+        """
+        results = self.imap(func, workers=workers, backend=backend,
+                            chunksize=chunksize)
+        value = initial
+        for result in results:
+            if value is _MISSING:
+                value = result
+            else:
+                value = reducer(value, result)
+        if value is _MISSING:
+            raise ValueError('reduce of an empty collection '
+                             'with no initial value')
+        return value
 
     @property
     def shapes(self):
         return (obj.shape for obj in self)
+
+    def _key(self, obj):
+        """ Return the key for an object
+        """
+        return getattr(obj, self.key_attribute)
+
+    def _objects(self):
+        """ Return a list of the objects in order, rebuilding it if required
+        """
+        if self._order is None:
+            self._order = self._index.values()
+        return self._order
+
+    def _map_source(self):
+        """ Return the tasks to send to workers in `imap`, and a function
+            which workers use to turn each task into an object (or None if
+            the tasks are the objects themselves)
+        """
+        return iter(self), None
+
+    def _added(self, objects):
+        """ Called with the list of objects added to the collection
+        """
+        pass
+
+    def _removed(self, obj):
+        """ Called with each object removed from (or replaced in) the
+            collection
+        """
+        pass
+
+
+def _chunks(items, chunksize):
+    """ Split an iterable into lists of up to chunksize items
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _apply_chunk(func, loader, chunk):
+    """ Apply a function to a chunk of tasks
+    """
+    if loader is not None:
+        return [func(loader(task)) for task in chunk]
+    return [func(task) for task in chunk]
+
+
+def _init_worker(func, loader):
+    """ Set up a process pool worker
+    """
+    global _WORKER
+    _WORKER = (func, loader)
+
+
+def _apply_worker_chunk(data):
+    """ Apply the worker function to a pickled chunk of tasks in a process
+    """
+    func, loader = _WORKER
+    return _apply_chunk(func, loader, _unpack_chunk(data))
+
+
+def _pack_chunk(chunk, directory):
+    """ Pickle a chunk of tasks for a process worker
+
+        Large numpy arrays are saved to files in `directory` and pickled as
+        references to those files.
+
+        :returns: the pickled chunk, and a list of the files written
+    """
+    paths, saved = [], {}
+
+    def persistent_id(obj):
+        if not isinstance(obj, numpy.ndarray) or obj.dtype.hasobject \
+                or obj.nbytes < _SHARED_ARRAY_BYTES:
+            return None
+        if id(obj) not in saved:
+            handle, path = tempfile.mkstemp(suffix='.npy', dir=directory)
+            with os.fdopen(handle, 'wb') as fhandle:
+                numpy.save(fhandle, obj)
+            paths.append(path)
+            saved[id(obj)] = path
+        return saved[id(obj)]
+
+    buf = StringIO()
+    pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(chunk)
+    return buf.getvalue(), paths
+
+
+def _unpack_chunk(data):
+    """ Unpickle a chunk of tasks from `_pack_chunk`, memory-mapping any
+        arrays sent as files
+    """
+    unpickler = pickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = lambda path: numpy.load(path, mmap_mode='c')
+    return unpickler.load()
+
+
+def _imap(func, loader, chunks, workers, backend):
+    """ Stream the results of applying a function to chunks of tasks in a
+        pool, keeping up to two chunks per worker in flight
+    """
+    directory = None
+    if backend == 'thread':
+        pool = ThreadPool(workers)
+
+        def submit(chunk):
+            return pool.apply_async(_apply_chunk, (func, loader, chunk)), []
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(func, loader))
+        directory = tempfile.mkdtemp(prefix='pysiss-map-')
+
+        def submit(chunk):
+            data, paths = _pack_chunk(chunk, directory)
+            return pool.apply_async(_apply_worker_chunk, (data,)), paths
+
+    def collect():
+        result, paths = pending.popleft()
+        results = result.get()
+        for path in paths:
+            os.remove(path)
+        return results
+
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(submit(chunk))
+            if len(pending) >= 2 * workers:
+                for result in collect():
+                    yield result
+        while pending:
+            for result in collect():
+                yield result
+    finally:
+        pool.terminate()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class CollectionIndex(object):
+
+    """ A secondary index on an attribute of the objects in a Collection
+
+        :param name: The name of the index
+        :type name: string
+        :param attribute: The attribute to index, either as an attribute
+            name or as a function which takes an object and returns the
+            value. Optional, defaults to the attribute given by `name`.
+        :type attribute: string or callable
+    """
+
+    def __init__(self, name, attribute=None):
+        super(CollectionIndex, self).__init__()
+        self.name = name
+        self.attribute = attribute if attribute is not None else name
+        self._keys = {}  # maps values to OrderedDicts of keys
+        self._values = {}  # maps keys to lists of values
+
+    def __len__(self):
+        return len(self._values)
+
+    def extract(self, obj):
+        """ Return the list of values of the indexed attribute for an object
+        """
+        if callable(self.attribute):
+            value = self.attribute(obj)
+        else:
+            value = getattr(obj, self.attribute, None)
+        if isinstance(value, (list, set, frozenset)):
+            return list(value)
+        return [value]
+
+    def add(self, key, obj):
+        """ Add an object to the index
+        """
+        values = self.extract(obj)
+        for value in values:
+            self._keys.setdefault(value, OrderedDict())[key] = True
+        self._values[key] = values
+
+    def discard(self, key):
+        """ Remove a key from the index, if it's there
+        """
+        for value in self._values.pop(key, ()):
+            keys = self._keys[value]
+            keys.pop(key, None)
+            if not keys:
+                del self._keys[value]
+
+    def lookup(self, value):
+        """ Return the keys of the objects with the given value
+        """
+        return self._keys.get(value, {})
+
+    def clear(self):
+        self._keys.clear()
+        self._values.clear()
@@ -14,6 +14,8 @@ class id_object(object):
         and defines the class __eq__ method to use this UUID.
     """
 
+    __slots__ = ()
+
     def __init__(self, name, *args, **kwargs):
         super(id_object, self).__init__(*args, **kwargs)
         self.uuid = uuid.uuid5(uuid.NAMESPACE_DNS, name)
@@ -77,3 +77,81 @@ def try_float(value_str):
         return float(value_str)
     except ValueError:
         return numpy.nan
+
+
+def nearest_indices(points, new_points):
+    """ Find the nearest point to each of a set of new points
+
+        Both sets of points must be sorted in increasing order. Rather than
+        comparing every pair of points, this does a binary search for each
+        new point, so it takes O((N + M) log N) time and O(M) memory. Where a
+        new point is midway between two points, the first is chosen.
+
+        :param points: The N points to choose from
+        :type points: numpy.ndarray
+        :param new_points: The M new points
+        :type new_points: numpy.ndarray
+        :returns: an array of M indices into `points`
+    """
+    points = numpy.asarray(points)
+    new_points = numpy.asarray(new_points)
+    if len(points) < 2:
+        return numpy.zeros(len(new_points), dtype=int)
+    upper = numpy.clip(numpy.searchsorted(points, new_points), 1,
+                       len(points) - 1)
+    lower = upper - 1
+    use_lower = (new_points - points[lower]) <= (points[upper] - new_points)
+    return numpy.where(use_lower, lower, upper)
+
+
+def interpolate_columns(points, values, new_points, degree=1,
+                        extrapolate=False):
+    """ Interpolate the columns of an array onto a set of new points
+
+        All columns are interpolated at once, so the cost is dominated by
+        locating the new points, which is only done once. Points outside the
+        range of the original points take the value at the nearest end,
+        unless `extrapolate` is True.
+
+        :param points: The N points at which the values are given, in
+            increasing order
+        :type points: numpy.ndarray
+        :param values: The values, as an (N,) or (N, K) array
+        :type values: numpy.ndarray
+        :param new_points: The M points to interpolate to, in increasing
+            order
+        :type new_points: numpy.ndarray
+        :param degree: The degree of the interpolation - 0 for nearest
+            neighbour or 1 for linear. Optional, defaults to 1.
+        :type degree: int
+        :param extrapolate: Whether to extend the first and last linear
+            segments past the ends of the points. Optional, defaults to
+            False.
+        :type extrapolate: bool
+        :returns: an (M,) or (M, K) array of interpolated values
+    """
+    points = numpy.asarray(points, dtype=float)
+    values = numpy.asarray(values)
+    new_points = numpy.asarray(new_points, dtype=float)
+    if degree == 0 or len(points) < 2:
+        return values[nearest_indices(points, new_points)]
+    elif degree != 1:
+        raise ValueError('Only degree 0 (nearest neighbour) or 1 (linear) '
+                         'interpolation is supported, not {0}'.format(degree))
+    upper = numpy.clip(numpy.searchsorted(points, new_points), 1,
+                       len(points) - 1)
+    lower = upper - 1
+    weights = (new_points - points[lower]) / (points[upper] - points[lower])
+    if not extrapolate:
+        weights = numpy.clip(weights, 0, 1)
+    if values.ndim > 1:
+        weights = weights.reshape((-1,) + (1,) * (values.ndim - 1))
+    return values[lower] * (1 - weights) + values[upper] * weights
+
+
+def to_degrees(value):
+    """ Convert a pint angle (or a plain number of degrees) into a float
+    """
+    if hasattr(value, 'to'):
+        return value.to('degree').magnitude
+    return float(value)
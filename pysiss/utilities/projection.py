@@ -1,34 +1,96 @@
 """ file: projection.py (pysiss.utilities)
 
     description: Projection utilities
+
+    Coordinates are transformed with pyproj, in whole arrays at a time.
+    Setting up a transformation is relatively expensive, so transformers are
+    cached for each pair of projections. pyproj is only imported when we
+    first need a transformer.
 """
 
-# from osgeo import ogr
-# from shapely.wkb import loads
+import numpy
+import re
+
+# Cache of transformers, keyed by (from, to) projection pairs
+_TRANSFORMERS = {}
+
+# Patterns for EPSG codes in GML srsNames
+_EPSG_PATTERNS = [
+    re.compile(r'^EPSG:+(\d+)$', re.IGNORECASE),
+    re.compile(r'^urn:ogc:def:crs:EPSG:[\d.]*:(\d+)$', re.IGNORECASE),
+    re.compile(r'^https?://www\.opengis\.net/gml/srs/epsg\.xml#(\d+)$',
+               re.IGNORECASE),
+    re.compile(r'^https?://www\.opengis\.net/def/crs/EPSG/[\d.]+/(\d+)$',
+               re.IGNORECASE)]
+
+
+def normalize_projection(projection):
+    """ Convert a projection identifier into a form pyproj understands
+
+        EPSG codes can be given as integers, or in any of the usual srsName
+        forms (e.g. 'EPSG:4326', 'urn:ogc:def:crs:EPSG::4326' or
+        'http://www.opengis.net/gml/srs/epsg.xml#4326'), and are converted
+        to 'EPSG:<code>'. Anything else is passed through unchanged.
+    """
+    if isinstance(projection, (int, long)):
+        return 'EPSG:{0}'.format(projection)
+    for pattern in _EPSG_PATTERNS:
+        match = pattern.match(projection.strip())
+        if match:
+            return 'EPSG:{0}'.format(match.group(1))
+    return projection
+
+
+def get_transformer(from_projection, to_projection):
+    """ Return a (cached) pyproj Transformer between two projections
 
+        Transformers always take coordinates in (x, y) order, i.e.
+        (longitude, latitude) for geographic projections.
+    """
+    key = (normalize_projection(from_projection),
+           normalize_projection(to_projection))
+    try:
+        return _TRANSFORMERS[key]
+    except KeyError:
+        from pyproj import Transformer
+        transformer = _TRANSFORMERS[key] = Transformer.from_crs(
+            key[0], key[1], always_xy=True)
+        return transformer
 
-# def project(geom, to_epsg=900913, from_epsg=4326):
-#     """utility function to do quick projection with ogr,
-#     to and from shapely objects
 
-#         >>> from shapely.geometry import LineString
-#         >>> l = LineString([[-121, 43], [-122, 42]])
-#         >>> lp = project(l, from_epsg=4326, to_epsg=26910)
-#         >>> lp.wkt
-#         'LINESTRING (663019.0700828594854102 4762755.6415722491219640,
-#             582818.0692490270594135 4650259.8474613213911653)'
+def transform(coords, from_projection, to_projection):
+    """ Transform an array of coordinates between projections
 
-#         Stolen from http://hackmap.blogspot.com.au/2008/03/ogr-python-projection.html
-#     """
+        :param coords: The coordinates, as an (N, 2) array
+        :type coords: numpy.ndarray
+        :param from_projection: The current projection
+        :param to_projection: The new projection
+        :returns: an (N, 2) array of transformed coordinates
+    """
+    coords = numpy.asarray(coords, dtype=float).reshape(-1, 2)
+    if normalize_projection(from_projection) \
+            == normalize_projection(to_projection):
+        return coords.copy()
+    xs, ys = get_transformer(from_projection, to_projection).transform(
+        coords[:, 0], coords[:, 1])
+    return numpy.column_stack([xs, ys])
 
-#     to_srs = ogr.osr.SpatialReference()
-#     to_srs.ImportFromEPSG(to_epsg)
 
-#     from_srs = ogr.osr.SpatialReference()
-#     from_srs.ImportFromEPSG(from_epsg)
+def project(geom, to_projection, from_projection='EPSG:4326'):
+    """ Project a shapely geometry
 
-#     ogr_geom = ogr.CreateGeometryFromWkb(geom.wkb)
-#     ogr_geom.AssignSpatialReference(from_srs)
+            >>> from shapely.geometry import LineString
+            >>> l = LineString([[-121, 43], [-122, 42]])
+            >>> lp = project(l, from_projection=4326, to_projection=26910)
 
-#     ogr_geom.TransformTo(to_srs)
-#     return loads(ogr_geom.ExportToWkb())
+        :param geom: The geometry to project
+        :type geom: shapely.geometry.base.BaseGeometry
+        :param to_projection: The new projection
+        :param from_projection: The current projection. Optional, defaults
+            to 'EPSG:4326'.
+        :returns: a new geometry of the same type
+    """
+    from shapely.ops import transform as transform_geometry
+    transformer = get_transformer(from_projection, to_projection)
+    return transform_geometry(
+        lambda xs, ys, zs=None: transformer.transform(xs, ys), geom)
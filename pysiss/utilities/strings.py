@@ -0,0 +1,59 @@
+""" file:   strings.py (pysiss.utilities)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Monday 15 September, 2014
+
+    description: Converting strings to and from on-disk formats
+
+    The on-disk stores (feature caches, partitioned feature stores and
+    borehole stores) keep identifiers as UTF-8 bytes in NumPy arrays and as
+    unicode in JSON manifests. These functions convert between those and
+    native strings.
+"""
+
+
+def to_bytes(value):
+    """ Encode a string (or anything else with a string form, like a UUID)
+        as UTF-8 bytes for storage
+    """
+    if isinstance(value, bytes):
+        return value
+    return unicode(value).encode('utf-8')
+
+
+def from_bytes(value):
+    """ Decode bytes from storage into a native string
+    """
+    return value if str is bytes else value.decode('utf-8')
+
+
+def to_text(value):
+    """ Convert a key into a string for a manifest (keys can be UUIDs if a
+        record had no identifier)
+
+        None is kept as None (i.e. null in JSON), so that missing keys are
+        read back as None rather than 'None'.
+    """
+    if value is None or isinstance(value, basestring):
+        return value
+    return str(value)
+
+
+def to_native(value):
+    """ Convert unicode strings read from JSON back into native strings
+        where possible
+
+        Dictionaries and lists are converted recursively. Strings which
+        can't be represented as native strings are left as unicode.
+    """
+    if isinstance(value, dict):
+        return dict((to_native(key), to_native(val))
+                    for key, val in value.items())
+    elif isinstance(value, list):
+        return [to_native(val) for val in value]
+    elif isinstance(value, unicode):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    return value
@@ -0,0 +1,289 @@
+""" file:   cache.py (pysiss.vocabulary)
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Friday 29 August, 2014
+
+    description: Binary sidecar caches for unmarshalled GML features
+
+    Parsing large GeoSciML files is slow, so the first time a file is
+    unmarshalled we can store the resulting MappedFeatures in a sidecar
+    directory next to the file. Geometries are stored as WKB in one
+    contiguous buffer, identifiers, projections and specification keys are
+    stored as columnar arrays, and metadata records are stored as serialized
+    XML. Later loads memory-map the cache rather than reparsing the XML.
+
+    The cache is valid while the source file's size and modification time
+    match those recorded when the cache was written. If only the modification
+    time has changed (e.g. the file has been copied), we check the file's
+    SHA1 hash instead and keep using the cache if the contents match.
+"""
+
+from .unmarshal import unmarshal_all, unmarshal_all_parallel
+from ..coverage.vector import MappedFeature
+from ..metadata import Metadata
+from ..utilities import from_bytes, to_bytes, to_native, to_text
+
+from shapely.wkb import loads as wkb_loads
+import hashlib
+import json
+import numpy
+import os
+
+# Bump this if the cache layout changes
+CACHE_VERSION = 1
+
+_MANIFEST = 'manifest.json'
+
+
+def unmarshal_all_cached(filename, tag='gsml:MappedFeature', cache_path=None,
+                         parallel=False, **kwargs):
+    """ Unmarshall all gsml:MappedFeatures from an xml file, using a binary
+        sidecar cache if there is a valid one
+
+        If there is no valid cache, the file is unmarshalled with
+        `unmarshal_all` (or `unmarshal_all_parallel` if `parallel` is True)
+        and the cache is written for next time.
+
+        :param filename: The XML file to unmarshal
+        :type filename: string
+        :param tag: The tag to unmarshal. Only 'gsml:MappedFeature' is
+            supported at the moment.
+        :type tag: string
+        :param cache_path: The directory to store the cache in. Optional,
+            defaults to `<filename>.pysiss`.
+        :type cache_path: string
+        :param parallel: Whether to use `unmarshal_all_parallel` when the
+            cache is invalid. Optional, defaults to False.
+        :type parallel: bool
+        :param kwargs: Passed through to `unmarshal_all_parallel` (e.g.
+            `processes`), so these can only be given if `parallel` is True.
+            Projected loads (i.e. `fields`) can't be cached.
+        :returns: a list of MappedFeature instances
+    """
+    if tag != 'gsml:MappedFeature':
+        raise ValueError(
+            ('Caching is not supported for {0}. '
+             'Supported tags are {1}').format(tag, ['gsml:MappedFeature']))
+    if kwargs.get('fields') is not None:
+        raise ValueError('Projected loads (i.e. with fields) return '
+                         'dictionaries rather than features, so they can\'t '
+                         'be cached. Use unmarshal_all instead.')
+    if kwargs and not parallel:
+        raise TypeError(
+            ('Unexpected keyword arguments {0}, these are only used if '
+             'parallel is True').format(sorted(kwargs.keys())))
+
+    features = read_cache(filename, cache_path)
+    if features is None:
+        if parallel:
+            features = unmarshal_all_parallel(filename, tag, **kwargs)
+        else:
+            features = unmarshal_all(filename, tag)
+        write_cache(features, filename, cache_path)
+    return features
+
+
+def write_cache(features, filename, cache_path=None):
+    """ Write a sidecar cache for a list of MappedFeatures unmarshalled from
+        the given file
+
+        The metadata records referred to by the features are read from the
+        features' metadata registries and stored alongside them.
+
+        :param features: The features unmarshalled from `filename`
+        :type features: list of MappedFeature instances
+        :param filename: The XML file the features came from
+        :type filename: string
+        :param cache_path: The directory to store the cache in. Optional,
+            defaults to `<filename>.pysiss`.
+        :type cache_path: string
+        :raises ValueError: if any of the features aren't MappedFeatures
+            (e.g. dictionaries from a projected load)
+    """
+    if not all(isinstance(f, MappedFeature) for f in features):
+        raise ValueError('Only MappedFeatures can be cached')
+    cache_path = cache_path or _default_cache_path(filename)
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+
+    # Remove the manifest first so a half-written cache is never valid
+    manifest_path = os.path.join(cache_path, _MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    # Geometries as one contiguous WKB buffer plus offsets
+    wkb, wkb_offsets = _pack([f.shape.wkb for f in features])
+    _save(cache_path, 'wkb', wkb)
+    _save(cache_path, 'wkb_offsets', wkb_offsets)
+
+    # Identifiers, stored as empty strings if they were generated UUIDs
+    idents = [to_bytes(f.ident) if isinstance(f.ident, basestring) else b''
+              for f in features]
+    _save(cache_path, 'idents', numpy.array(idents, dtype=bytes))
+
+    # Projections and specifications are stored as codes into a lookup table
+    projections, projection_codes = \
+        _categorize([f.projection for f in features])
+    _save(cache_path, 'projections', projection_codes)
+    specifications, specification_codes = \
+        _categorize([f.specification for f in features])
+    _save(cache_path, 'specifications', specification_codes)
+
+    # Metadata records referred to by the features
+    # Records are stored under the key the features use, which may be an
+    # alias for a shared record
+    registries = dict((f.specification, f.md_registry) for f in features)
+    records = [(key, registries[key][key]) for key in specifications
+               if key in registries[key]]
+    metadata, metadata_offsets = _pack([r.serialized for _, r in records])
+    _save(cache_path, 'metadata', metadata)
+    _save(cache_path, 'metadata_offsets', metadata_offsets)
+
+    # Finally write the manifest
+    manifest = {
+        'version': CACHE_VERSION,
+        'source': _source_info(filename, with_hash=True),
+        'count': len(features),
+        'projections': projections,
+        'specifications': [to_text(s) for s in specifications],
+        'metadata': [[to_text(key), r.type] for key, r in records]
+    }
+    with open(manifest_path, 'w') as fhandle:
+        json.dump(manifest, fhandle)
+
+
+def read_cache(filename, cache_path=None):
+    """ Read the MappedFeatures for a file from its sidecar cache
+
+        The arrays in the cache are memory-mapped, so only the parts needed
+        to rebuild the features are read from disk. Metadata records in the
+        cache are registered in the current metadata registry.
+
+        :param filename: The XML file the features came from
+        :type filename: string
+        :param cache_path: The directory the cache is stored in. Optional,
+            defaults to `<filename>.pysiss`.
+        :type cache_path: string
+        :returns: a list of MappedFeature instances, or None if there is no
+            valid cache for the file.
+    """
+    cache_path = cache_path or _default_cache_path(filename)
+    manifest = _valid_manifest(filename, cache_path)
+    if manifest is None:
+        return None
+
+    # Register metadata first, since the features look up their types
+    metadata = _load(cache_path, 'metadata')
+    metadata_offsets = _load(cache_path, 'metadata_offsets')
+    for idx, (ident, mdtype) in enumerate(manifest['metadata']):
+        start, stop = metadata_offsets[idx], metadata_offsets[idx + 1]
+        Metadata(ident=to_native(ident), type=to_native(mdtype),
+                 tree=metadata[start:stop].tobytes())
+
+    # Rebuild the features
+    wkb = _load(cache_path, 'wkb')
+    wkb_offsets = _load(cache_path, 'wkb_offsets')
+    idents = _load(cache_path, 'idents')
+    projections = [to_native(p) for p in manifest['projections']]
+    projection_codes = _load(cache_path, 'projections')
+    specifications = [to_native(s) for s in manifest['specifications']]
+    specification_codes = _load(cache_path, 'specifications')
+    features = []
+    for idx in range(manifest['count']):
+        features.append(MappedFeature(
+            ident=from_bytes(idents[idx]) or None,
+            shape=wkb_loads(wkb[wkb_offsets[idx]:wkb_offsets[idx + 1]]
+                            .tobytes()),
+            projection=projections[projection_codes[idx]],
+            specification=specifications[specification_codes[idx]]))
+    return features
+
+
+def _valid_manifest(filename, cache_path):
+    """ Return the cache manifest if the cache is valid for the given file,
+        otherwise return None
+    """
+    manifest_path = os.path.join(cache_path, _MANIFEST)
+    try:
+        with open(manifest_path) as fhandle:
+            manifest = json.load(fhandle)
+    except (IOError, OSError, ValueError):
+        return None
+    if manifest.get('version') != CACHE_VERSION:
+        return None
+
+    # Check the source file hasn't changed
+    cached, current = manifest['source'], _source_info(filename)
+    if cached['size'] != current['size']:
+        return None
+    if cached['mtime'] != current['mtime']:
+        # Same size but touched, so check whether the contents have changed
+        if cached['sha1'] != _file_hash(filename):
+            return None
+        manifest['source']['mtime'] = current['mtime']
+        with open(manifest_path, 'w') as fhandle:
+            json.dump(manifest, fhandle)
+    return manifest
+
+
+def _default_cache_path(filename):
+    """ Return the default sidecar cache directory for a file
+    """
+    return filename + '.pysiss'
+
+
+def _source_info(filename, with_hash=False):
+    """ Return the size, modification time and optionally the hash of a file
+    """
+    stat = os.stat(filename)
+    info = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if with_hash:
+        info['sha1'] = _file_hash(filename)
+    return info
+
+
+def _file_hash(filename, blocksize=2 ** 20):
+    """ Return the SHA1 hash of a file's contents
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fhandle:
+        for block in iter(lambda: fhandle.read(blocksize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _pack(buffers):
+    """ Concatenate byte strings into a single uint8 array plus an array of
+        offsets, so that buffer i is packed[offsets[i]:offsets[i + 1]]
+    """
+    offsets = numpy.zeros(len(buffers) + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(b) for b in buffers])
+    packed = numpy.frombuffer(b''.join(buffers), dtype=numpy.uint8)
+    return packed, offsets
+
+
+def _categorize(values):
+    """ Convert a list of values into a list of the unique values and an
+        array of codes into that list
+    """
+    categories, codes = [], numpy.empty(len(values), dtype=numpy.int32)
+    lookup = {}
+    for idx, value in enumerate(values):
+        try:
+            codes[idx] = lookup[value]
+        except KeyError:
+            codes[idx] = lookup[value] = len(categories)
+            categories.append(value)
+    return categories, codes
+
+
+def _save(cache_path, name, array):
+    """ Save an array into the cache
+    """
+    numpy.save(os.path.join(cache_path, name + '.npy'), array)
+
+
+def _load(cache_path, name):
+    """ Memory-map an array from the cache
+    """
+    return numpy.load(os.path.join(cache_path, name + '.npy'), mmap_mode='r')
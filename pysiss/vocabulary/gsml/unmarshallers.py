@@ -7,31 +7,96 @@
 """
 
 from ...coverage.vector import MappedFeature
-from ...metadata import Metadata
+from ...metadata import Metadata, current_registry, shared_key
 from ..namespaces import NamespaceRegistry, expand_namespace, shorten_namespace
 from ..gml.unmarshallers import UNMARSHALLERS as GML_UNMARSHALLERS
 
+from lxml import etree
+import hashlib
+
 NAMESPACES = NamespaceRegistry()
 
+# Whether to share one metadata record between identical inline
+# specifications, rather than creating a new record for each copy
+DEDUPLICATE_SPECIFICATIONS = True
+
+# The fields which can be unmarshalled from a gsml:MappedFeature
+MAPPED_FEATURE_FIELDS = ('ident', 'shape', 'projection', 'specification')
+
 
 def mapped_feature(elem):
     """ Unmarshal a gsml:MappedFeature element
     """
+    return MappedFeature(**mapped_feature_data(elem))
+
+
+def mapped_feature_data(elem, fields=None):
+    """ Unmarshal the data for a gsml:MappedFeature element
+
+        Returns a dictionary of keyword arguments for the MappedFeature
+        constructor, rather than the MappedFeature itself. This lets us
+        unmarshal features in worker processes and construct them later,
+        once all the metadata records they refer to have been registered.
+
+        If `fields` is given then only those fields are unmarshalled, and
+        the rest of the element is skipped. In this case specification
+        metadata records are not created or registered, and the
+        'specification' field just contains the record key.
+
+        :param elem: The gsml:MappedFeature element
+        :type elem: `lxml.etree.Element`
+        :param fields: The fields to unmarshal, a subset of
+            `MAPPED_FEATURE_FIELDS`. Optional, defaults to None (i.e. all
+            fields, registering metadata records)
+        :type fields: iterable of strings
+    """
+    if fields is None:
+        register, fields = True, MAPPED_FEATURE_FIELDS
+    else:
+        register, fields = False, check_fields(fields)
+    data = {}
+
     # Shape and projection data
-    shape_elem = elem.find('./gsml:shape', namespaces=NAMESPACES)
-    shape_data = shape(shape_elem)
-    shape_elem.clear()  # Remove shape element from metadata
+    if 'shape' in fields or 'projection' in fields:
+        shape_elem = elem.find('./gsml:shape', namespaces=NAMESPACES)
+        if 'shape' in fields:
+            shape_data = shape(shape_elem)
+            data['shape'] = shape_data['shape']
+            if 'projection' in fields:
+                data['projection'] = shape_data['projection']
+        else:
+            # We can get the projection without building the geometry
+            data['projection'] = shape_elem.xpath(
+                './/@srsName', namespaces=NAMESPACES)[0]
+        shape_elem.clear()  # Remove shape element from metadata
 
     # Identifier
-    ident = elem.get(expand_namespace('gml:id')) or None
+    if 'ident' in fields:
+        data['ident'] = elem.get(expand_namespace('gml:id')) or None
 
     # Get specification metadata records
-    spec_elem = elem.find('./gsml:specification', namespaces=NAMESPACES)
-    spec = specification(spec_elem)
+    if 'specification' in fields:
+        spec_elem = elem.find('./gsml:specification', namespaces=NAMESPACES)
+        if register:
+            data['specification'] = specification(spec_elem)
+        else:
+            data['specification'] = specification_key(spec_elem)
 
-    return MappedFeature(ident=ident, shape=shape_data['shape'],
-                         projection=shape_data['projection'],
-                         specification=spec)
+    return data
+
+
+def check_fields(fields):
+    """ Check that a list of fields to unmarshal for a gsml:MappedFeature are
+        all known, and return them as a set
+    """
+    fields = set(fields)
+    unknown = fields.difference(MAPPED_FEATURE_FIELDS)
+    if unknown:
+        raise ValueError(
+            ('Unknown MappedFeature fields {0}. '
+             'Allowed values are {1}').format(sorted(unknown),
+                                              list(MAPPED_FEATURE_FIELDS)))
+    return fields
 
 
 def specification(elem):
@@ -49,12 +114,59 @@ def specification(elem):
     else:
         spec_elem = elem.iterchildren().next()
         ident = spec_elem.get(expand_namespace('gml:id'))
+        if not DEDUPLICATE_SPECIFICATIONS:
+            mdata = Metadata(ident=ident,
+                             type=shorten_namespace(spec_elem.tag),
+                             tree=spec_elem)
+            return mdata.ident
+
+        # If we've already seen an identical record then just point at that,
+        # keeping our identifier as an alias so that xlinks still resolve
+        registry = current_registry()
+        digest = canonical_digest(spec_elem)
+        key = shared_key(registry, digest)
+        if key is not None:
+            if ident is not None and ident not in registry:
+                registry[ident] = registry[key]
+            return key
         mdata = Metadata(ident=ident,
                          type=shorten_namespace(spec_elem.tag),
-                         tree=spec_elem)
+                         tree=spec_elem, digest=digest)
         return mdata.ident
 
 
+def canonical_digest(elem):
+    """ Return a hash of the canonical form of an element
+
+        The gml:id attributes in the element are ignored, since these are
+        just document-local identifiers and will be different for each copy
+        of a record.
+    """
+    gml_id = expand_namespace('gml:id')
+    ids = [(e, e.attrib.pop(gml_id))
+           for e in elem.iter(tag=etree.Element) if gml_id in e.attrib]
+    try:
+        canonical = etree.tostring(elem, method='c14n')
+    finally:
+        for e, value in ids:
+            e.set(gml_id, value)
+    return hashlib.sha1(canonical).hexdigest()
+
+
+def specification_key(elem):
+    """ Return the metadata key for a gsml:specification element without
+        creating a metadata record
+
+        This is either the xlink target, or the gml:id of the inline record
+        (which may be None if the record has no identifier).
+    """
+    xlink = elem.get(expand_namespace('xlink:href'))
+    if xlink:
+        return xlink.lstrip('#')
+    else:
+        return elem.iterchildren().next().get(expand_namespace('gml:id'))
+
+
 def shape(elem):
     """ Unmarshal a gsml:shape element
 
@@ -8,26 +8,44 @@
     TODO: Pull unknown namespace definitions from XML file and add to registry
 """
 
-import simplejson
-import pkg_resources
+import json
+import pkgutil
 from ..utilities import Singleton
 
+_DEFAULT_NAMESPACES = None
+
+
+def default_namespaces():
+    """ Return the default namespaces listed in namespaces.json
+
+        The file is only read the first time this is called. We use pkgutil
+        rather than pkg_resources here since importing pkg_resources scans
+        every installed distribution, which is very slow.
+    """
+    global _DEFAULT_NAMESPACES
+    if _DEFAULT_NAMESPACES is None:
+        namespaces = json.loads(pkgutil.get_data(
+            'pysiss.vocabulary.resources', 'namespaces.json').decode('utf-8'))
+
+        # Keep native strings, since tags built from these end up in UUIDs
+        _DEFAULT_NAMESPACES = dict((str(k), str(v))
+                                   for k, v in namespaces.items())
+    return dict(_DEFAULT_NAMESPACES)
+
 
 class NamespaceRegistry(dict):
 
     """ Registry for namespace objects
+
+        The default namespaces are loaded when the registry is first
+        instantiated.
     """
 
     __metaclass__ = Singleton
 
-    # Load default namespaces list in namespaces.json
-    default_namespaces = simplejson.load(
-        pkg_resources.resource_stream(
-            "pysiss.vocabulary.resources", "namespaces.json"))
-
     def __init__(self):
         super(NamespaceRegistry, self).__init__()
-        self.update(self.default_namespaces)
+        self.update(default_namespaces())
         self.inverse = dict(reversed(item) for item in self.items())
 
     def __setitem__(self, key, value):
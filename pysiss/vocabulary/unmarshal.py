@@ -10,14 +10,33 @@ from .namespaces import shorten_namespace, expand_namespace
 from .gml import unmarshallers as gml
 from .gsml import unmarshallers as gsml
 from .erml import unmarshallers as erml
+from ..coverage.vector import MappedFeature
+from ..metadata import Metadata, current_registry, metadata_scope, \
+    shared_key
 
 from lxml import etree
+from io import BytesIO
+import bisect
+import mmap
+import multiprocessing
+import re
 
 UNMARSHALLERS = {}
 UNMARSHALLERS.update(gml.UNMARSHALLERS)
 UNMARSHALLERS.update(gsml.UNMARSHALLERS)
 UNMARSHALLERS.update(erml.UNMARSHALLERS)
 
+# Unmarshallers which return the constructor arguments for an object rather
+# than the object itself. The parallel loader uses these so that objects are
+# only built once all the metadata they refer to has been registered.
+DEFERRED_UNMARSHALLERS = {
+    'gsml:MappedFeature': (gsml.mapped_feature_data, MappedFeature)
+}
+
+# Opening and closing gml:featureMember tags, whatever the namespace prefix
+_MEMBER_START = re.compile(br'<(?:[\w.-]+:)?featureMember[\s>]')
+_MEMBER_END = re.compile(br'</(?:[\w.-]+:)?featureMember\s*>')
+
 
 def unmarshal(elem):
     """ Unmarshal an lxml.etree.Element element
@@ -33,17 +52,237 @@ def unmarshal(elem):
         return None
 
 
-def unmarshal_all(filename, tag='gsml:MappedFeature'):
+def unmarshal_all(filename, tag='gsml:MappedFeature', fields=None):
     """ Unmarshall all instances of a tag from an xml file
         and return them as a list of objects
+
+        If `fields` is given, only those fields are unmarshalled and a list
+        of dictionaries is returned instead of objects. Everything else in
+        each element (including specification metadata records) is skipped,
+        and elements are cleared as soon as they have been read, so this is
+        much faster and uses much less memory than building full objects.
+        Projection is only available for tags in `DEFERRED_UNMARSHALLERS`.
+
+        :param filename: The XML file to unmarshal
+        :type filename: string
+        :param tag: The tag to unmarshal. Optional, defaults to
+            'gsml:MappedFeature'
+        :type tag: string
+        :param fields: The fields to unmarshal (e.g. `['ident', 'shape']`
+            for gsml:MappedFeature). Optional, defaults to None (i.e.
+            unmarshal everything).
+        :type fields: iterable of strings
     """
+    unmarshal_data = _projected_unmarshaller(tag, fields)
     tag = expand_namespace(tag)
     results = []
     with open(filename, 'rb') as fhandle:
         try:
             context = iter(etree.iterparse(fhandle, events=('end',), tag=tag))
             for event, elem in context:
-                results.append(unmarshal(elem))
+                if fields is None:
+                    results.append(unmarshal(elem))
+                else:
+                    results.append(unmarshal_data(elem, fields))
+                    _release(elem)
         except etree.XMLSyntaxError:
             pass
     return results
+
+
+def unmarshal_all_parallel(filename, tag='gsml:MappedFeature', processes=None,
+                           chunks_per_process=4, fields=None):
+    """ Unmarshall all instances of a tag from an xml file using a pool of
+        worker processes, and return them as a list of objects
+
+        The file is split into byte ranges at gml:featureMember boundaries,
+        and each range is parsed in a seperate process. Metadata records
+        created by the workers are merged back into the current metadata
+        registry in this process, and the results are returned in document
+        order.
+
+        If the file has no gml:featureMember elements then this just falls
+        back to `unmarshal_all`.
+
+        :param filename: The XML file to unmarshal
+        :type filename: string
+        :param tag: The tag to unmarshal. Optional, defaults to
+            'gsml:MappedFeature'
+        :type tag: string
+        :param processes: The number of worker processes. Optional, defaults
+            to the number of CPUs.
+        :type processes: int
+        :param chunks_per_process: The number of chunks to split the file
+            into for each worker process, which helps balance the load when
+            features are different sizes. Optional, defaults to 4.
+        :type chunks_per_process: int
+        :param fields: The fields to unmarshal, see `unmarshal_all`.
+            Optional, defaults to None (i.e. unmarshal everything).
+        :type fields: iterable of strings
+        :returns: a list of unmarshalled objects
+    """
+    _projected_unmarshaller(tag, fields)
+    processes = processes or multiprocessing.cpu_count()
+    ranges = _feature_member_ranges(filename, processes * chunks_per_process)
+    if ranges is None:
+        return unmarshal_all(filename, tag, fields)
+
+    # Farm out the chunks to the workers
+    header_end, footer_start, chunks = ranges
+    jobs = [(filename, header_end, start, stop, footer_start, tag, fields)
+            for start, stop in chunks]
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunk_results = pool.map(_unmarshal_chunk, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Register all the metadata first, since features can refer to records
+    # which were defined in other chunks
+    registry = current_registry()
+    aliases = []
+    for _, records in chunk_results:
+        for key, ident, mdtype, tree, digest in records:
+            if key != ident:
+                # Alias for a shared record, we deal with these below
+                aliases.append((key, ident))
+                continue
+            shared = shared_key(registry, digest) if digest else None
+            if shared is not None and shared != ident:
+                # Identical to a record from another chunk
+                registry[ident] = registry[shared]
+            else:
+                Metadata(ident=ident, type=mdtype, tree=tree, digest=digest)
+    for key, ident in aliases:
+        if key not in registry:
+            registry[key] = registry[ident]
+
+    # Construct objects from the unmarshalled data if required
+    results = []
+    deferred = DEFERRED_UNMARSHALLERS.get(tag)
+    for items, _ in chunk_results:
+        if deferred and fields is None:
+            _, cls = deferred
+            results.extend(cls(**item) for item in items)
+        else:
+            results.extend(items)
+    return results
+
+
+def _release(elem):
+    """ Free an element we've finished with during an iterparse
+
+        Clearing the element only empties it, so we also delete everything
+        before it (and before each of its ancestors) in the document, which
+        would otherwise stay attached to the root as the file is read.
+    """
+    elem.clear()
+    node = elem
+    while node.getparent() is not None:
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+        node = node.getparent()
+
+
+def _projected_unmarshaller(tag, fields):
+    """ Return the data unmarshaller to use for a projected load of the
+        given tag, or None if no projection was asked for.
+
+        Raises a ValueError if the tag doesn't support projection.
+    """
+    if fields is None:
+        return None
+    try:
+        return DEFERRED_UNMARSHALLERS[tag][0]
+    except KeyError:
+        raise ValueError(
+            ('Unmarshalling selected fields is not supported for {0}. '
+             'Supported tags are {1}').format(
+                tag, DEFERRED_UNMARSHALLERS.keys()))
+
+
+def _feature_member_ranges(filename, nchunks):
+    """ Split an XML file into byte ranges at gml:featureMember boundaries
+
+        Returns a tuple containing the end of the file header (i.e. the
+        start of the first featureMember), the start of the file footer (i.e.
+        the end of the last featureMember), and a list of (start, stop) byte
+        ranges which each contain a whole number of featureMembers. Returns
+        None if there are no featureMember elements in the file.
+    """
+    with open(filename, 'rb') as fhandle:
+        try:
+            data = mmap.mmap(fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file, nothing to split
+            return None
+        try:
+            starts = [m.start() for m in _MEMBER_START.finditer(data)]
+            if not starts:
+                return None
+            last_end = _MEMBER_END.search(data, starts[-1])
+            if last_end is None:
+                return None
+            footer_start = last_end.end()
+        finally:
+            data.close()
+
+    # Pick the featureMember start nearest to each evenly-spaced target
+    header_end = starts[0]
+    step = (footer_start - header_end) / float(nchunks)
+    boundaries = [header_end]
+    for idx in range(1, nchunks):
+        target = header_end + idx * step
+        boundary = starts[min(bisect.bisect_left(starts, target),
+                              len(starts) - 1)]
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    boundaries.append(footer_start)
+    return header_end, footer_start, zip(boundaries[:-1], boundaries[1:])
+
+
+def _unmarshal_chunk(job):
+    """ Unmarshal the instances of a tag in a chunk of an XML file
+
+        This runs in a worker process for `unmarshal_all_parallel`. The chunk
+        is wrapped in the file header and footer so that it is a valid
+        document with all the namespace declarations. Returns the
+        unmarshalled items, and the metadata records created while parsing
+        as (key, ident, type, serialized tree, digest) tuples, where the key
+        differs from the record's identifier for aliases of shared records.
+    """
+    filename, header_end, start, stop, footer_start, tag, fields = job
+    with open(filename, 'rb') as fhandle:
+        header = fhandle.read(header_end)
+        fhandle.seek(start)
+        body = fhandle.read(stop - start)
+        fhandle.seek(footer_start)
+        footer = fhandle.read()
+
+    # Unmarshal the chunk into a fresh registry, so that we only send back
+    # the records created from this chunk. The current registry was
+    # inherited from the parent process and may share on-disk state with
+    # it, so we mustn't touch it.
+    deferred = DEFERRED_UNMARSHALLERS.get(tag)
+    items = []
+    with metadata_scope() as registry:
+        try:
+            context = etree.iterparse(BytesIO(header + body + footer),
+                                      events=('end',),
+                                      tag=expand_namespace(tag))
+            for event, elem in context:
+                if deferred:
+                    unmarshal_data, _ = deferred
+                    items.append(unmarshal_data(elem, fields))
+                    if fields is not None:
+                        _release(elem)
+                else:
+                    items.append(unmarshal(elem))
+        except etree.XMLSyntaxError:
+            pass
+
+    records = [(key, md.ident, md.type, md.serialized,
+                getattr(md, 'digest', None))
+               for key, md in registry.items()]
+    return items, records
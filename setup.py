@@ -49,15 +49,15 @@ setup(
     # Dependencies
     install_requires=[
         'matplotlib>=1.0',
-        'numpy>=1.6',
+        'numpy>=1.10',
         'scipy>=0.9',
         'OWSLib>=0.8',
         'lxml',
-        'simplejson>=3.0',
         'pandas>=0.10',
         'shapely',
         'requests',
-        'pint'
+        'pint',
+        'pyproj>=2.2'
     ],
 
     # Contents
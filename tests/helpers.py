@@ -0,0 +1,30 @@
+""" file:   helpers.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Monday 15 September, 2014
+
+    description: Feature fixtures shared between the coverage tests
+"""
+
+from pysiss.coverage.vector import StoredFeature
+from shapely.geometry import box
+import numpy
+
+
+def make_feature(ident, shape, specification=None, projection=None):
+    """ Make a bare feature with just the attributes the feature stores and
+        spatial indexes read
+    """
+    return StoredFeature(ident=ident, shape=shape,
+                         specification=specification, projection=projection)
+
+
+def random_features(number, seed=42):
+    """ Generate some random boxes
+    """
+    rng = numpy.random.RandomState(seed)
+    corners = rng.uniform(0, 100, size=(number, 2))
+    sizes = rng.uniform(0.1, 8, size=(number, 2))
+    return [make_feature('f{0}'.format(idx), box(x, y, x + dx, y + dy),
+                         specification='gu.test', projection='EPSG:3577')
+            for idx, ((x, y), (dx, dy)) in enumerate(zip(corners, sizes))]
@@ -8,9 +8,26 @@
 
 from pysiss import borehole as pybh
 from pysiss.utilities import Collection
+import numpy
+import operator
 import unittest
 
 
+def total_depth(borehole):
+    """ Sum the depths in a borehole's datasets (used in worker processes)
+    """
+    return sum(dataset.depths.sum()
+               for dataset in borehole.point_datasets.values())
+
+
+def mapped_depths(borehole):
+    """ Check whether a borehole's depths were memory-mapped (used in worker
+        processes)
+    """
+    depths = borehole.point_datasets['samples'].depths
+    return isinstance(depths, numpy.memmap), depths.sum()
+
+
 class TestBoreholeCollection(unittest.TestCase):
 
     """ Tests for BoreholeCollection
@@ -52,3 +69,128 @@ class TestBoreholeCollection(unittest.TestCase):
         for idx, (name, bh) in enumerate(coll.items()):
             self.assertEqual(bh, self.boreholes[idx])
             self.assertEqual(name, self.boreholes[idx].name)
+
+    def test_lookup(self):
+        """ Objects should be available by name or position
+        """
+        coll = Collection(self.boreholes)
+        self.assertEqual(len(coll._index), 10)
+        self.assertTrue(coll['test_3'] is self.boreholes[3])
+        self.assertTrue(coll[3] is self.boreholes[3])
+        self.assertTrue(coll[-1] is self.boreholes[-1])
+        self.assertEqual(coll[2:4].keys(), ['test_2', 'test_3'])
+        self.assertTrue('test_3' in coll)
+        self.assertTrue(self.boreholes[3] in coll)
+        self.assertRaises(KeyError, coll.__getitem__, 'missing')
+        self.assertRaises(IndexError, coll.__getitem__, 10)
+
+    def test_deletion(self):
+        """ Deleting objects should keep the rest in order
+        """
+        coll = Collection(self.boreholes)
+        del coll['test_3']
+        del coll[0]
+        self.assertEqual(len(coll), 8)
+        self.assertFalse('test_3' in coll)
+        self.assertEqual(coll.keys(), self.bh_names[1:3] + self.bh_names[4:])
+        self.assertTrue(coll[2] is self.boreholes[4])
+        self.assertTrue(coll['test_4'] is self.boreholes[4])
+        coll.append(self.boreholes[3])
+        self.assertTrue(coll[-1] is self.boreholes[3])
+
+    def test_replacement(self):
+        """ Adding an object with an existing name should replace it
+        """
+        coll = Collection(self.boreholes)
+        replacement = pybh.Borehole('test_5')
+        coll.append(replacement)
+        self.assertEqual(len(coll), 10)
+        self.assertTrue(coll[5] is replacement)
+        self.assertRaises(KeyError, coll.__setitem__, 'test_6', replacement)
+
+    def test_secondary_indexes(self):
+        """ Secondary indexes should find objects by attribute
+        """
+        for idx, bh in enumerate(self.boreholes):
+            bh.add_point_dataset('even' if idx % 2 == 0 else 'odd',
+                                 [1., 2.])
+            if idx < 3:
+                bh.add_point_dataset('shallow', [1., 2.])
+        coll = Collection(self.boreholes)
+        coll.add_index('datasets', lambda bh: bh.point_datasets.keys())
+        coll.add_index('name')
+        self.assertEqual(coll.find(datasets='odd').keys(),
+                         ['test_1', 'test_3', 'test_5', 'test_7', 'test_9'])
+        self.assertEqual(coll.find_keys(datasets='shallow'),
+                         ['test_0', 'test_1', 'test_2'])
+        self.assertEqual(coll.find_keys(datasets='even', name='test_2'),
+                         ['test_2'])
+        self.assertEqual(coll.find_keys(datasets='missing'), [])
+        self.assertRaises(KeyError, coll.find, endpoint='nowhere')
+
+        # Indexes should follow deletions and additions
+        del coll['test_1']
+        coll.append(pybh.Borehole('test_10'))
+        coll['test_10'].add_point_dataset('shallow', [1., 2.])
+        self.assertEqual(coll.find_keys(datasets='shallow'),
+                         ['test_0', 'test_2'])
+        coll['test_10'] = coll['test_10']
+        self.assertEqual(coll.find_keys(datasets='shallow'),
+                         ['test_0', 'test_2', 'test_10'])
+
+    def test_map(self):
+        """ Mapping should give results in order for every backend
+        """
+        for idx, bh in enumerate(self.boreholes):
+            bh.add_point_dataset('samples', numpy.arange(idx + 2.))
+        coll = Collection(self.boreholes)
+        expected = [sum(range(idx + 2)) for idx in range(10)]
+        self.assertEqual(coll.map(total_depth, workers=1), expected)
+        for backend in ('thread', 'process'):
+            for chunksize in (1, 3):
+                self.assertEqual(
+                    coll.map(total_depth, workers=2, backend=backend,
+                             chunksize=chunksize),
+                    expected)
+        results = coll.imap(total_depth, workers=2, chunksize=2)
+        self.assertEqual(next(results), 1)
+        self.assertRaises(ValueError, coll.map, total_depth, backend='gpu')
+
+    def test_reduce(self):
+        """ Reducing should combine the mapped results
+        """
+        for idx, bh in enumerate(self.boreholes):
+            bh.add_point_dataset('samples', numpy.arange(idx + 2.))
+        coll = Collection(self.boreholes)
+        self.assertEqual(coll.reduce(total_depth, operator.add, workers=2,
+                                     backend='process'),
+                         sum(sum(range(idx + 2)) for idx in range(10)))
+        self.assertEqual(coll.reduce(total_depth, max, workers=1), 55)
+        self.assertEqual(Collection().reduce(total_depth, max, 0), 0)
+        self.assertRaises(ValueError, Collection().reduce, total_depth, max)
+
+    def test_shared_arrays(self):
+        """ Large arrays should reach process workers as memory maps
+        """
+        for idx, bh in enumerate(self.boreholes):
+            size = 10 if idx % 2 else 20000
+            bh.add_point_dataset('samples', numpy.arange(size + idx,
+                                                         dtype=float))
+        coll = Collection(self.boreholes)
+        results = coll.map(mapped_depths, workers=2, backend='process',
+                           chunksize=3)
+        self.assertEqual([mapped for mapped, _ in results],
+                         [idx % 2 == 0 for idx in range(10)])
+        self.assertEqual([total for _, total in results],
+                         [total_depth(bh) for bh in self.boreholes])
+
+    def test_duplicate_keys_in_batch(self):
+        """ Only the last object with each key in a batch should be added
+        """
+        first, second = pybh.Borehole('dup'), pybh.Borehole('dup')
+        coll = Collection(self.boreholes[:2] + [first, second])
+        self.assertEqual(len(coll), 3)
+        self.assertTrue(coll['dup'] is second)
+        coll.extend([first, self.boreholes[0]])
+        self.assertEqual(coll.keys(), ['test_0', 'test_1', 'dup'])
+        self.assertTrue(coll['dup'] is first)
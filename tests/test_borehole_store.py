@@ -0,0 +1,165 @@
+""" file:   test_borehole_store.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Friday 12 September, 2014
+
+    description: Tests for disk-backed borehole collections
+"""
+
+from pysiss import borehole as pybh
+from pysiss.borehole.borehole import OriginPosition
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+
+DENSITY = pybh.PropertyType(name="d", long_name="density", units="g/cm3")
+
+
+def deepest(borehole):
+    """ Find the deepest sample in a borehole (used in worker processes)
+    """
+    return max(dataset.depths[-1]
+               for dataset in borehole.point_datasets.values())
+
+
+def make_borehole(idx):
+    """ Make a borehole with a point dataset
+    """
+    borehole = pybh.Borehole('bh_{0}'.format(idx),
+                             OriginPosition(-31. - idx, 117. + idx, 0.))
+    depths = numpy.linspace(0, 10 * (idx + 1), 20)
+    dataset = borehole.add_point_dataset('even' if idx % 2 == 0 else 'odd',
+                                         depths)
+    dataset.add_property(DENSITY, numpy.sin(depths))
+    borehole.details.add_detail('driller', 'driller {0}'.format(idx % 3))
+    return borehole
+
+
+class TestBoreholeStore(unittest.TestCase):
+
+    """ Tests for BoreholeStore and LazyBoreholeCollection
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.boreholes = [make_borehole(idx) for idx in range(10)]
+        self.store = pybh.BoreholeStore.create(self.tmpdir,
+                                               iter(self.boreholes))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameBorehole(self, borehole, expected):
+        self.assertEqual(borehole.name, expected.name)
+        self.assertEqual(borehole.details['driller'].values,
+                         expected.details['driller'].values)
+        for name, dataset in expected.point_datasets.items():
+            loaded = borehole.point_datasets[name]
+            self.assertTrue(numpy.allclose(loaded.depths, dataset.depths))
+            self.assertTrue(numpy.allclose(loaded.properties['d'].values,
+                                           dataset.properties['d'].values))
+
+    def test_store(self):
+        """ Boreholes and summaries should survive reopening the store
+        """
+        store = pybh.BoreholeStore(self.tmpdir)
+        self.assertEqual(store.names(), [bh.name for bh in self.boreholes])
+        self.assertSameBorehole(store.load('bh_3'), self.boreholes[3])
+        summary = store.summaries['bh_3']
+        self.assertEqual((summary.longitude, summary.latitude),
+                         (120., -34.))
+        self.assertEqual(summary.point_datasets['odd']['samples'], 20)
+        self.assertEqual(summary.point_datasets['odd']['end'], 40.)
+        self.assertEqual(summary.properties, ['d'])
+
+        store.remove('bh_3')
+        store.add(make_borehole(3))
+        store = pybh.BoreholeStore(self.tmpdir)
+        self.assertEqual(store.names()[-1], 'bh_3')
+        self.assertEqual(len(store), 10)
+        self.assertRaises(KeyError, store.load, 'bh_10')
+
+    def test_recreate(self):
+        """ Re-creating a store should remove the old boreholes
+        """
+        store = pybh.BoreholeStore.create(self.tmpdir, self.boreholes[:2])
+        self.assertEqual(store.names(), ['bh_0', 'bh_1'])
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.tmpdir, 'boreholes'))), 2)
+        self.assertRaises(KeyError, store.load, 'bh_3')
+        self.assertRaises(IOError, pybh.store.StoreLoader(self.tmpdir),
+                          'bh_3')
+        self.assertSameBorehole(pybh.store.StoreLoader(self.tmpdir)('bh_1'),
+                                self.boreholes[1])
+
+    def test_residency(self):
+        """ Only the most recently used boreholes should stay in memory
+        """
+        coll = pybh.LazyBoreholeCollection(self.tmpdir, max_resident=3)
+        self.assertEqual(len(coll), 10)
+        self.assertEqual(coll.resident, [])
+        self.assertSameBorehole(coll['bh_2'], self.boreholes[2])
+        self.assertSameBorehole(coll[5], self.boreholes[5])
+        for idx, borehole in enumerate(coll):
+            self.assertSameBorehole(borehole, self.boreholes[idx])
+            self.assertTrue(len(coll.resident) <= 3)
+        self.assertEqual(coll.resident, ['bh_7', 'bh_8', 'bh_9'])
+        self.assertTrue(coll['bh_8'] is coll['bh_8'])
+        self.assertEqual(coll.resident, ['bh_7', 'bh_9', 'bh_8'])
+
+    def test_read_ahead(self):
+        """ Read-ahead iteration should give the boreholes in order
+        """
+        coll = pybh.LazyBoreholeCollection(self.store, max_resident=2,
+                                           read_ahead=4)
+        names = [borehole.name for borehole in coll]
+        self.assertEqual(names, [bh.name for bh in self.boreholes])
+        self.assertEqual(coll.resident, ['bh_8', 'bh_9'])
+
+        # Stopping early should be fine too
+        for borehole in coll[2:]:
+            break
+        self.assertEqual(borehole.name, 'bh_2')
+
+    def test_find(self):
+        """ Finding boreholes should use the summaries without loading
+        """
+        coll = pybh.LazyBoreholeCollection(self.store)
+        coll.add_index('datasets', lambda summary: summary.datasets)
+        found = coll.find(datasets='odd')
+        self.assertEqual(coll.resident, [])
+        self.assertEqual(found.keys(), ['bh_1', 'bh_3', 'bh_5', 'bh_7',
+                                        'bh_9'])
+        self.assertEqual([bh.name for bh in found], found.keys())
+
+    def test_map(self):
+        """ Map workers should load boreholes from the store
+        """
+        coll = pybh.LazyBoreholeCollection(self.store, max_resident=2)
+        expected = [10. * (idx + 1) for idx in range(10)]
+        for backend in ('thread', 'process'):
+            self.assertEqual(coll.map(deepest, workers=3, backend=backend,
+                                      chunksize=2),
+                             expected)
+        self.assertEqual(coll.resident, [])
+        self.assertEqual(coll[1:3].map(deepest, workers=1), [20., 30.])
+
+    def test_modification(self):
+        """ Adding boreholes should write them to the store, while deleting
+            them should only remove them from the collection
+        """
+        coll = pybh.LazyBoreholeCollection(self.store, max_resident=2)
+        coll.append(make_borehole(10))
+        self.assertEqual(coll.keys()[-1], 'bh_10')
+        self.assertTrue('bh_10' in self.store)
+        del coll['bh_0']
+        self.assertFalse('bh_0' in coll)
+        self.assertTrue('bh_0' in self.store)
+        self.assertEqual(len(coll), 10)
+        self.assertEqual(len(pybh.BoreholeStore(self.tmpdir)), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+""" file:   test_cache.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Friday 29 August, 2014
+
+    description: Tests for binary sidecar caches of unmarshalled features
+"""
+
+from pysiss.vocabulary.cache import unmarshal_all_cached, read_cache, \
+    write_cache
+from pysiss.vocabulary.unmarshal import unmarshal_all
+from pysiss.metadata import MetadataRegistry
+from pysiss.coverage import MappedFeature
+from shapely.geometry import box
+import os
+import shutil
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FEATURES_FILE = os.path.join(TEST_DIR, 'geosciml', 'mappedfeatures.xml')
+
+
+class TestFeatureCache(unittest.TestCase):
+
+    """ Tests for caching unmarshalled MappedFeatures
+    """
+
+    def setUp(self):
+        self.registry = MetadataRegistry()
+        self.registry.clear()
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'mappedfeatures.xml')
+        shutil.copy(FEATURES_FILE, self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        """ Features read from the cache should match the originals
+        """
+        features = unmarshal_all_cached(self.filename)
+        self.assertTrue(os.path.isdir(self.filename + '.pysiss'))
+        self.registry.clear()
+
+        cached = read_cache(self.filename)
+        self.assertEqual([f.ident for f in features],
+                         [f.ident for f in cached])
+        for feature, cached_feature in zip(features, cached):
+            self.assertTrue(feature.shape.equals(cached_feature.shape))
+            self.assertEqual(feature.projection, cached_feature.projection)
+            self.assertEqual(feature.specification,
+                             cached_feature.specification)
+        self.assertEqual(sorted(self.registry.keys()),
+                         ['gu.basalt', 'gu.granite', 'gu.sandstone'])
+        self.assertEqual(self.registry['gu.granite'].type,
+                         'gsml:GeologicUnit')
+
+    def test_missing(self):
+        """ There should be no cache until one is written
+        """
+        self.assertTrue(read_cache(self.filename) is None)
+
+    def test_modified(self):
+        """ Changing the source file should invalidate the cache
+        """
+        write_cache(unmarshal_all(self.filename), self.filename)
+        with open(self.filename, 'a') as fhandle:
+            fhandle.write('\n')
+        self.assertTrue(read_cache(self.filename) is None)
+
+    def test_touched(self):
+        """ Touching the source file without changing it should keep the
+            cache valid
+        """
+        write_cache(unmarshal_all(self.filename), self.filename)
+        stat = os.stat(self.filename)
+        os.utime(self.filename, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(len(read_cache(self.filename)), 5)
+
+    def test_unsupported_tag(self):
+        """ Only MappedFeatures can be cached
+        """
+        self.assertRaises(ValueError, unmarshal_all_cached, self.filename,
+                          tag='gml:Polygon')
+
+    def test_no_specification(self):
+        """ Features without specifications should read back as None
+        """
+        feature = MappedFeature(shape=box(0, 0, 1, 1),
+                                projection='EPSG:4326', specification=None,
+                                ident='mf.none')
+        write_cache(unmarshal_all(self.filename) + [feature], self.filename)
+        cached = read_cache(self.filename)
+        self.assertTrue(cached[-1].specification is None)
+        self.assertEqual(cached[0].specification, 'gu.granite')
+
+    def test_bad_arguments(self):
+        """ Projected loads and parallel-only arguments should be refused
+            rather than ignored
+        """
+        self.assertRaises(ValueError, unmarshal_all_cached, self.filename,
+                          fields=['ident'])
+        self.assertRaises(ValueError, unmarshal_all_cached, self.filename,
+                          parallel=True, fields=['ident'])
+        self.assertRaises(TypeError, unmarshal_all_cached, self.filename,
+                          processes=2)
+        self.assertRaises(ValueError, write_cache,
+                          unmarshal_all(self.filename, fields=['ident']),
+                          self.filename)
+        self.assertTrue(read_cache(self.filename) is None)
+        features = unmarshal_all_cached(self.filename, parallel=True,
+                                        processes=2)
+        self.assertEqual(len(features), 5)
+        self.assertEqual(len(read_cache(self.filename)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+""" file:   test_feature_store.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Thursday 4 September, 2014
+
+    description: Tests for columnar feature stores
+"""
+
+from pysiss.coverage import FeatureStore, MappedFeature
+from pysiss.metadata import MetadataRegistry
+from pysiss.vocabulary.unmarshal import unmarshal_all
+from shapely.geometry import Point, LineString, Polygon, MultiPolygon, \
+    MultiLineString
+from tests.helpers import make_feature
+import numpy
+import os
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FEATURES_FILE = os.path.join(TEST_DIR, 'geosciml', 'mappedfeatures.xml')
+
+SHAPES = [
+    Point(1, 2),
+    LineString([(0, 0), (3, 4), (3, 10)]),
+    Polygon([(10, 10), (10, 20), (30, 20), (30, 10)],
+            [[(12, 12), (14, 12), (14, 14), (12, 14)]]),
+    MultiLineString([[(0, 0), (1, 0)], [(5, 5), (5, 8)]]),
+    MultiPolygon([Polygon([(0, 0), (1, 0), (1, 1)]),
+                  Polygon([(1e6, 1e6), (1e6 + 2, 1e6), (1e6 + 2, 1e6 + 3),
+                           (1e6, 1e6 + 3)])])]
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    """ Tests for FeatureStore
+    """
+
+    def setUp(self):
+        MetadataRegistry().clear()
+        self.features = unmarshal_all(FEATURES_FILE)
+        self.store = FeatureStore.from_features(self.features)
+        self.mixed = FeatureStore.from_features(
+            [make_feature('f{0}'.format(idx), shape, 'gu.granite', 'EPSG:4326')
+             for idx, shape in enumerate(SHAPES)])
+
+    def test_roundtrip(self):
+        """ Materialised features should match the originals
+        """
+        self.assertEqual(len(self.store), 5)
+        for idx, feature in enumerate(self.features):
+            stored = self.store[idx]
+            self.assertTrue(isinstance(stored, MappedFeature))
+            self.assertEqual(stored.ident, feature.ident)
+            self.assertEqual(stored.specification, feature.specification)
+            self.assertTrue(stored.shape.equals(feature.shape))
+        for idx, shape in enumerate(SHAPES):
+            self.assertEqual(self.mixed.shape(idx).geom_type, shape.geom_type)
+            self.assertTrue(self.mixed.shape(idx).equals(shape))
+
+    def test_vectorised(self):
+        """ Bounds, areas, lengths and centroids should match shapely
+        """
+        for store, shapes in ((self.store, [f.shape for f in self.features]),
+                              (self.mixed, SHAPES)):
+            numpy.testing.assert_allclose(
+                store.bounds, [shape.bounds for shape in shapes])
+            numpy.testing.assert_allclose(
+                store.area(), [shape.area for shape in shapes])
+            numpy.testing.assert_allclose(
+                store.length(), [shape.length for shape in shapes])
+            numpy.testing.assert_allclose(
+                store.centroid(),
+                [shape.centroid.coords[0] for shape in shapes])
+
+    def test_filter(self):
+        """ Filtering should give a store with just the matching features
+        """
+        granite = self.store.filter(specification='gu.granite')
+        self.assertEqual(list(granite.idents), ['mf.1', 'mf.3'])
+        self.assertTrue(granite.shape(1).equals(self.features[2].shape))
+        big = self.mixed.filter(self.mixed.area() > 10, bounds=(0, 0, 50, 50))
+        self.assertEqual(list(big.idents), ['f2'])
+        self.assertTrue(big.shape(0).equals(SHAPES[2]))
+        subset = self.mixed[[4, 1]]
+        self.assertTrue(subset.shape(0).equals(SHAPES[4]))
+        self.assertTrue(subset.shape(1).equals(SHAPES[1]))
+        self.assertEqual(len(self.mixed[:0]), 0)
+
+    def test_unsupported(self):
+        """ Unsupported geometries should raise a ValueError
+        """
+        from shapely.geometry import MultiPoint
+        self.assertRaises(ValueError, FeatureStore.from_features,
+                          [make_feature('f', MultiPoint([(0, 0)]), 'a', 'b')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+""" file:   test_join.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Monday 8 September, 2014
+
+    description: Tests for joining boreholes to mapped features
+"""
+
+from pysiss.borehole import Borehole
+from pysiss.borehole.borehole import OriginPosition
+from pysiss.coverage import FeatureCollection, FeatureStore, join_collars
+from pysiss.metadata import MetadataRegistry
+from pysiss.utilities import Collection
+from pysiss.vocabulary.unmarshal import unmarshal_all
+from shapely.geometry import Point, Polygon, MultiPolygon
+from tests.helpers import make_feature
+import numpy
+import os
+import pint
+import unittest
+import warnings
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FEATURES_FILE = os.path.join(TEST_DIR, 'geosciml', 'mappedfeatures.xml')
+
+# Collar locations and the features they should land in
+COLLARS = [((0.5, 0.5), 'mf.1'), ((1.5, 0.5), 'mf.2'), ((2.1, 0.5), 'mf.3'),
+           ((2.5, 0.5), None), ((3.5, 1.5), 'mf.4'), ((0.5, 1.5), 'mf.5'),
+           ((10, 10), None), (None, None)]
+
+
+class TestJoinCollars(unittest.TestCase):
+
+    """ Tests for joining borehole collars to features
+    """
+
+    def setUp(self):
+        MetadataRegistry().clear()
+        self.features = unmarshal_all(FEATURES_FILE)
+        ureg = pint.UnitRegistry()
+        self.boreholes = Collection()
+        for idx, (location, _) in enumerate(COLLARS):
+            if location is None:
+                position = None
+            else:
+                position = OriginPosition(
+                    longitude=location[0] * ureg.degree,
+                    latitude=location[1] * ureg.degree,
+                    elevation=0 * ureg.meter)
+            self.boreholes.append(Borehole('bh{0}'.format(idx), position))
+        self.expected = [ident for _, ident in COLLARS]
+
+    def test_features(self):
+        """ Joining against MappedFeatures should return the originals
+        """
+        joined = join_collars(self.boreholes,
+                              FeatureCollection(self.features))
+        self.assertEqual(list(joined.index),
+                         ['bh{0}'.format(i) for i in range(len(COLLARS))])
+        self.assertEqual(list(joined.ident), self.expected)
+        self.assertTrue(joined.feature['bh0'] is self.features[0])
+        self.assertEqual(joined.specification['bh2'], 'gu.granite')
+        self.assertTrue(numpy.isnan(joined.latitude['bh7']))
+
+    def test_store(self):
+        """ Joining against a FeatureStore should give the same answer
+        """
+        joined = join_collars(self.boreholes,
+                              FeatureStore.from_features(self.features))
+        self.assertEqual(list(joined.ident), self.expected)
+        self.assertEqual(joined.feature['bh4'].ident, 'mf.4')
+
+    def test_projected(self):
+        """ Collars should be transformed into the features' projection
+        """
+        for feature in self.features:
+            feature.reproject('EPSG:3577')
+        joined = join_collars(self.boreholes, self.features)
+        self.assertEqual(list(joined.ident), self.expected)
+
+
+class TestContainsPoints(unittest.TestCase):
+
+    """ Tests for vectorised point-in-polygon tests
+    """
+
+    def test_against_shapely(self):
+        """ Point in polygon tests should match shapely
+        """
+        shapes = [
+            Polygon([(0, 0), (4, 0), (4, 4), (0, 4)],
+                    [[(1, 1), (3, 1), (3, 3), (1, 3)]]),
+            MultiPolygon([Polygon([(5, 0), (6, 0), (5.5, 2)]),
+                          Polygon([(7, 0), (9, 0), (9, 3), (8, 1), (7, 3)])])]
+        features = [make_feature('f{0}'.format(idx), shape)
+                    for idx, shape in enumerate(shapes)]
+        store = FeatureStore.from_features(features)
+        points = numpy.random.RandomState(0).uniform(-1, 10, size=(2000, 2))
+        expected = [0 if shapes[0].contains(Point(p))
+                    else 1 if shapes[1].contains(Point(p)) else -1
+                    for p in points]
+        self.assertEqual(list(store.locate(points)), expected)
+        for max_segments in (1, 7, 2 ** 22):
+            self.assertEqual(
+                list(store.contains_points(points, [1] * len(points),
+                                           max_segments=max_segments)),
+                [shapes[1].contains(Point(p)) for p in points])
+
+    def test_contains_points_horizontal_edges(self):
+        """ Points level with horizontal edges shouldn't raise floating point
+            warnings
+        """
+        feature = make_feature(
+            'f0', Polygon([(0, 0), (4, 0), (4, 4), (0, 4)],
+                          [[(1, 1), (3, 1), (3, 3), (1, 3)]]))
+        store = FeatureStore.from_features([feature])
+        points = numpy.array([(-1, 0), (0.5, 1), (3.5, 3), (5, 1), (5, 4)],
+                             dtype=float)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            inside = store.contains_points(points, [0] * len(points))
+        self.assertEqual(list(inside), [feature.shape.contains(Point(p))
+                                        for p in points])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+""" file:   test_mapped_feature.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Friday 5 September, 2014
+
+    description: Tests for MappedFeatures
+"""
+
+from pysiss.coverage import MappedFeature
+from pysiss.metadata import Metadata, MetadataRegistry
+from shapely.geometry import box
+import pickle
+import unittest
+
+RECORD = (b'<gsml:GeologicUnit xmlns:gsml="urn:cgi:xmlns:CGI:GeoSciML:2.0" '
+          b'xmlns:gml="http://www.opengis.net/gml" gml:id="gu.granite"/>')
+
+
+class TestMappedFeature(unittest.TestCase):
+
+    """ Tests for MappedFeature
+    """
+
+    def setUp(self):
+        MetadataRegistry().clear()
+        Metadata(ident='gu.granite', tree=RECORD, type='gsml:GeologicUnit')
+        self.feature = MappedFeature(shape=box(0, 0, 2, 1),
+                                     projection='EPSG:4326',
+                                     specification='gu.granite',
+                                     ident='mf.1')
+
+    def test_lazy(self):
+        """ Derived attributes should only be worked out when needed
+        """
+        self.assertTrue(self.feature._centroid is None)
+        self.assertTrue(self.feature._type is None)
+        self.assertTrue(self.feature.centroid.within(self.feature.shape))
+        self.assertEqual(self.feature.type, 'gsml:GeologicUnit')
+        self.assertTrue(self.feature.uuid is not None)
+
+    def test_default_idents(self):
+        """ Features without idents should get distinct ones
+        """
+        features = [MappedFeature(shape=box(0, 0, 1, 1),
+                                  projection='EPSG:4326',
+                                  specification='gu.granite')
+                    for _ in range(2)]
+        self.assertNotEqual(features[0].ident, features[1].ident)
+        self.assertNotEqual(features[0].uuid, features[1].uuid)
+        self.assertNotEqual(self.feature.uuid, features[0].uuid)
+
+    def test_shape_resets_centroid(self):
+        """ Changing the shape should change the centroid
+        """
+        self.feature.centroid
+        self.feature.shape = box(10, 10, 11, 11)
+        self.assertTrue(self.feature.centroid.within(self.feature.shape))
+
+    def test_slots(self):
+        """ Features shouldn't need an instance dictionary unless they have
+            extra attributes
+        """
+        self.assertFalse(hasattr(MappedFeature, '__weakref__'))
+        feature = MappedFeature(shape=box(0, 0, 1, 1), projection='EPSG:4326',
+                                specification='gu.granite', colour='red')
+        self.assertEqual(feature.colour, 'red')
+
+    def test_pickle(self):
+        """ Features should survive pickling, including extra attributes
+        """
+        self.feature.colour = 'red'
+        for protocol in (0, 2):
+            feature = pickle.loads(pickle.dumps(self.feature, protocol))
+            self.assertEqual(feature.ident, 'mf.1')
+            self.assertEqual(feature.colour, 'red')
+            self.assertTrue(feature.shape.equals(self.feature.shape))
+            self.assertEqual(feature.type, 'gsml:GeologicUnit')
+
+
+if __name__ == '__main__':
+    unittest.main()
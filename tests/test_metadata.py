@@ -0,0 +1,412 @@
+""" file:   test_metadata.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Thursday 28 August, 2014
+
+    description: Tests for metadata records and the metadata registry
+"""
+
+from pysiss.metadata import Metadata, MetadataRegistry, \
+    ScopedMetadataRegistry, current_registry, metadata_scope, extract_table
+from pysiss.vocabulary.unmarshal import unmarshal_all
+from lxml import etree
+import gc
+import os
+import pickle
+import threading
+import time
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FEATURES_FILE = os.path.join(TEST_DIR, 'geosciml', 'mappedfeatures.xml')
+
+RECORD = (b'<gsml:GeologicUnit xmlns:gsml="urn:cgi:xmlns:CGI:GeoSciML:2.0" '
+          b'xmlns:gml="http://www.opengis.net/gml" gml:id="gu.granite">'
+          b'<gml:name>Mount Test Granite</gml:name>'
+          b'</gsml:GeologicUnit>')
+NAMESPACES = {'gml': 'http://www.opengis.net/gml'}
+GSML_NAMESPACES = {'gml': 'http://www.opengis.net/gml',
+                   'gsml': 'urn:cgi:xmlns:CGI:GeoSciML:2.0',
+                   'xlink': 'http://www.w3.org/1999/xlink'}
+LITHOLOGY = 'urn:cgi:classifier:CGI:SimpleLithology:200811:{0}'
+
+
+class TestCompactMetadata(unittest.TestCase):
+
+    """ Tests for compact metadata records
+    """
+
+    def setUp(self):
+        self.registry = MetadataRegistry()
+        self.registry.clear()
+
+    def test_default(self):
+        """ Records should keep their tree by default
+        """
+        tree = etree.fromstring(RECORD)
+        mdata = Metadata(ident='gu.granite', tree=tree,
+                         type='gsml:GeologicUnit')
+        self.assertTrue(mdata.tree is tree)
+        self.assertTrue(self.registry['gu.granite'] is mdata)
+
+    def test_compact(self):
+        """ Compact records should only store serialized XML
+        """
+        mdata = Metadata(ident='gu.granite', tree=etree.fromstring(RECORD),
+                         type='gsml:GeologicUnit', compact=True)
+        self.assertTrue(mdata._tree is None)
+        self.assertTrue(isinstance(mdata.serialized, bytes))
+        self.assertEqual(
+            mdata.xpath('./gml:name/text()', namespaces=NAMESPACES),
+            ['Mount Test Granite'])
+
+    def test_compact_from_bytes(self):
+        """ Records should accept serialized XML
+        """
+        mdata = Metadata(ident='gu.granite', tree=RECORD,
+                         type='gsml:GeologicUnit', compact=True)
+        self.assertEqual(mdata.serialized, RECORD)
+        mdata = Metadata(ident='gu.granite', tree=RECORD,
+                         type='gsml:GeologicUnit')
+        self.assertEqual(mdata.tree.get('{http://www.opengis.net/gml}id'),
+                         'gu.granite')
+
+    def test_class_default(self):
+        """ Setting Metadata.compact should change the default storage
+        """
+        Metadata.compact = True
+        try:
+            mdata = Metadata(ident='gu.granite', tree=RECORD,
+                             type='gsml:GeologicUnit')
+            self.assertTrue(mdata._tree is None)
+        finally:
+            Metadata.compact = False
+
+    def test_extract(self):
+        """ Extracted fields should be available without reparsing
+        """
+        query = etree.XPath('./gml:name/text()', namespaces=NAMESPACES)
+        mdata = Metadata(ident='gu.granite', tree=RECORD,
+                         type='gsml:GeologicUnit', compact=True,
+                         extract={'name': './gml:name/text()',
+                                  'compiled': query})
+        self.assertEqual(mdata.fields['name'], ['Mount Test Granite'])
+        self.assertEqual(mdata.fields['compiled'], ['Mount Test Granite'])
+
+
+class TestScopedRegistry(unittest.TestCase):
+
+    """ Tests for scoped metadata registries
+    """
+
+    def setUp(self):
+        MetadataRegistry().clear()
+
+    def make_record(self, ident, **kwargs):
+        return Metadata(ident=ident, tree=RECORD, type='gsml:GeologicUnit',
+                        **kwargs)
+
+    def test_scope(self):
+        """ Records created in a scope should go into the scoped registry
+        """
+        with metadata_scope() as registry:
+            self.assertTrue(current_registry() is registry)
+            self.make_record('scoped')
+        self.assertTrue(current_registry() is MetadataRegistry())
+        self.assertTrue('scoped' in registry)
+        self.assertFalse('scoped' in MetadataRegistry())
+
+    def test_features_keep_registry(self):
+        """ Features should look up metadata in their own registry after the
+            scope has exited
+        """
+        with metadata_scope() as registry:
+            features = unmarshal_all(FEATURES_FILE)
+        self.assertEqual(len(MetadataRegistry()), 0)
+        self.assertEqual(len(registry), 3)
+        self.assertEqual(features[2].metadata.ident, 'gu.granite')
+
+    def test_lru_spill(self):
+        """ Evicted records should be spilled to disk and reloaded
+        """
+        registry = ScopedMetadataRegistry(max_size=2)
+        try:
+            with metadata_scope(registry):
+                for idx in range(5):
+                    self.make_record('record_{0}'.format(idx))
+            self.assertEqual(len(registry), 5)
+            self.assertEqual(registry.resident, 2)
+            mdata = registry['record_0']
+            self.assertEqual(mdata.ident, 'record_0')
+            self.assertEqual(
+                mdata.xpath('./gml:name/text()', namespaces=NAMESPACES),
+                ['Mount Test Granite'])
+            self.assertEqual(registry.resident, 2)
+            self.assertEqual(sorted(registry.keys()),
+                             ['record_{0}'.format(i) for i in range(5)])
+            del registry['record_1']
+            self.assertFalse('record_1' in registry)
+        finally:
+            registry.close()
+
+    def test_spill_many(self):
+        """ Reading back lots of spilled records should take linear time
+        """
+        registry = ScopedMetadataRegistry(max_size=10)
+        try:
+            with metadata_scope(registry):
+                for idx in range(4000):
+                    self.make_record('record_{0}'.format(idx))
+            start = time.time()
+            for idx in range(4000):
+                self.assertEqual(registry['record_{0}'.format(idx)].ident,
+                                 'record_{0}'.format(idx))
+            self.assertTrue(time.time() - start < 10)
+            self.assertEqual(len(registry), 4000)
+            self.assertEqual(registry.resident, 10)
+            self.assertTrue(registry._store.wasted
+                            <= max(registry._store.used, 2 ** 20))
+            start = time.time()
+            registry.clear()
+            self.assertTrue(time.time() - start < 1)
+            self.assertEqual(len(registry), 0)
+            self.assertEqual(os.path.getsize(registry._store.path), 0)
+        finally:
+            registry.close()
+
+    def test_scope_threads(self):
+        """ Each thread should have its own stack of scopes
+        """
+        first_in, second_in, first_out = [threading.Event()
+                                          for _ in range(3)]
+        registries = {}
+
+        def load(name, wait_for, signal):
+            with metadata_scope() as registry:
+                registries[name] = registry
+                signal[0].set()
+                wait_for[0].wait(10)
+                self.make_record(name)
+            registries[name + '_after'] = current_registry()
+            signal[1].set()
+
+        # The first thread enters its scope first but records and exits
+        # while the second thread is still in its scope
+        first = threading.Thread(target=load, args=(
+            'first', (second_in,), (first_in, first_out)))
+        second = threading.Thread(target=load, args=(
+            'second', (first_out,), (second_in, threading.Event())))
+        first.start()
+        first_in.wait(10)
+        second.start()
+        first.join()
+        second.join()
+        self.assertEqual(list(registries['first'].keys()), ['first'])
+        self.assertEqual(list(registries['second'].keys()), ['second'])
+        self.assertTrue(registries['first_after'] is MetadataRegistry())
+        self.assertTrue(registries['second_after'] is MetadataRegistry())
+        self.assertTrue(current_registry() is MetadataRegistry())
+        self.assertEqual(len(MetadataRegistry()), 0)
+
+    def test_lru_drop(self):
+        """ Evicted records should be dropped if we're not spilling
+        """
+        with metadata_scope(max_size=2, spill=False) as registry:
+            for idx in range(5):
+                self.make_record('record_{0}'.format(idx))
+        self.assertEqual(sorted(registry.keys()), ['record_3', 'record_4'])
+
+    def test_weak(self):
+        """ Weak registries should release unreferenced records
+        """
+        with metadata_scope(weak=True) as registry:
+            features = unmarshal_all(FEATURES_FILE)
+            self.make_record('unused')
+        gc.collect()
+        self.assertFalse('unused' in registry)
+        self.assertEqual(len(registry), 3)
+        del features
+        gc.collect()
+        self.assertEqual(len(registry), 0)
+
+    def test_weak_and_bounded(self):
+        """ We can't have a weak bounded registry
+        """
+        self.assertRaises(ValueError, ScopedMetadataRegistry,
+                          max_size=10, weak=True)
+
+    def test_pickle(self):
+        """ Metadata records should survive pickling
+        """
+        mdata = pickle.loads(pickle.dumps(self.make_record('pickled')))
+        self.assertEqual(
+            mdata.xpath('./gml:name/text()', namespaces=NAMESPACES),
+            ['Mount Test Granite'])
+
+
+class TestRegistryIndexes(unittest.TestCase):
+
+    """ Tests for secondary indexes on metadata registries
+    """
+
+    def setUp(self):
+        self.registry = MetadataRegistry()
+        self.registry.clear()
+        self.registry.indexes.clear()
+
+    def tearDown(self):
+        self.registry.indexes.clear()
+
+    def add_indexes(self, registry):
+        registry.add_index('lithology', './/gsml:lithology/@xlink:href',
+                           namespaces=GSML_NAMESPACES)
+        registry.add_index('age', './/gsml:eventAge//gsml:value',
+                           namespaces=GSML_NAMESPACES)
+
+    def check_lookups(self, registry):
+        self.assertEqual(registry.find(lithology=LITHOLOGY.format('granite')),
+                         set(['gu.granite']))
+        self.assertEqual(registry.find(age='Devonian'),
+                         set(['gu.granite', 'gu.sandstone']))
+        self.assertEqual(
+            registry.find(type='gsml:GeologicUnit', age='Devonian',
+                          lithology=LITHOLOGY.format('sandstone')),
+            set(['gu.sandstone']))
+        self.assertEqual(registry.find(type='gsml:Borehole'), set())
+        self.assertEqual(registry.find(age='Jurassic'), set())
+
+    def test_index_on_register(self):
+        """ Records registered after an index is added should be indexed
+        """
+        self.add_indexes(self.registry)
+        unmarshal_all(FEATURES_FILE)
+        self.check_lookups(self.registry)
+
+    def test_index_existing(self):
+        """ Adding an index should index existing records
+        """
+        unmarshal_all(FEATURES_FILE)
+        self.add_indexes(self.registry)
+        self.check_lookups(self.registry)
+
+    def test_deregister(self):
+        """ Deregistered records should be removed from the indexes
+        """
+        self.add_indexes(self.registry)
+        unmarshal_all(FEATURES_FILE)
+        self.registry.deregister('gu.granite')
+        self.assertEqual(self.registry.find(age='Devonian'),
+                         set(['gu.sandstone']))
+        self.assertEqual(
+            self.registry.find(lithology=LITHOLOGY.format('granite')), set())
+
+    def test_scoped(self):
+        """ Scoped registries should support indexes too, including for
+            spilled records
+        """
+        registry = ScopedMetadataRegistry(max_size=1)
+        try:
+            self.add_indexes(registry)
+            with metadata_scope(registry):
+                unmarshal_all(FEATURES_FILE)
+            self.check_lookups(registry)
+        finally:
+            registry.close()
+
+    def test_extracted_fields(self):
+        """ Indexes should use extracted fields when they're available
+        """
+        self.registry.add_index('name', './gml:missing/text()',
+                                namespaces=NAMESPACES)
+        Metadata(ident='gu.granite', tree=RECORD, type='gsml:GeologicUnit',
+                 compact=True, extract={'name': './gml:name/text()'})
+        self.assertEqual(self.registry.find(name='Mount Test Granite'),
+                         set(['gu.granite']))
+
+    def test_unknown_index(self):
+        """ Looking up an unknown field should raise a KeyError
+        """
+        self.assertRaises(KeyError, self.registry.find, lithology='granite')
+
+
+class TestExtractTable(unittest.TestCase):
+
+    """ Tests for bulk extraction of tables from metadata records
+    """
+
+    queries = [('name', 'string(./gml:name)'),
+               ('age', './/gsml:eventAge//gsml:value/text()'),
+               ('lithology', './/gsml:lithology/@xlink:href')]
+
+    def setUp(self):
+        self.registry = MetadataRegistry()
+        self.registry.clear()
+        self.registry.indexes.clear()
+        unmarshal_all(FEATURES_FILE)
+
+    def tearDown(self):
+        self.registry.indexes.clear()
+
+    def check_table(self, table):
+        self.assertEqual(list(table.columns), ['name', 'age', 'lithology'])
+        self.assertEqual(list(table.index),
+                         ['gu.basalt', 'gu.granite', 'gu.sandstone'])
+        self.assertEqual(table.loc['gu.granite', 'age'], 'Devonian')
+        self.assertEqual(table.loc['gu.basalt', 'lithology'],
+                         LITHOLOGY.format('basalt'))
+
+    def test_dataframe(self):
+        """ All records should be extracted into a DataFrame
+        """
+        self.check_table(extract_table(self.queries,
+                                       namespaces=GSML_NAMESPACES))
+
+    def test_parallel(self):
+        """ Extracting in worker processes should give the same table
+        """
+        self.check_table(extract_table(self.queries,
+                                       namespaces=GSML_NAMESPACES,
+                                       processes=2, chunksize=1))
+
+    def test_parallel_compiled(self):
+        """ Compiled queries should be refused when extracting in worker
+            processes, since their namespaces would be lost
+        """
+        queries = [('name', etree.XPath('string(./gml:name)',
+                                        namespaces=GSML_NAMESPACES))]
+        self.assertRaises(ValueError, extract_table, queries, processes=2)
+        table = extract_table(queries)
+        self.assertEqual(table.loc['gu.granite', 'name'],
+                         'Mount Test Granite')
+
+    def test_columns(self):
+        """ We should be able to get NumPy columns instead
+        """
+        table = extract_table(self.queries, namespaces=GSML_NAMESPACES,
+                              as_dataframe=False)
+        self.assertEqual(sorted(table.keys()),
+                         ['age', 'key', 'lithology', 'name'])
+        self.assertEqual(len(table['age']), 3)
+        self.assertEqual(list(table['key']),
+                         ['gu.basalt', 'gu.granite', 'gu.sandstone'])
+        self.assertEqual(list(table['age']),
+                         ['Cambrian', 'Devonian', 'Devonian'])
+
+    def test_filtered(self):
+        """ We should be able to extract a subset of records
+        """
+        self.registry.add_index('age', './/gsml:eventAge//gsml:value',
+                                namespaces=GSML_NAMESPACES)
+        table = extract_table(self.queries, namespaces=GSML_NAMESPACES,
+                              where={'age': 'Devonian'})
+        self.assertEqual(list(table.index), ['gu.granite', 'gu.sandstone'])
+        table = extract_table(dict(self.queries), namespaces=GSML_NAMESPACES,
+                              keys=['gu.basalt'])
+        self.assertEqual(list(table.index), ['gu.basalt'])
+        self.assertEqual(len(extract_table(self.queries,
+                                           namespaces=GSML_NAMESPACES,
+                                           type='gsml:Borehole')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+""" file:   test_partition.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Thursday 11 September, 2014
+
+    description: Tests for spatially partitioned feature stores
+"""
+
+from pysiss.coverage import FeatureStore, PartitionedFeatureStore
+from pysiss.metadata import MetadataRegistry
+from pysiss.vocabulary.unmarshal import unmarshal_all
+from shapely.geometry import box
+from tests.helpers import make_feature, random_features
+import os
+import shutil
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FEATURES_FILE = os.path.join(TEST_DIR, 'geosciml', 'mappedfeatures.xml')
+
+
+def count_features(store):
+    """ Count the features in a tile (used in worker processes)
+    """
+    return len(store)
+
+
+class TestPartitionedFeatureStore(unittest.TestCase):
+
+    """ Tests for PartitionedFeatureStore
+    """
+
+    def setUp(self):
+        MetadataRegistry().clear()
+        self.tmpdir = tempfile.mkdtemp()
+        self.features = random_features(300)
+        self.store = PartitionedFeatureStore.create(
+            os.path.join(self.tmpdir, 'random'), iter(self.features),
+            tile_size=(25, 25), batch_size=70)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def brute_force(self, bounds):
+        query = box(*bounds)
+        return sorted(f.ident for f in self.features
+                      if box(*f.shape.bounds).intersects(query))
+
+    def test_tiles(self):
+        """ Features should be split across the tile grid
+        """
+        store = PartitionedFeatureStore(os.path.join(self.tmpdir, 'random'))
+        self.assertEqual(len(store), 300)
+        self.assertTrue(16 <= len(store.tiles) <= 25)
+        self.assertTrue(all(0 <= col < 5 and 0 <= row < 5
+                            for col, row in store.tiles))
+        self.assertEqual(store.tiles_for((0, 0, 10, 10)), [(0, 0)])
+        tile = store.read_tile((0, 0))
+        self.assertTrue(((tile.bounds[:, :2] + tile.bounds[:, 2:]) / 2
+                         < 25).all())
+
+    def test_query(self):
+        """ Queries should find every intersecting feature, including those
+            spilling over tile edges
+        """
+        for bounds in ((24, 24, 26, 26), (0, 0, 100, 100), (-5, -5, -1, -1),
+                       (60, 10, 61, 90)):
+            result = self.store.query(bounds)
+            self.assertEqual(sorted(result.idents), self.brute_force(bounds))
+        result = self.store.query((24, 24, 26, 26))
+        for idx, ident in enumerate(result.idents):
+            original = self.features[int(ident[1:])]
+            self.assertTrue(result.shape(idx).equals(original.shape))
+            self.assertEqual(result.projections[idx], 'EPSG:3577')
+
+    def test_map_tiles(self):
+        """ Tile-parallel operations should cover every feature
+        """
+        for processes in (1, 2):
+            counts = self.store.map_tiles(count_features,
+                                          processes=processes)
+            self.assertEqual(sorted(counts.keys()), self.store.tiles)
+            self.assertEqual(sum(counts.values()), 300)
+        counts = self.store.map_tiles(count_features, bounds=(0, 0, 10, 10),
+                                      processes=1)
+        self.assertEqual(counts.keys(), [(0, 0)])
+
+    def test_metadata(self):
+        """ Metadata records should be stored and registered on opening
+        """
+        features = unmarshal_all(FEATURES_FILE)
+        path = os.path.join(self.tmpdir, 'mapped')
+        PartitionedFeatureStore.create(path, features, tile_size=(2, 2))
+        MetadataRegistry().clear()
+        store = PartitionedFeatureStore(path)
+        self.assertEqual(sorted(MetadataRegistry().keys()),
+                         ['gu.basalt', 'gu.granite', 'gu.sandstone'])
+        result = store.query((2.5, 0.5, 2.6, 0.6))
+        self.assertEqual(list(result.idents), ['mf.3'])
+        self.assertEqual(result[0].metadata.ident, 'gu.granite')
+
+    def test_from_store(self):
+        """ We should be able to partition a FeatureStore
+        """
+        path = os.path.join(self.tmpdir, 'from_store')
+        store = PartitionedFeatureStore.create(
+            path, FeatureStore.from_features(self.features),
+            tile_size=(50, 50), origin=(-10, -10), batch_size=100)
+        self.assertEqual(len(store), 300)
+        self.assertEqual(sorted(store.query((0, 0, 100, 100)).idents),
+                         sorted(f.ident for f in self.features))
+
+    def test_recreate(self):
+        """ Re-creating a store should replace all the old features
+        """
+        path = os.path.join(self.tmpdir, 'random')
+        store = PartitionedFeatureStore.create(
+            path, self.features[:2], tile_size=(25, 25))
+        self.assertEqual(len(store), 2)
+        idents = sorted(f.ident for f in self.features[:2])
+        self.assertEqual(sorted(store.query((0, 0, 100, 100)).idents),
+                         idents)
+        self.assertEqual(sum(len(store.read_tile(tile))
+                             for tile in store.tiles), 2)
+        counts = store.map_tiles(count_features, processes=1)
+        self.assertEqual(sum(counts.values()), 2)
+
+    def test_no_specification(self):
+        """ Features without specifications should read back as None
+        """
+        features = random_features(3)
+        features.append(make_feature('f_none', box(1, 1, 2, 2),
+                                     projection='EPSG:3577'))
+        path = os.path.join(self.tmpdir, 'none')
+        PartitionedFeatureStore.create(path, features, tile_size=(50, 50))
+        store = PartitionedFeatureStore(path)
+        result = store.query((0, 0, 100, 100))
+        specifications = dict(zip(result.idents, result.specifications))
+        self.assertTrue(specifications['f_none'] is None)
+        self.assertEqual(specifications['f0'], 'gu.test')
+
+
+if __name__ == '__main__':
+    unittest.main()
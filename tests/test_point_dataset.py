@@ -0,0 +1,206 @@
+""" file:   test_point_dataset.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Tuesday 16 September, 2014
+
+    description: Tests for PointDataSet resampling
+"""
+
+from pysiss import borehole as pybh
+from scipy.interpolate import InterpolatedUnivariateSpline as Spline
+import numpy
+import unittest
+
+DENSITY = pybh.PropertyType('density')
+
+
+def brute_force_nearest(depths, new_depths):
+    """ Nearest neighbours by comparing every pair of depths
+    """
+    return numpy.argmin((depths - new_depths[:, numpy.newaxis]) ** 2,
+                        axis=-1)
+
+
+def reference_fill(dataset, new_depths, resampled, values, fill_method):
+    """ Fill gaps one at a time, as a check on the vectorised version
+    """
+    inside = lambda depths, (start, end): numpy.flatnonzero(
+        (depths >= start) & (depths <= end))
+    gap_idxs = [inside(new_depths, gap) for gap in dataset.gaps]
+    sdom_idxs = [inside(dataset.depths, sdom)
+                 for sdom in dataset.subdatasets]
+    result = resampled.copy()
+    for gap, (gidx, sidxa, sidxb) in enumerate(zip(gap_idxs, sdom_idxs[:-1],
+                                                   sdom_idxs[1:])):
+        if fill_method == 'mean':
+            result[gidx] = values.mean()
+        elif fill_method == 'median':
+            result[gidx] = numpy.median(values)
+        elif fill_method == 'local mean':
+            result[gidx] = (values[sidxa].mean() + values[sidxb].mean()) / 2.
+        elif fill_method == 'local median':
+            result[gidx] = numpy.median(numpy.concatenate(
+                [values[sidxa], values[sidxb]]))
+    return result
+
+
+class TestPointDataSet(unittest.TestCase):
+
+    """ Tests for PointDataSet
+    """
+
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        self.depths = numpy.cumsum(rng.uniform(0.5, 1.5, 200))
+        self.values = rng.normal(size=200)
+        self.dataset = pybh.PointDataSet('test', self.depths)
+        self.dataset.add_property(DENSITY, self.values)
+        self.dataset.split_at_gaps()
+
+    def test_resample_nearest(self):
+        """ Nearest neighbour resampling should match a brute force search
+        """
+        new_depths = numpy.linspace(-5, self.depths[-1] + 5, 1000)
+        result = self.dataset.resample(new_depths, fill_method='interpolate')
+        expected = self.values[brute_force_nearest(self.depths, new_depths)]
+        self.assertTrue(numpy.allclose(result.depths, new_depths))
+        self.assertTrue(numpy.allclose(
+            result.properties['density'].values, expected))
+
+    def test_regularize_nearest(self):
+        """ Nearest neighbour regularization should match a brute force
+            search
+        """
+        result = self.dataset.regularize(fill_method='interpolate')
+        expected = self.values[brute_force_nearest(self.depths,
+                                                   result.depths)]
+        self.assertTrue(numpy.allclose(
+            result.properties['density'].values, expected))
+        spacing = numpy.diff(result.depths)
+        self.assertTrue(numpy.allclose(spacing, spacing[0]))
+
+    def test_interpolate_properties(self):
+        """ Batched interpolation should match fitting each property
+        """
+        rng = numpy.random.RandomState(1)
+        for idx in range(5):
+            self.dataset.add_property(pybh.PropertyType('p{0}'.format(idx)),
+                                      rng.normal(size=200))
+        self.dataset.add_property(pybh.PropertyType('rock', isnumeric=False),
+                                  ['granite'] * 200)
+        new_depths = numpy.linspace(self.depths[0], self.depths[-1], 500)
+        for degree in (1, 3, 4):
+            props, values = self.dataset.interpolate_properties(new_depths,
+                                                                degree)
+            self.assertEqual(values.shape, (500, 6))
+            self.assertFalse('rock' in [prop.name for prop in props])
+            for prop, column in zip(props, values.T):
+                expected = Spline(self.depths, prop.values, k=degree)
+                self.assertTrue(numpy.allclose(column, expected(new_depths)))
+
+        result = self.dataset.resample(new_depths, degree=3,
+                                       fill_method='interpolate')
+        self.assertEqual(len(result.properties), 6)
+        self.assertTrue(numpy.allclose(
+            result.properties['p2'].values,
+            Spline(self.depths, self.dataset.properties['p2'].values,
+                   k=3)(new_depths)))
+
+    def test_fill_gaps(self):
+        """ Gap filling should match filling each gap separately
+        """
+        rng = numpy.random.RandomState(3)
+        spacing = rng.uniform(0.5, 1.5, 300)
+        spacing[[20, 21, 100, 101, 102, 250]] = 60
+        depths = numpy.cumsum(spacing)
+        dataset = pybh.PointDataSet('gappy', depths)
+        for idx in range(4):
+            dataset.add_property(pybh.PropertyType('p{0}'.format(idx)),
+                                 rng.normal(size=300))
+        dataset.split_at_gaps()
+        self.assertEqual(len(dataset.gaps), 6)
+        new_depths = numpy.linspace(depths[0], depths[-1], 2000)
+        raw = dataset.resample(new_depths, fill_method='interpolate')
+        for fill_method in ('mean', 'median', 'local mean', 'local median'):
+            result = dataset.resample(new_depths, fill_method=fill_method)
+            for name, prop in dataset.properties.items():
+                expected = reference_fill(
+                    dataset, new_depths, raw.properties[name].values,
+                    prop.values, fill_method)
+                self.assertTrue(numpy.allclose(
+                    result.properties[name].values, expected))
+        self.assertRaises(NotImplementedError, dataset.resample,
+                          new_depths, fill_method='magic')
+
+    def test_fill_gaps_nan(self):
+        """ A NaN sample should only affect the gaps next to its subdataset
+        """
+        spacing = numpy.ones(60)
+        spacing[[20, 40]] = 30
+        depths = numpy.cumsum(spacing)
+        values = numpy.linspace(0, 1, 60)
+        values[5] = numpy.nan
+        dataset = pybh.PointDataSet('gappy', depths)
+        dataset.add_property(pybh.PropertyType('p'), values)
+        dataset.split_at_gaps()
+        self.assertEqual(len(dataset.gaps), 2)
+        new_depths = numpy.linspace(depths[0], depths[-1], 500)
+        raw = dataset.resample(new_depths, fill_method='interpolate')
+        for fill_method in ('local mean', 'local median'):
+            result = dataset.resample(new_depths, fill_method=fill_method)
+            expected = reference_fill(
+                dataset, new_depths, raw.properties['p'].values, values,
+                fill_method)
+            later_gap = (new_depths > depths[39]) & (new_depths < depths[40])
+            self.assertTrue(later_gap.any())
+            self.assertFalse(numpy.isnan(
+                result.properties['p'].values[later_gap]).any())
+            self.assertTrue(numpy.allclose(
+                result.properties['p'].values[later_gap],
+                expected[later_gap]))
+
+            # Like numpy, a NaN in a neighbouring subdataset gives a NaN fill
+            first_gap = (new_depths > depths[19]) & (new_depths < depths[20])
+            self.assertTrue(first_gap.any())
+            self.assertTrue(numpy.isnan(
+                result.properties['p'].values[first_gap]).all())
+            self.assertTrue(numpy.isnan(expected[first_gap]).all())
+
+    def test_interval_indices(self):
+        """ Interval lookup should match a boolean scan
+        """
+        for from_depth, to_depth in ((10, 50), (self.depths[3],
+                                                self.depths[7]),
+                                     (-10, 1000), (300, 400), (50, 10)):
+            expected = numpy.flatnonzero((self.depths >= from_depth)
+                                         & (self.depths <= to_depth))
+            indices = self.dataset.get_interval_indices(from_depth, to_depth)
+            self.assertTrue(isinstance(indices, slice))
+            self.assertEqual(list(numpy.arange(200)[indices]),
+                             list(expected))
+
+    def test_interval_views(self):
+        """ Intervals should share memory with their parent unless copied
+        """
+        interval = self.dataset.get_interval(10, 50)
+        inside = (self.depths >= 10) & (self.depths <= 50)
+        self.assertTrue(numpy.allclose(interval.depths, self.depths[inside]))
+        values = interval.properties['density'].values
+        self.assertTrue(numpy.allclose(values, self.values[inside]))
+        self.assertTrue(numpy.may_share_memory(values, self.values))
+        self.assertTrue(numpy.may_share_memory(interval.depths, self.depths))
+        self.assertEqual(interval.size, inside.sum())
+
+        copied = self.dataset.get_interval(10, 50, copy=True)
+        self.assertFalse(numpy.may_share_memory(
+            copied.properties['density'].values, self.values))
+        self.assertTrue(numpy.allclose(copied.properties['density'].values,
+                                       values))
+
+        # Single samples are fine too
+        single = self.dataset.get_interval(self.depths[5], self.depths[5])
+        self.assertEqual(list(single.depths), [self.depths[5]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+""" file:   test_projection.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Thursday 4 September, 2014
+
+    description: Tests for reprojecting coordinates and features
+"""
+
+from pysiss.utilities.projection import project, transform, \
+    normalize_projection, get_transformer
+from pysiss.coverage import FeatureCollection, FeatureStore
+from pysiss.coverage.vector import reproject_features
+from pysiss.metadata import MetadataRegistry
+from pysiss.vocabulary.unmarshal import unmarshal_all
+from shapely.geometry import LineString
+import numpy
+import os
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FEATURES_FILE = os.path.join(TEST_DIR, 'geosciml', 'mappedfeatures.xml')
+
+
+class TestProjection(unittest.TestCase):
+
+    """ Tests for projection utilities
+    """
+
+    def test_normalize(self):
+        """ Common srsName forms should map to EPSG codes
+        """
+        for srs in (4326, 'EPSG:4326', 'epsg::4326',
+                    'urn:ogc:def:crs:EPSG::4326',
+                    'urn:ogc:def:crs:EPSG:6.6:4326',
+                    'http://www.opengis.net/gml/srs/epsg.xml#4326'):
+            self.assertEqual(normalize_projection(srs), 'EPSG:4326')
+        self.assertEqual(normalize_projection('+proj=longlat'),
+                         '+proj=longlat')
+
+    def test_transform(self):
+        """ Transforming should give known values, and round trip
+        """
+        coords = [(-121, 43), (-122, 42)]
+        projected = transform(coords, 4326, 26910)
+        numpy.testing.assert_allclose(projected[0],
+                                      (663019.07, 4762755.64), atol=0.01)
+        numpy.testing.assert_allclose(
+            transform(projected, 'EPSG:26910', 'EPSG:4326'), coords)
+        self.assertTrue(get_transformer(4326, 26910)
+                        is get_transformer('EPSG:4326', 'EPSG:26910'))
+
+    def test_project(self):
+        """ Projecting a geometry should transform each vertex
+        """
+        line = LineString([(-121, 43), (-122, 42)])
+        projected = project(line, to_projection=26910)
+        numpy.testing.assert_allclose(projected.coords,
+                                      transform(line.coords, 4326, 26910))
+
+
+class TestReprojectFeatures(unittest.TestCase):
+
+    """ Tests for reprojecting MappedFeatures
+    """
+
+    def setUp(self):
+        MetadataRegistry().clear()
+        self.features = unmarshal_all(FEATURES_FILE)
+        self.expected = [project(f.shape, 3577) for f in self.features]
+
+    def check(self, shapes):
+        for shape, expected in zip(shapes, self.expected):
+            numpy.testing.assert_allclose(shape.bounds, expected.bounds)
+            self.assertAlmostEqual(shape.area, expected.area, places=3)
+
+    def test_feature(self):
+        """ A single feature should be reprojected in place
+        """
+        feature = self.features[0]
+        feature.reproject('EPSG:3577')
+        self.assertEqual(feature.projection, 'EPSG:3577')
+        self.check([feature.shape])
+
+    def test_batch(self):
+        """ Reprojecting a batch should match reprojecting each feature
+        """
+        reproject_features(self.features, 3577)
+        self.assertEqual(set(f.projection for f in self.features),
+                         set([3577]))
+        self.check([f.shape for f in self.features])
+
+    def test_store(self):
+        """ Reprojecting a FeatureStore should give a new store
+        """
+        store = FeatureStore.from_features(self.features)
+        projected = store.reproject('EPSG:3577')
+        self.check([projected.shape(idx) for idx in range(len(projected))])
+        self.assertEqual(set(store.projections), set(['EPSG:4326']))
+
+    def test_collection(self):
+        """ The spatial index should follow a reprojected collection
+        """
+        coll = FeatureCollection(self.features)
+        coll.reproject(3577)
+        point = self.expected[3].representative_point()
+        self.assertEqual([f.ident for f in
+                          coll.spatial_index.containing(point)], ['mf.4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+""" file:   test_pyramid.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Wednesday 10 September, 2014
+
+    description: Tests for level-of-detail feature pyramids
+"""
+
+from pysiss.coverage import FeaturePyramid, FeatureStore
+from pysiss.coverage.vector import StoredFeature
+from shapely.geometry import Polygon
+import numpy
+import unittest
+
+
+def wiggly_features(number=20, vertices=500, seed=42):
+    """ Generate some noisy circles with lots of vertices
+    """
+    rng = numpy.random.RandomState(seed)
+    angles = numpy.linspace(0, 2 * numpy.pi, vertices, endpoint=False)
+    features = []
+    for idx in range(number):
+        radius = 1 + 0.05 * rng.standard_normal(vertices)
+        centre = (3 * (idx % 5), 3 * (idx // 5))
+        shape = Polygon(numpy.column_stack([
+            centre[0] + radius * numpy.cos(angles),
+            centre[1] + radius * numpy.sin(angles)]))
+        features.append(StoredFeature(
+            ident='f{0}'.format(idx), shape=shape.buffer(0),
+            specification='gu.test', projection='EPSG:3577'))
+    return features
+
+
+class TestFeaturePyramid(unittest.TestCase):
+
+    """ Tests for FeaturePyramid
+    """
+
+    def setUp(self):
+        self.features = wiggly_features()
+        self.pyramid = FeaturePyramid(self.features,
+                                      tolerances=[0.2, 0.01, 0.05])
+
+    def test_levels(self):
+        """ Coarser levels should have fewer vertices but stay within their
+            tolerance
+        """
+        self.assertEqual(self.pyramid.tolerances, [0, 0.01, 0.05, 0.2])
+        counts = self.pyramid.vertex_counts()
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertTrue(counts[-1] < counts[0] / 10)
+        for tolerance, level in zip(self.pyramid.tolerances,
+                                    self.pyramid.levels):
+            self.assertEqual(len(level), len(self.features))
+            for idx, feature in enumerate(self.features):
+                shape = level.shape(idx)
+                self.assertTrue(shape.is_valid)
+                self.assertTrue(
+                    shape.hausdorff_distance(feature.shape)
+                    <= tolerance + 1e-9)
+
+    def test_level_for(self):
+        """ We should get the coarsest level within the tolerance
+        """
+        self.assertEqual(self.pyramid.level_for(0), 0)
+        self.assertEqual(self.pyramid.level_for(0.005), 0)
+        self.assertEqual(self.pyramid.level_for(0.01), 1)
+        self.assertEqual(self.pyramid.level_for(0.1), 2)
+        self.assertEqual(self.pyramid.level_for(10), 3)
+        self.assertTrue(self.pyramid.store(0.1) is self.pyramid.levels[2])
+
+    def test_query(self):
+        """ Queries should come from the right level
+        """
+        result = self.pyramid.query((-1, -1, 4, 1), tolerance=0.06)
+        self.assertEqual(list(result.idents), ['f0', 'f1'])
+        self.assertEqual(len(result.coords),
+                         len(self.pyramid.levels[2].take([0, 1]).coords))
+        self.assertEqual(len(self.pyramid.query((100, 100, 101, 101))), 0)
+
+    def test_default_tolerances(self):
+        """ Default tolerances should scale with the extent
+        """
+        pyramid = FeaturePyramid(FeatureStore.from_features(self.features))
+        numpy.testing.assert_allclose(pyramid.tolerances,
+                                      [0, 1.4e-3, 1.4e-2, 1.4e-1], rtol=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+""" file:   test_raster.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Tuesday 9 September, 2014
+
+    description: Tests for memory-mapped raster coverages
+"""
+
+from pysiss.coverage.raster import RasterCoverage
+from pysiss.borehole import Borehole
+from pysiss.borehole.borehole import OriginPosition
+from pysiss.utilities import Collection
+import numpy
+import pint
+import shutil
+import tempfile
+import unittest
+
+
+class TestRasterCoverage(unittest.TestCase):
+
+    """ Tests for RasterCoverage
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rows, cols = numpy.mgrid[0:100, 0:70]
+        self.data = (rows * 1000 + cols).astype(float)
+        self.data[5, 5] = -9999
+        self.raster = RasterCoverage.create(
+            self.tmpdir + '/grid', self.data, origin=(100., -20.),
+            cell_size=(0.1, 0.1), projection='EPSG:4326', nodata=-9999,
+            tile_size=16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reopen(self):
+        """ A coverage should reopen from its manifest
+        """
+        raster = RasterCoverage(self.tmpdir + '/grid')
+        self.assertEqual(raster.shape, (100, 70))
+        self.assertEqual(raster.levels, 4)
+        numpy.testing.assert_allclose(raster.bounds, (100, -30, 107, -20))
+        numpy.testing.assert_array_equal(raster.read(), self.data)
+
+    def test_window(self):
+        """ Windowed reads should match slices of the grid, padding cells
+            outside the grid
+        """
+        numpy.testing.assert_array_equal(self.raster.read((10, 40, 3, 33)),
+                                         self.data[10:40, 3:33])
+        window = self.raster.read((-2, 3, 68, 72))
+        self.assertEqual(window.shape, (5, 4))
+        self.assertTrue((window[:2] == -9999).all())
+        numpy.testing.assert_array_equal(window[2:, :2], self.data[:3, 68:])
+        block, corner = self.raster.read_bounds((100.25, -20.55, 100.55,
+                                                 -20.25))
+        numpy.testing.assert_allclose(corner, (100.2, -20.2))
+        numpy.testing.assert_array_equal(block, self.data[2:6, 2:6])
+
+    def test_overviews(self):
+        """ Overviews should average blocks of cells, ignoring nodata
+        """
+        self.assertEqual(self.raster.level_shape(1), (50, 35))
+        overview = self.raster.read(level=1)
+        self.assertAlmostEqual(overview[0, 0], self.data[:2, :2].mean())
+        self.assertAlmostEqual(overview[2, 2],
+                               (4004 + 4005 + 5004) / 3.)
+        self.assertAlmostEqual(self.raster.read(level=3)[0, 1],
+                               self.data[:8, 8:16].mean())
+        self.assertEqual(self.raster.read(level=3).shape, (13, 9))
+        self.assertEqual(self.raster.choose_level(0.45), 2)
+        self.assertEqual(self.raster.choose_level(100), 3)
+        self.assertRaises(ValueError, self.raster.read, level=4)
+
+    def test_sample(self):
+        """ Sampling should look up the cell under each point
+        """
+        points = [(100.05, -20.05), (106.95, -29.95), (100.55, -20.55),
+                  (99, -25), (103.21, -21.37)]
+        numpy.testing.assert_array_equal(
+            self.raster.sample(points),
+            [0, 99069, numpy.nan, numpy.nan, 13032])
+        numpy.testing.assert_allclose(
+            self.raster.sample([(100.1, -20.1), (103.2, -21.35)],
+                               method='bilinear'),
+            [500.5, 13031.5])
+
+    def test_sample_boreholes(self):
+        """ We should be able to sample at borehole collars
+        """
+        ureg = pint.UnitRegistry()
+        boreholes = Collection([
+            Borehole('bh1', OriginPosition(latitude=-21.37 * ureg.degree,
+                                           longitude=103.21 * ureg.degree,
+                                           elevation=0 * ureg.meter)),
+            Borehole('bh2')])
+        numpy.testing.assert_array_equal(
+            self.raster.sample_boreholes(boreholes), [13032, numpy.nan])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+""" file:   test_spatial_index.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Wednesday 3 September, 2014
+
+    description: Tests for spatial indexes over MappedFeatures
+"""
+
+from pysiss.coverage import FeatureCollection, SpatialIndex
+from pysiss.metadata import MetadataRegistry
+from pysiss.vocabulary.unmarshal import unmarshal_all
+from shapely.geometry import Point, box
+from tests.helpers import make_feature, random_features
+import os
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FEATURES_FILE = os.path.join(TEST_DIR, 'geosciml', 'mappedfeatures.xml')
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    """ Tests for the STR-tree spatial index
+    """
+
+    def setUp(self):
+        self.features = random_features(500)
+        self.index = SpatialIndex(self.features, node_capacity=4)
+        self.boxes = [(10, 10, 20, 20), (50, 50, 50.5, 50.5),
+                      (-10, -10, -5, -5), (0, 0, 100, 100)]
+
+    def brute_force(self, features, bounds):
+        query = box(*bounds)
+        return sorted(f.ident for f in features if f.shape.intersects(query))
+
+    def idents(self, features):
+        return sorted(f.ident for f in features)
+
+    def test_query(self):
+        """ Bounding box queries should match a linear scan
+        """
+        for bounds in self.boxes:
+            self.assertEqual(self.idents(self.index.query(bounds)),
+                             self.brute_force(self.features, bounds))
+
+    def test_query_many(self):
+        """ Bulk queries should match individual queries
+        """
+        results = self.index.query_many(self.boxes)
+        self.assertEqual(len(results), len(self.boxes))
+        for bounds, result in zip(self.boxes, results):
+            self.assertEqual(self.idents(result),
+                             self.idents(self.index.query(bounds)))
+
+    def test_containing(self):
+        """ Point queries should only return features containing the point
+        """
+        points = [(15, 15), Point(50, 50), (-1, -1)]
+        for point, result in zip(points,
+                                 self.index.containing_many(points)):
+            point = point if isinstance(point, Point) else Point(*point)
+            self.assertEqual(
+                self.idents(result),
+                sorted(f.ident for f in self.features
+                       if f.shape.contains(point)))
+
+    def test_nearest(self):
+        """ Nearest queries should return features in order of distance
+        """
+        point = Point(-10, 50)
+        expected = sorted(self.features,
+                          key=lambda f: f.shape.distance(point))[:5]
+        result = self.index.nearest(point, k=5)
+        self.assertEqual([f.shape.distance(point) for f in result],
+                         [f.shape.distance(point) for f in expected])
+
+    def test_incremental(self):
+        """ Inserted and deleted features should show up in queries, before
+            and after the tree is repacked
+        """
+        index = SpatialIndex(self.features[:100], node_capacity=4,
+                             rebuild_fraction=1)
+        live = list(self.features[:100])
+        for feature in self.features[100:110]:
+            index.insert(feature)
+            live.append(feature)
+        for feature in live[:10]:
+            index.delete(feature.ident)
+        live = live[10:]
+        self.assertEqual(len(index), 100)
+        self.assertEqual(index.nearest((150, 150))[0].ident,
+                         min(live, key=lambda f: f.shape.distance(
+                             Point(150, 150))).ident)
+        for rebuild in (False, True):
+            if rebuild:
+                index.rebuild()
+            for bounds in self.boxes:
+                self.assertEqual(self.idents(index.query(bounds)),
+                                 self.brute_force(live, bounds))
+        self.assertRaises(KeyError, index.delete, 'f0')
+
+    def test_duplicate_batch(self):
+        """ The last of several features with the same ident in a batch
+            should win, as with repeated inserts
+        """
+        first = make_feature('a', box(0, 0, 1, 1))
+        second = make_feature('a', box(5, 5, 6, 6))
+        for bounds in (None, [first.shape.bounds, second.shape.bounds]):
+            index = SpatialIndex(node_capacity=4)
+            index.insert_many([first, second], bounds)
+            self.assertEqual(len(index), 1)
+            self.assertEqual(index.query((0, 0, 1, 1)), [])
+            self.assertEqual(index.query((5, 5, 6, 6)), [second])
+            index.rebuild()
+            self.assertEqual(index.query((0, 0, 1, 1)), [])
+            index.delete('a')
+            self.assertEqual(index.query((0, 0, 10, 10)), [])
+            index.rebuild()
+            self.assertEqual(index.query((0, 0, 10, 10)), [])
+
+
+class TestFeatureCollection(unittest.TestCase):
+
+    """ Tests for spatially indexed collections of MappedFeatures
+    """
+
+    def setUp(self):
+        MetadataRegistry().clear()
+        self.features = unmarshal_all(FEATURES_FILE)
+
+    def test_collection(self):
+        """ The spatial index should follow the collection
+        """
+        coll = FeatureCollection(self.features[:3])
+        point = self.features[3].shape.representative_point()
+        self.assertEqual(coll.spatial_index.containing(point), [])
+        coll.append(self.features[3])
+        self.assertEqual([f.ident for f in
+                          coll.spatial_index.containing(point)],
+                         ['mf.4'])
+        self.assertTrue(coll['mf.4'] is self.features[3])
+        del coll['mf.4']
+        self.assertEqual(coll.spatial_index.containing(point), [])
+        self.assertEqual(coll.keys(), ['mf.1', 'mf.2', 'mf.3'])
+        del coll[0]
+        self.assertEqual(coll.keys(), ['mf.2', 'mf.3'])
+        self.assertEqual(len(coll.spatial_index), 2)
+
+    def test_duplicate_idents(self):
+        """ Features with the same ident in one batch shouldn't break the
+            spatial index
+        """
+        first = make_feature('a', box(0, 0, 1, 1))
+        second = make_feature('a', box(5, 5, 6, 6))
+        coll = FeatureCollection([first, second])
+        self.assertEqual(len(coll), 1)
+        self.assertTrue(coll['a'] is second)
+        self.assertEqual(len(coll.spatial_index), 1)
+        self.assertEqual(coll.spatial_index.query((0, 0, 1, 1)), [])
+        coll.extend([first, first])
+        self.assertEqual(len(coll.spatial_index), 1)
+        self.assertEqual(coll.spatial_index.query((0, 0, 1, 1)), [first])
+
+
+if __name__ == '__main__':
+    unittest.main()
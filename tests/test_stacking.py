@@ -0,0 +1,111 @@
+""" file:   test_stacking.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Monday 15 September, 2014
+
+    description: Tests for stacking boreholes onto a common depth grid
+"""
+
+from pysiss import borehole as pybh
+from pysiss.borehole.analysis import stack_boreholes
+from pysiss.utilities import Collection
+import numpy
+import unittest
+
+IRON = pybh.PropertyType('Fe')
+SILICA = pybh.PropertyType('Si')
+ROCK = pybh.PropertyType('rock', isnumeric=False)
+
+
+class TestStackBoreholes(unittest.TestCase):
+
+    """ Tests for stack_boreholes
+    """
+
+    def setUp(self):
+        self.boreholes = Collection()
+        for idx in range(3):
+            borehole = pybh.Borehole('bh_{0}'.format(idx))
+            depths = numpy.arange(idx, 10. + idx)
+            dataset = borehole.add_point_dataset('assays', depths)
+            dataset.add_property(IRON, depths * 10)
+            dataset.add_property(ROCK, ['granite'] * len(depths))
+            if idx != 1:
+                dataset.add_property(SILICA, -depths)
+            self.boreholes.append(borehole)
+        self.depths = numpy.linspace(0, 12, 25)
+
+    def test_nearest(self):
+        """ Nearest neighbour stacking should match per-hole resampling
+        """
+        stack = stack_boreholes(self.boreholes, ['Fe', 'Si', 'rock'],
+                                self.depths)
+        self.assertEqual(stack.values.shape, (3, 25, 3))
+        self.assertEqual(stack.names, ['bh_0', 'bh_1', 'bh_2'])
+        for idx, borehole in enumerate(self.boreholes):
+            dataset = borehole.point_datasets['assays']
+            inside = (self.depths >= dataset.depths[0]) \
+                & (self.depths <= dataset.depths[-1])
+            nearest = numpy.argmin(
+                (dataset.depths - self.depths[:, numpy.newaxis]) ** 2,
+                axis=-1)
+            expected = dataset.properties['Fe'].values[nearest]
+            self.assertTrue(numpy.allclose(stack.values[idx, inside, 0],
+                                           expected[inside]))
+            self.assertTrue((stack.mask[idx, :, 0] == inside).all())
+
+        # Missing and non-numeric properties should be masked
+        self.assertFalse(stack.mask[1, :, 1].any())
+        self.assertTrue(stack.mask[2, :, 1].any())
+        self.assertFalse(stack.mask[:, :, 2].any())
+
+    def test_linear(self):
+        """ Linear stacking should interpolate between samples
+        """
+        stack = stack_boreholes(self.boreholes, ['Fe'], self.depths,
+                                dataset_name='assays', degree=1)
+        mask = stack.mask[:, :, 0]
+        depths = numpy.tile(self.depths, (3, 1))
+        self.assertTrue(numpy.allclose(stack.values[:, :, 0][mask],
+                                       depths[mask] * 10))
+        self.assertRaises(ValueError, stack_boreholes, self.boreholes,
+                          ['Fe'], self.depths, degree=3)
+
+    def test_matches_resample(self):
+        """ Stacked values should match resampling each dataset, gap fills
+            aside
+        """
+        rng = numpy.random.RandomState(2)
+        borehole = pybh.Borehole('noisy')
+        depths = numpy.cumsum(rng.uniform(0.5, 1.5, 40))
+        dataset = borehole.add_point_dataset('assays', depths)
+        dataset.add_property(IRON, rng.normal(size=40))
+        dataset.split_at_gaps()
+        grid = numpy.linspace(depths[0], depths[-1], 97)
+        for degree in (0, 1):
+            stack = stack_boreholes([borehole], ['Fe'], grid, degree=degree)
+            resampled = dataset.resample(grid, fill_method='interpolate',
+                                         degree=degree)
+            self.assertTrue(numpy.allclose(
+                stack.values[0, :, 0], resampled.properties['Fe'].values))
+
+    def test_gaps(self):
+        """ Grid depths in gaps should be masked
+        """
+        borehole = pybh.Borehole('gappy')
+        depths = numpy.concatenate([numpy.arange(0, 5, 0.5),
+                                    numpy.arange(50, 55, 0.5)])
+        dataset = borehole.add_point_dataset('assays', depths)
+        dataset.add_property(IRON, depths)
+        dataset.split_at_gaps()
+        grid = numpy.arange(0, 55, 1.)
+        stack = stack_boreholes([borehole], ['Fe'], grid)
+        # Gaps include their end points, as in PointDataSet.label_gaps
+        self.assertTrue((stack.mask[0, :, 0]
+                         == ((grid < 4.5) | (grid > 50))).all())
+        stack = stack_boreholes([borehole], ['Fe'], grid, mask_gaps=False)
+        self.assertTrue(stack.mask.all())
+
+
+if __name__ == '__main__':
+    unittest.main()
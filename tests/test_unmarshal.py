@@ -0,0 +1,258 @@
+""" file:   test_unmarshal.py
+    author: Jess Robertson
+            CSIRO Minerals Resources Flagship
+    date:   Thursday 28 August, 2014
+
+    description: Tests for unmarshalling GeoSciML feature collections
+"""
+
+from pysiss.vocabulary.unmarshal import unmarshal_all, \
+    unmarshal_all_parallel, _feature_member_ranges, _release
+from pysiss.vocabulary.gsml import unmarshallers as gsml
+from pysiss.metadata import Metadata, MetadataRegistry, \
+    ScopedMetadataRegistry, metadata_scope
+from lxml import etree
+import os
+import shutil
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FEATURES_FILE = os.path.join(TEST_DIR, 'geosciml', 'mappedfeatures.xml')
+
+RECORD = (b'<gsml:GeologicUnit xmlns:gsml="urn:cgi:xmlns:CGI:GeoSciML:2.0" '
+          b'xmlns:gml="http://www.opengis.net/gml" gml:id="gu.spilled"/>')
+
+# Template for a feature with an inline specification
+FEATURE = """
+<gsml:MappedFeature xmlns:gsml="urn:cgi:xmlns:CGI:GeoSciML:2.0"
+    xmlns:gml="http://www.opengis.net/gml" gml:id="mf.{0}">
+  <gsml:specification>
+    <gsml:GeologicUnit gml:id="gu.{0}">
+      <gml:name>{1}</gml:name>
+    </gsml:GeologicUnit>
+  </gsml:specification>
+  <gsml:shape>
+    <gml:LineString srsName="EPSG:4326">
+      <gml:posList>
+0.0 0.0
+1.0 1.0
+      </gml:posList>
+    </gml:LineString>
+  </gsml:shape>
+</gsml:MappedFeature>
+"""
+
+
+class TestParallelUnmarshal(unittest.TestCase):
+
+    """ Tests for unmarshalling feature collections with a process pool
+    """
+
+    def setUp(self):
+        self.registry = MetadataRegistry()
+        self.registry.clear()
+
+    def test_ranges(self):
+        """ Byte ranges should be contiguous and cover every featureMember
+        """
+        header_end, footer_start, chunks = \
+            _feature_member_ranges(FEATURES_FILE, 3)
+        self.assertEqual(chunks[0][0], header_end)
+        self.assertEqual(chunks[-1][1], footer_start)
+        for (_, stop), (start, _) in zip(chunks[:-1], chunks[1:]):
+            self.assertEqual(stop, start)
+        with open(FEATURES_FILE, 'rb') as fhandle:
+            data = fhandle.read()
+        for start, _ in chunks:
+            self.assertTrue(data[start:].startswith(b'<gml:featureMember'))
+
+    def test_matches_serial(self):
+        """ Parallel unmarshalling should match serial unmarshalling
+        """
+        serial = unmarshal_all(FEATURES_FILE)
+        serial_keys = sorted(self.registry.keys())
+        self.registry.clear()
+
+        parallel = unmarshal_all_parallel(FEATURES_FILE, processes=2,
+                                          chunks_per_process=2)
+        self.assertEqual(serial_keys, sorted(self.registry.keys()))
+        self.assertEqual([f.ident for f in serial],
+                         [f.ident for f in parallel])
+        for sfeature, pfeature in zip(serial, parallel):
+            self.assertTrue(sfeature.shape.equals(pfeature.shape))
+            self.assertEqual(sfeature.specification, pfeature.specification)
+            self.assertEqual(sfeature.type, pfeature.type)
+
+    def test_merged_metadata(self):
+        """ Merged metadata records should support XPath queries
+        """
+        unmarshal_all_parallel(FEATURES_FILE, processes=2)
+        names = self.registry['gu.basalt'].xpath(
+            './gml:name/text()',
+            namespaces={'gml': 'http://www.opengis.net/gml'})
+        self.assertEqual(names, ['Test Basalt'])
+
+    def test_spilling_scope(self):
+        """ Workers shouldn't touch the parent's spilled records
+        """
+        registry = ScopedMetadataRegistry(max_size=1)
+        try:
+            with metadata_scope(registry):
+                for idx in range(3):
+                    Metadata(ident='gu.spilled_{0}'.format(idx),
+                             tree=RECORD, type='gsml:GeologicUnit')
+                unmarshal_all_parallel(FEATURES_FILE, processes=2)
+            self.assertEqual(registry.resident, 1)
+            for idx in range(3):
+                self.assertEqual(registry['gu.spilled_{0}'.format(idx)].type,
+                                 'gsml:GeologicUnit')
+            self.assertEqual(registry['gu.basalt'].ident, 'gu.basalt')
+            self.assertEqual(len(registry), 6)
+        finally:
+            registry.close()
+
+
+class TestProjectedUnmarshal(unittest.TestCase):
+
+    """ Tests for unmarshalling selected fields only
+    """
+
+    def setUp(self):
+        self.registry = MetadataRegistry()
+        self.registry.clear()
+
+    def test_ident_shape(self):
+        """ Only the requested fields should be returned
+        """
+        data = unmarshal_all(FEATURES_FILE, fields=['ident', 'shape'])
+        self.assertEqual([d['ident'] for d in data],
+                         ['mf.1', 'mf.2', 'mf.3', 'mf.4', 'mf.5'])
+        self.assertEqual(sorted(data[0].keys()), ['ident', 'shape'])
+        self.assertEqual(data[2]['shape'].area, 0.75)
+        self.assertEqual(len(self.registry), 0)
+
+    def test_specification_keys(self):
+        """ Specification keys should be returned without registering
+            metadata
+        """
+        data = unmarshal_all(FEATURES_FILE,
+                             fields=['specification', 'projection'])
+        self.assertEqual(
+            [d['specification'] for d in data],
+            ['gu.granite', 'gu.basalt', 'gu.granite', 'gu.basalt',
+             'gu.sandstone'])
+        self.assertEqual(set(d['projection'] for d in data),
+                         set(['EPSG:4326']))
+        self.assertEqual(len(self.registry), 0)
+
+    def test_parallel(self):
+        """ Projection should work with the parallel loader
+        """
+        serial = unmarshal_all(FEATURES_FILE, fields=['ident'])
+        parallel = unmarshal_all_parallel(FEATURES_FILE, processes=2,
+                                          fields=['ident'])
+        self.assertEqual(serial, parallel)
+        self.assertEqual(len(self.registry), 0)
+
+    def test_release(self):
+        """ Elements should be detached from the document once they've been
+            read, along with everything before them
+        """
+        tree = etree.fromstring(
+            b'<root><head/><member><a/><b><c/></b></member>'
+            b'<member><a/><b><c/></b></member><tail/></root>')
+        target = tree[2][1]
+        _release(target)
+        self.assertEqual([child.tag for child in tree], ['member', 'tail'])
+        self.assertEqual([child.tag for child in tree[0]], ['b'])
+        self.assertEqual(len(target), 0)
+
+    def test_projected_large(self):
+        """ Projected loads should still see every feature when finished
+            elements are released
+        """
+        path = os.path.join(tempfile.mkdtemp(), 'many.xml')
+        try:
+            with open(path, 'w') as fhandle:
+                fhandle.write(
+                    '<gml:FeatureCollection '
+                    'xmlns:gml="http://www.opengis.net/gml">')
+                for idx in range(200):
+                    fhandle.write('<gml:featureMember>{0}'
+                                  '</gml:featureMember>'.format(
+                                      FEATURE.format(idx, 'unit')))
+                fhandle.write('</gml:FeatureCollection>')
+            data = unmarshal_all(path, fields=['ident', 'specification'])
+            self.assertEqual([d['ident'] for d in data],
+                             ['mf.{0}'.format(idx) for idx in range(200)])
+            self.assertEqual(data[-1]['specification'], 'gu.199')
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    def test_unknown_field(self):
+        """ Unknown fields should raise a ValueError
+        """
+        self.assertRaises(ValueError, unmarshal_all, FEATURES_FILE,
+                          fields=['ident', 'lithology'])
+        self.assertRaises(ValueError, unmarshal_all, FEATURES_FILE,
+                          tag='gml:Polygon', fields=['ident'])
+
+
+class TestSpecificationDeduplication(unittest.TestCase):
+
+    """ Tests for sharing identical inline specifications
+    """
+
+    def setUp(self):
+        self.registry = MetadataRegistry()
+        self.registry.clear()
+
+    def unmarshal(self, idx, name):
+        return gsml.mapped_feature(etree.fromstring(FEATURE.format(idx, name)))
+
+    def test_shared(self):
+        """ Identical specifications should share one record
+        """
+        features = [self.unmarshal(idx, 'Granite') for idx in range(3)]
+        self.assertEqual(set(f.specification for f in features),
+                         set(['gu.0']))
+        self.assertTrue(self.registry['gu.2'] is self.registry['gu.0'])
+        self.assertEqual(len(set(map(id, self.registry.values()))), 1)
+
+    def test_different(self):
+        """ Different specifications should get their own records
+        """
+        first = self.unmarshal(0, 'Granite')
+        second = self.unmarshal(1, 'Basalt')
+        self.assertEqual(first.specification, 'gu.0')
+        self.assertEqual(second.specification, 'gu.1')
+        self.assertFalse(self.registry['gu.0'] is self.registry['gu.1'])
+
+    def test_digest_ignores_ids(self):
+        """ Digests should ignore gml:ids but not content
+        """
+        first = etree.fromstring(FEATURE.format(0, 'Granite'))
+        second = etree.fromstring(FEATURE.format(1, 'Granite'))
+        third = etree.fromstring(FEATURE.format(1, 'Basalt'))
+        self.assertEqual(gsml.canonical_digest(first),
+                         gsml.canonical_digest(second))
+        self.assertNotEqual(gsml.canonical_digest(first),
+                            gsml.canonical_digest(third))
+        self.assertEqual(first.get('{http://www.opengis.net/gml}id'), 'mf.0')
+
+    def test_disabled(self):
+        """ Deduplication can be switched off
+        """
+        gsml.DEDUPLICATE_SPECIFICATIONS = False
+        try:
+            features = [self.unmarshal(idx, 'Granite') for idx in range(2)]
+        finally:
+            gsml.DEDUPLICATE_SPECIFICATIONS = True
+        self.assertEqual([f.specification for f in features],
+                         ['gu.0', 'gu.1'])
+        self.assertFalse(self.registry['gu.0'] is self.registry['gu.1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
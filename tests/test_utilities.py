@@ -8,7 +8,9 @@
 
 import unittest
 import numpy
-from pysiss.utilities import mask_all_nans
+from pysiss.utilities import mask_all_nans, nearest_indices, \
+    interpolate_columns, from_bytes, to_bytes, to_native, to_text
+import uuid
 
 
 class TestMaskNans(unittest.TestCase):
@@ -32,3 +34,72 @@ class TestMaskNans(unittest.TestCase):
         self.assertRaises(ValueError, mask_all_nans,
                           "i'm a string",
                           range(10))
+
+
+class TestInterpolation(unittest.TestCase):
+
+    """ Tests for the interpolation kernels
+    """
+
+    def test_nearest_indices(self):
+        "Nearest indices should match a brute force search"
+        points = numpy.sort(numpy.random.uniform(0, 10, 200))
+        new_points = numpy.linspace(-1, 11, 1000)
+        expected = numpy.argmin(
+            (points - new_points[:, numpy.newaxis]) ** 2, axis=-1)
+        self.assertTrue((nearest_indices(points, new_points)
+                         == expected).all())
+        self.assertEqual(list(nearest_indices([0., 1.], [0.5, 0.51])),
+                         [0, 1])
+
+    def test_interpolate_columns(self):
+        "Linear interpolation should match numpy.interp for every column"
+        points = numpy.sort(numpy.random.uniform(0, 10, 50))
+        values = numpy.random.normal(size=(50, 3))
+        new_points = numpy.linspace(-1, 11, 300)
+        result = interpolate_columns(points, values, new_points)
+        for col in range(3):
+            self.assertTrue(numpy.allclose(
+                result[:, col],
+                numpy.interp(new_points, points, values[:, col])))
+        self.assertRaises(ValueError, interpolate_columns, points, values,
+                          new_points, degree=2)
+
+    def test_extrapolate(self):
+        "Extrapolation should extend the end segments"
+        points = numpy.array([0., 1., 3.])
+        values = numpy.array([[0., 1.], [1., 1.], [5., 0.]])
+        result = interpolate_columns(points, values, [-1, 2, 4],
+                                     extrapolate=True)
+        self.assertTrue(numpy.allclose(result,
+                                       [[-1, 1], [3, 0.5], [7, -0.5]]))
+        result = interpolate_columns(points, values, [-1, 4])
+        self.assertTrue(numpy.allclose(result, [[0, 1], [5, 0]]))
+
+
+class TestStrings(unittest.TestCase):
+
+    """ Testing conversions to and from on-disk strings
+    """
+
+    def test_round_trip(self):
+        "Strings should survive being stored as bytes"
+        for value in ('gu.granite', u'gu.gr\xe4nite'.encode('utf-8')):
+            self.assertEqual(from_bytes(to_bytes(value)), value)
+        self.assertEqual(to_bytes(u'gu.gr\xe4nite'),
+                         u'gu.gr\xe4nite'.encode('utf-8'))
+
+    def test_keys(self):
+        "UUID keys should be stored as their string form"
+        key = uuid.uuid4()
+        self.assertEqual(to_text(key), str(key))
+        self.assertEqual(to_bytes(key), str(key))
+        self.assertEqual(to_text(u'gu.granite'), u'gu.granite')
+        self.assertTrue(to_text(None) is None)
+
+    def test_native(self):
+        "JSON unicode should become native strings where possible"
+        result = to_native({u'name': [u'a', u'\xe4', 1.5]})
+        self.assertEqual(result, {'name': ['a', u'\xe4', 1.5]})
+        self.assertTrue(type(result.keys()[0]) is str)
+        self.assertTrue(type(result['name'][0]) is str)
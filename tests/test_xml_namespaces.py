@@ -1,6 +1,9 @@
+import os
+import subprocess
+import sys
 import unittest
 from pysiss.vocabulary.namespaces import split_namespace, \
-    shorten_namespace, expand_namespace
+    shorten_namespace, expand_namespace, NamespaceRegistry
 
 
 class TestXMLNamespaces(unittest.TestCase):
@@ -40,5 +43,28 @@ class TestXMLNamespaces(unittest.TestCase):
             'urn:cgi:xmlns:CGI:GeoSciML:2.0:MappedFeature')
 
 
+class TestNamespaceRegistry(unittest.TestCase):
+
+    """ Tests for loading the namespace registry
+    """
+
+    def test_defaults(self):
+        """ Default namespaces should be loaded into the registry
+        """
+        registry = NamespaceRegistry()
+        self.assertEqual(registry['gml'], 'http://www.opengis.net/gml')
+        self.assertEqual(registry.inverse['http://www.opengis.net/gml'],
+                         'gml')
+
+    def test_no_pkg_resources(self):
+        """ Importing the namespaces module shouldn't import pkg_resources
+        """
+        root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        script = ('import sys; import pysiss.vocabulary.namespaces; '
+                  'sys.exit(int("pkg_resources" in sys.modules))')
+        self.assertEqual(
+            subprocess.call([sys.executable, '-c', script], cwd=root), 0)
+
+
 if __name__ == '__main__':
     unittest.main()